@@ -1,6 +1,44 @@
 from django.contrib import admin
-from .models import Project, Channel, Event
 
-admin.site.register(Project)
-admin.site.register(Channel)
+from .models import ArchiveSegment, Project, Channel, Event, EventRollup
+from .retention import delete_channel, delete_project
+
+
+class ChunkedDeleteAdmin(admin.ModelAdmin):
+    """Delete events in chunks instead of collecting them for the cascade"""
+
+    def get_deleted_objects(self, objs, request):
+        # the confirmation page counts events from the counters instead of listing them
+        objs = list(objs)
+        events = sum(obj.event_count for obj in objs)
+        perms_needed = set()
+        if events and not request.user.has_perm("api.delete_event"):
+            perms_needed.add(Event._meta.verbose_name)
+        model_count = {self.model._meta.verbose_name_plural: len(objs)}
+        if events:
+            model_count[Event._meta.verbose_name_plural] = events
+        return [str(obj) for obj in objs], model_count, perms_needed, []
+
+    def delete_model(self, request, obj) -> None:
+        self.delete_chunked(obj)
+
+    def delete_queryset(self, request, queryset) -> None:
+        for obj in queryset:
+            self.delete_chunked(obj)
+
+
+class ProjectAdmin(ChunkedDeleteAdmin):
+    def delete_chunked(self, obj: Project) -> None:
+        delete_project(obj)
+
+
+class ChannelAdmin(ChunkedDeleteAdmin):
+    def delete_chunked(self, obj: Channel) -> None:
+        delete_channel(obj)
+
+
+admin.site.register(Project, ProjectAdmin)
+admin.site.register(Channel, ChannelAdmin)
 admin.site.register(Event)
+admin.site.register(EventRollup)
+admin.site.register(ArchiveSegment)
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self) -> None:
+        # register the cache invalidation, counter, archive, version and sql timing signal receivers
+        from . import (  # noqa: F401
+            archive,
+            authentication,
+            cache,
+            counters,
+            metrics,
+            ratelimit,
+            recent,
+            rules,
+            versions,
+        )
@@ -0,0 +1,302 @@
+"""
+Copy Cat Archive
+================
+
+Cold events are moved out of the Event table into compressed segment
+files under the ARCHIVE_DIR setting, partitioned by channel and month.
+A segment holds at most ARCHIVE_SEGMENT_SIZE events as gzipped json
+lines in (created_at, id) order, and an ArchiveSegment row records its
+channel, created_at range, event count and size. The file is written
+before the row is created and the events are deleted in the same
+transaction as the row, so an interrupted run leaves at worst an orphaned
+file.
+
+The event listings of users, projects and channels and the channel export
+merge archived rows with the hot rows. Segments outside the requested
+range are skipped without being opened, and decoded segments stay in a
+small LRU cache so paging through one decompresses it once. Archived
+events still count in the project and channel counters. Search only sees
+the hot table, its responses count the archived events it left out.
+"""
+import gzip
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time
+from functools import lru_cache
+from heapq import merge
+from itertools import islice
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ParseError
+
+from .conf import get_setting
+from .counters import remove_counts
+from .models import ArchiveSegment, Channel, Event, Project
+from .recent import recent_events
+from .serializers import EVENT_FIELDS
+from .versions import bump
+
+CREATED_AT = EVENT_FIELDS.index("created_at")
+ID = EVENT_FIELDS.index("id")
+# ids deleted per statement, well under the sqlite bound parameter limit
+DELETE_BATCH_SIZE = 500
+
+
+def archive_dir() -> Path:
+    return Path(get_setting("ARCHIVE_DIR") or Path(settings.BASE_DIR) / "archive")
+
+
+def row_key(row) -> tuple:
+    return row[CREATED_AT], row[ID]
+
+
+def parse_bound(value: Optional[str]) -> Optional[datetime]:
+    """Parse a start or end query parameter the way a created_at filter reads it
+
+    Args:
+        value (Optional[str]): date or datetime, if any
+
+    Raises:
+        ParseError: the value is not a date or datetime
+
+    Returns:
+        Optional[datetime]: aware datetime, dates at midnight
+    """
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, time.min) if day is not None else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ParseError({"message": "Invalid start or end date."})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def write_segment(channel: Channel, rows: list) -> ArchiveSegment:
+    """Write rows to a new segment file
+
+    Args:
+        channel (Channel): channel the rows belong to
+        rows (list): EVENT_FIELDS rows of one month, in (created_at, id) order
+
+    Returns:
+        ArchiveSegment: unsaved segment describing the file
+    """
+    first = rows[0]
+    relative = Path(
+        str(channel.id),
+        f"{first[CREATED_AT]:%Y-%m}",
+        f"{first[CREATED_AT]:%Y%m%dT%H%M%S%f}-{first[ID]}.jsonl.gz",
+    )
+    path = archive_dir() / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix(".tmp")
+    with open(temp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as out:
+            # the header lets segments outlive changes to EVENT_FIELDS
+            out.write(json.dumps({"fields": EVENT_FIELDS}).encode() + b"\n")
+            for row in rows:
+                row = list(row)
+                row[CREATED_AT] = row[CREATED_AT].isoformat()
+                out.write(json.dumps(row, ensure_ascii=False).encode() + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(temp, path)
+    return ArchiveSegment(
+        channel_id_id=channel.id,
+        path=str(relative),
+        min_created_at=first[CREATED_AT],
+        max_created_at=rows[-1][CREATED_AT],
+        count=len(rows),
+        size=path.stat().st_size,
+    )
+
+
+@lru_cache(maxsize=get_setting("ARCHIVE_CACHE_SIZE"))
+def read_segment(path: str) -> tuple:
+    """Decode a segment file, cached since segment files never change
+
+    Args:
+        path (str): path of the segment relative to the archive directory
+
+    Returns:
+        tuple: ((created_at, id) keys, EVENT_FIELDS rows), both in key order
+    """
+    with gzip.open(archive_dir() / path, "rt", encoding="utf-8") as lines:
+        fields = json.loads(next(lines))["fields"]
+        positions = [fields.index(name) if name in fields else None for name in EVENT_FIELDS]
+        rows = []
+        for line in lines:
+            values = json.loads(line)
+            row = [None if position is None else values[position] for position in positions]
+            row[CREATED_AT] = datetime.fromisoformat(row[CREATED_AT])
+            rows.append(tuple(row))
+    return [row_key(row) for row in rows], rows
+
+
+def archive_channel(channel: Channel, cutoff: datetime, segment_size: Optional[int] = None) -> int:
+    """Move the events of a channel created before a cutoff into segments
+
+    Args:
+        channel (Channel): channel to archive
+        cutoff (datetime): events created before this are archived
+        segment_size (int, optional): most events per segment
+
+    Returns:
+        int: number of archived events
+    """
+    segment_size = segment_size or get_setting("ARCHIVE_SEGMENT_SIZE")
+    events = Event.objects.filter(
+        user=channel.user_id, channel_id=channel.id, created_at__lt=cutoff
+    ).order_by("created_at", "id")
+    archived = 0
+    while True:
+        # every pass takes the oldest hot rows, so a run can stop and resume anywhere
+        rows = list(events.values_list(*EVENT_FIELDS)[:segment_size])
+        if not rows:
+            return archived
+        # a segment never spans two months
+        month = f"{rows[0][CREATED_AT]:%Y-%m}"
+        rows = [row for row in rows if f"{row[CREATED_AT]:%Y-%m}" == month]
+
+        segment = write_segment(channel, rows)
+        ids = [row[ID] for row in rows]
+        with transaction.atomic():
+            segment.save()
+            for offset in range(0, len(ids), DELETE_BATCH_SIZE):
+                Event.objects.filter(id__in=ids[offset : offset + DELETE_BATCH_SIZE]).delete()
+            # the events moved, so cached listings and their etags are stale
+            bump(Channel, [channel.id])
+            bump(Project, [channel.project_id_id])
+        recent_events.invalidate([channel.id])
+        archived += len(rows)
+
+
+def delete_segments(segments) -> int:
+    """Delete segments and take their events off the project and channel counters
+
+    Args:
+        segments (QuerySet): segments to delete
+
+    Returns:
+        int: number of events in the deleted segments
+    """
+    with transaction.atomic():
+        channels = dict(
+            segments.values_list("channel_id").annotate(count=Sum("count")).order_by()
+        )
+        projects = {}
+        for channel_id, project_id in Channel.objects.filter(id__in=channels).values_list(
+            "id", "project_id"
+        ):
+            projects[project_id] = projects.get(project_id, 0) + channels[channel_id]
+        segments.delete()
+        remove_counts(Channel, channels)
+        remove_counts(Project, projects)
+    recent_events.invalidate(channels)
+    return sum(channels.values())
+
+
+@receiver(post_delete, sender=ArchiveSegment)
+def remove_segment_file(sender, instance: ArchiveSegment, **kwargs) -> None:
+    path = archive_dir() / instance.path
+    transaction.on_commit(lambda: path.unlink(missing_ok=True))
+
+
+class ArchiveReader:
+    """Archived rows within a created_at range, in (created_at, id) order
+
+    The rows are those of a channel, or of every channel of a project or of
+    a user when project_id or user_id is given instead.
+    """
+
+    def __init__(
+        self,
+        channel_id: Optional[int] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        project_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+    ) -> None:
+        if channel_id is not None:
+            self.scope = {"channel_id": channel_id}
+        elif project_id is not None:
+            self.scope = {"channel_id__project_id": project_id}
+        else:
+            self.scope = {"channel_id__user": user_id}
+        self.start = parse_bound(start)
+        self.end = parse_bound(end)
+
+    def merge(self, rows: list, after: Optional[tuple], count: int) -> list:
+        """Merge a page of hot rows with the archived rows that belong on it
+
+        Args:
+            rows (list): hot EVENT_FIELDS rows in (created_at, id) order
+            after (Optional[tuple]): (created_at, id) of the last row on the previous page
+            count (int): number of rows wanted
+
+        Returns:
+            list: the first count rows of both, in (created_at, id) order
+        """
+        return list(islice(merge(rows, self.rows(after), key=row_key), count))
+
+    def in_range(self, after: Optional[tuple] = None):
+        segments = ArchiveSegment.objects.filter(**self.scope)
+        lower = self.start
+        if after is not None and (lower is None or after[0] > lower):
+            lower = after[0]
+        if lower is not None:
+            segments = segments.filter(max_created_at__gte=lower)
+        if self.end is not None:
+            segments = segments.filter(min_created_at__lte=self.end)
+        return segments
+
+    def segments(self, after: Optional[tuple]) -> list:
+        segments = self.in_range(after)
+        return list(segments.order_by("min_created_at").only("path", "min_created_at", "max_created_at"))
+
+    def count(self) -> int:
+        """Count the events of the segments overlapping the range, without opening them"""
+        return self.in_range().aggregate(count=Sum("count"))["count"] or 0
+
+    def rows(self, after: Optional[tuple] = None):
+        """Yield archived rows after a position
+
+        Segments that overlap in time are merged, the others are read one
+        after the other, so a page only opens the segments it reaches.
+        """
+        group = []
+        group_end = None
+        for segment in self.segments(after):
+            if group and segment.min_created_at > group_end:
+                yield from merge(*(self.segment_rows(s, after) for s in group), key=row_key)
+                group = []
+            if not group or segment.max_created_at > group_end:
+                group_end = segment.max_created_at
+            group.append(segment)
+        if group:
+            yield from merge(*(self.segment_rows(s, after) for s in group), key=row_key)
+
+    def segment_rows(self, segment: ArchiveSegment, after: Optional[tuple]):
+        keys, rows = read_segment(segment.path)
+        low = 0 if self.start is None else bisect_left(keys, (self.start,))
+        if after is not None:
+            low = max(low, bisect_right(keys, after))
+        high = len(rows) if self.end is None else bisect_right(keys, (self.end, float("inf")))
+        for index in range(low, high):
+            yield rows[index]
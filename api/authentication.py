@@ -0,0 +1,151 @@
+"""
+Copy Cat Authentication
+=======================
+
+Token authentication that remembers token -> user lookups for a short
+while, so a warm request authenticates without a Token + User query. Entries
+are dropped as soon as the token is deleted (which is how tokens rotate) or
+the user is saved, for example when it is deactivated.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from .conf import get_setting
+
+
+class TokenCache:
+    """Bounded map of token key -> (user, token) with a TTL"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def set(self, key: str, user, token) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            # dicts keep insertion order, so the first key is the oldest entry
+            while len(self._entries) >= self.maxsize:
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = (user, token, time.monotonic() + self.ttl)
+            self._by_user.setdefault(user.pk, set()).add(key)
+
+    def invalidate_key(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def _remove(self, key: str) -> None:
+        user, _, _ = self._entries.pop(key)
+        keys = self._by_user.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user.pk]
+
+
+token_cache = TokenCache(get_setting("TOKEN_CACHE_SIZE"), get_setting("TOKEN_CACHE_TTL"))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that serves warm lookups from the token cache
+
+    Cached entries are dropped by the Token post_delete and User post_save
+    signals. QuerySet.update() and delete() on users send neither, so a user
+    deactivated with User.objects.filter(...).update(is_active=False) keeps
+    authenticating until its entry expires after TOKEN_CACHE_TTL seconds.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # a failed lookup raises AuthenticationFailed and is not cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
+
+
+async def authenticate_async(request, authentication_classes: list):
+    """Authenticate a plain Django request from an async view
+
+    Args:
+        request (HttpRequest): incoming http request
+        authentication_classes (list): DRF authentication classes to try, in order
+
+    Raises:
+        APIException: the credentials are invalid, AuthenticationFailed with the
+            same detail the DRF views answer with
+
+    Returns:
+        the authenticated user, or None if no credentials were given
+    """
+    # a warm token is answered from the cache without leaving the event loop
+    if CachedTokenAuthentication in authentication_classes:
+        auth = request.headers.get("Authorization", "").split()
+        if len(auth) == 2 and auth[0].lower() == CachedTokenAuthentication.keyword.lower():
+            cached = token_cache.get(auth[1])
+            if cached is not None:
+                return cached[0]
+
+    drf_request = Request(
+        request, authenticators=[cls() for cls in authentication_classes]
+    )
+
+    def get_user():
+        # bad credentials, or a session request failing the csrf check, raise
+        user = drf_request.user
+        return user if user.is_authenticated else None
+
+    return await sync_to_async(get_user)()
+
+
+# drop cached tokens when the token goes away or the user changes
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance=None, **kwargs) -> None:
+    token_cache.invalidate_key(instance.key)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance=None, **kwargs) -> None:
+    token_cache.invalidate_user(instance.pk)
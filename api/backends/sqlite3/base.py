@@ -0,0 +1,110 @@
+"""
+Copy Cat SQLite Backend
+=======================
+
+Django's sqlite3 backend tuned for a write heavy server. Every new
+connection sets PRAGMAs for WAL journaling, NORMAL syncing, memory mapped
+reads, a bigger page cache and a busy timeout. Transactions start with
+BEGIN IMMEDIATE, so a writer takes the write lock up front and waits for
+it, instead of failing with "database is locked" when a read transaction
+has to be upgraded.
+
+With serialize_writes, writers in this process also queue on a lock before
+they begin, so they take turns in order instead of polling SQLite's busy
+handler. The lock is taken for every atomic block, read-only ones
+included, since a block is not known to write when it begins. Both are
+configured through OPTIONS:
+
+    DATABASES = {
+        "default": {
+            "ENGINE": "api.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                "pragmas": {"mmap_size": 0},
+                "transaction_mode": "IMMEDIATE",
+                "serialize_writes": True,
+            },
+        }
+    }
+"""
+import threading
+
+from django.db.backends.sqlite3 import base
+from django.db.utils import OperationalError
+
+# busy_timeout comes first so switching the journal mode can wait for a lock
+DEFAULT_PRAGMAS = {
+    "busy_timeout": 5000,
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    # negative sizes are in KiB
+    "cache_size": -64 * 1024,
+}
+
+# database file -> lock shared by every connection of this process to it
+write_locks = {}
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict["OPTIONS"]
+        self.pragmas = {**DEFAULT_PRAGMAS, **options.get("pragmas", {})}
+        self.transaction_mode = options.get("transaction_mode", "IMMEDIATE")
+        self.write_lock = None
+        if options.get("serialize_writes", False):
+            self.write_lock = write_locks.setdefault(
+                str(self.settings_dict["NAME"]), threading.Lock()
+            )
+        self.holds_write_lock = False
+
+    def get_connection_params(self) -> dict:
+        params = super().get_connection_params()
+        for option in ("pragmas", "transaction_mode", "serialize_writes"):
+            params.pop(option, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def _start_transaction_under_autocommit(self) -> None:
+        self.acquire_write_lock()
+        try:
+            self.cursor().execute(f"BEGIN {self.transaction_mode or ''}")
+        except Exception:
+            self.release_write_lock()
+            raise
+
+    def _commit(self):
+        # a failed commit is rolled back, which releases the lock then
+        result = super()._commit()
+        self.release_write_lock()
+        return result
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self.release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self.release_write_lock()
+
+    def acquire_write_lock(self) -> None:
+        if self.write_lock is None or self.holds_write_lock:
+            return
+        if not self.write_lock.acquire(timeout=self.pragmas["busy_timeout"] / 1000):
+            raise OperationalError("database is locked")
+        self.holds_write_lock = True
+
+    def release_write_lock(self) -> None:
+        if self.holds_write_lock:
+            self.holds_write_lock = False
+            self.write_lock.release()
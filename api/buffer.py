@@ -0,0 +1,256 @@
+"""
+Copy Cat Ingest Buffer
+======================
+
+Write-behind buffer for the buffered ingest mode. Validated events are
+queued in process and the request returns 202 straight away; a background
+thread drains the queue with bulk inserts whenever it holds enough events
+or the oldest event has waited long enough. The queue is bounded, and
+producers are turned away once it is full instead of growing it without
+limit. Whatever is still queued at interpreter exit is flushed.
+
+A batch whose insert fails is written again in halves, down to single
+events, so one bad row, such as an event whose channel was deleted while
+it was queued, only costs itself. Events that still fail are appended to
+the INGEST_DEAD_LETTER file as json lines instead of being dropped.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from .conf import get_setting
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """Raised when the ingest buffer has no room for the submitted events"""
+
+
+class IngestBuffer:
+    """Bounded queue of unsaved events with a background flusher thread"""
+
+    def __init__(
+        self, max_size: int, flush_size: int, flush_interval: float, write, reject=None
+    ) -> None:
+        self.max_size = max_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.write = write
+        # called with the events that could not be written even one at a time
+        self.reject = reject
+
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+        self._queue = deque()
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def put(self, events: list) -> None:
+        """Queue events for the next flush
+
+        Args:
+            events (list): unsaved events, queued all together or not at all
+
+        Raises:
+            BufferFull: there is no room for all of the events
+        """
+        with self._condition:
+            if len(self._queue) + len(events) > self.max_size:
+                self.rejected += len(events)
+                raise BufferFull()
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.extend(events)
+            self.accepted += len(events)
+            if self._thread is None:
+                self._start()
+            if len(self._queue) >= self.flush_size:
+                self._condition.notify()
+
+    def flush(self) -> None:
+        """Write everything currently queued from the calling thread"""
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self._write(batch)
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Stop the flusher thread and write anything left in the queue"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> dict:
+        """Queue depth and flush counters
+
+        Returns:
+            dict: depth, event counters and flush latency in seconds
+        """
+        return {
+            "depth": len(self._queue),
+            "max_size": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "flush_seconds_total": self.flush_seconds_total,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="copycat-ingest-flusher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    # wait until the queue is big enough, old enough or we are stopping
+                    while not self._stopping and not self._due():
+                        if self._queue:
+                            wait = self._oldest + self.flush_interval - time.monotonic()
+                        else:
+                            wait = None
+                        self._condition.wait(wait)
+                    if self._stopping:
+                        return
+                batch = self._take()
+                if batch:
+                    self._write(batch)
+        finally:
+            connection.close()
+
+    def _due(self) -> bool:
+        if not self._queue:
+            return False
+        if len(self._queue) >= self.flush_size:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+
+    def _take(self) -> list:
+        with self._condition:
+            count = min(len(self._queue), self.flush_size)
+            batch = [self._queue.popleft() for _ in range(count)]
+            self._oldest = time.monotonic() if self._queue else None
+            return batch
+
+    def _write(self, batch: list) -> None:
+        started = time.perf_counter()
+        self._write_slice(batch)
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flush_seconds_total += elapsed
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _write_slice(self, batch: list) -> None:
+        try:
+            close_old_connections()
+            with transaction.atomic():
+                self.write(batch)
+        except Exception:
+            if len(batch) > 1:
+                logger.warning(
+                    "Failed to flush %d buffered events, retrying in halves", len(batch)
+                )
+                middle = len(batch) // 2
+                self._write_slice(batch[:middle])
+                self._write_slice(batch[middle:])
+                return
+            self.failed += 1
+            logger.exception("Failed to flush a buffered event")
+            if self.reject is not None:
+                try:
+                    self.reject(batch)
+                except Exception:
+                    logger.exception("Failed to reject a buffered event")
+        else:
+            self.flushed += len(batch)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_dead_letter_lock = threading.Lock()
+
+
+def dead_letter_path() -> Path:
+    path = get_setting("INGEST_DEAD_LETTER")
+    return Path(path or Path(settings.BASE_DIR) / "ingest_dead_letter.ndjson")
+
+
+def dead_letter(events: list) -> None:
+    """Append events the flusher could not write to the dead letter file
+
+    Args:
+        events (list): unsaved events, kept with the ids they were queued with
+            since their project or channel may be gone
+    """
+    lines = []
+    for event in events:
+        item = {
+            "user": event.user_id,
+            "project_id": event.project_id_id,
+            "channel_id": event.channel_id_id,
+            "event": event.event_name,
+            "description": event.description,
+            "icon": event.icon,
+            "idempotency_key": event.idempotency_key,
+            "created_at": event.created_at.isoformat() if event.created_at else None,
+        }
+        lines.append(json.dumps(item) + "\n")
+    with _dead_letter_lock:
+        with open(dead_letter_path(), "a", encoding="utf-8") as file:
+            file.writelines(lines)
+
+
+def get_buffer() -> IngestBuffer:
+    """Get the process wide ingest buffer, creating it on first use
+
+    Returns:
+        IngestBuffer: buffer that writes through ingest.write_new_events and
+            hands what it cannot write to ingest.reject_events
+    """
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                from .ingest import reject_events, write_new_events
+
+                _buffer = IngestBuffer(
+                    get_setting("INGEST_BUFFER_SIZE"),
+                    get_setting("INGEST_FLUSH_SIZE"),
+                    get_setting("INGEST_FLUSH_INTERVAL"),
+                    write_new_events,
+                    reject_events,
+                )
+    return _buffer
+
+
+def buffering_enabled() -> bool:
+    return get_setting("INGEST_MODE") == "buffered"
@@ -0,0 +1,188 @@
+"""
+Copy Cat Name Cache
+===================
+
+The log endpoints address projects and channels by name. Resolving a
+(user, project name, channel name) triple to ids is cached in process so
+that warm requests do not run any lookup queries. Entries are bounded in
+number and age, and are dropped whenever the Project or Channel they point
+to is saved or deleted.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .conf import get_setting
+from .models import Channel, Project
+
+
+class NameCache:
+    """Bounded LRU cache with a TTL, indexed by project and channel id for invalidation"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._by_project = {}
+        self._by_channel = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """Get the (project id, channel id) cached for a key
+
+        Args:
+            key (tuple): (user id, project name, channel name or None)
+
+        Returns:
+            Optional[tuple]: cached ids, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: tuple, value: tuple) -> None:
+        """Cache the (project id, channel id) for a key
+
+        Args:
+            key (tuple): (user id, project name, channel name or None)
+            value (tuple): (project id, channel id or None)
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._by_project.setdefault(value[0], set()).add(key)
+            if value[1] is not None:
+                self._by_channel.setdefault(value[1], set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_project(self, project_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_project.get(project_id, ())):
+                self._remove(key)
+
+    def invalidate_channel(self, channel_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_channel.get(channel_id, ())):
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_project.clear()
+            self._by_channel.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Hit/miss statistics for the cache
+
+        Returns:
+            dict: hits, misses, evictions, current size and hit ratio
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remove(self, key: tuple) -> None:
+        value, _ = self._entries.pop(key)
+        keys = self._by_project.get(value[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_project[value[0]]
+        if value[1] is not None:
+            keys = self._by_channel.get(value[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_channel[value[1]]
+
+
+name_cache = NameCache(get_setting("NAME_CACHE_SIZE"), get_setting("NAME_CACHE_TTL"))
+
+
+def lookup_project(user_id: int, project_name: str) -> Optional[int]:
+    """Get the id of a user's project by name
+
+    Args:
+        user_id (int): owner of the project
+        project_name (str): name of the project
+
+    Returns:
+        Optional[int]: project id, or None if the project does not exist
+    """
+    key = (user_id, project_name, None)
+    ids = name_cache.get(key)
+    if ids is not None:
+        return ids[0]
+
+    project_id = (
+        Project.objects.filter(user=user_id, name=project_name)
+        .values_list("id", flat=True)
+        .first()
+    )
+    if project_id is not None:
+        name_cache.set(key, (project_id, None))
+    return project_id
+
+
+def lookup_channel(user_id: int, project_name: str, channel_name: str) -> Optional[tuple]:
+    """Get the project and channel ids of a user's channel by name
+
+    Args:
+        user_id (int): owner of the channel
+        project_name (str): name of the project the channel belongs to
+        channel_name (str): name of the channel
+
+    Returns:
+        Optional[tuple]: (project id, channel id), or None if either does not exist
+    """
+    key = (user_id, project_name, channel_name)
+    ids = name_cache.get(key)
+    if ids is not None:
+        return ids
+
+    ids = (
+        Channel.objects.filter(
+            user=user_id, project_id__name=project_name, name=channel_name
+        )
+        .values_list("project_id", "id")
+        .first()
+    )
+    if ids is not None:
+        name_cache.set(key, ids)
+    return ids
+
+
+# drop cached ids whenever the rows behind them change
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project(sender, instance=None, **kwargs) -> None:
+    name_cache.invalidate_project(instance.id)
+
+
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+def invalidate_channel(sender, instance=None, **kwargs) -> None:
+    name_cache.invalidate_channel(instance.id)
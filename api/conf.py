@@ -0,0 +1,83 @@
+"""
+Copy Cat Settings
+=================
+
+Tunables for the api app are read from the ``COPYCAT`` dict in the Django
+settings, falling back to the defaults below.
+"""
+from django.conf import settings
+
+DEFAULTS = {
+    # name -> id resolution cache used by the ingest and listing views
+    "NAME_CACHE_SIZE": 10000,
+    "NAME_CACHE_TTL": 300,
+    # token key -> user cache used by CachedTokenAuthentication
+    "TOKEN_CACHE_SIZE": 10000,
+    "TOKEN_CACHE_TTL": 60,
+    # keyset pagination of event listings
+    "PAGE_SIZE": 100,
+    "MAX_PAGE_SIZE": 1000,
+    # "direct" writes events in the request, "buffered" queues them and returns 202
+    "INGEST_MODE": "direct",
+    "INGEST_BUFFER_SIZE": 100000,
+    "INGEST_FLUSH_SIZE": 5000,
+    "INGEST_FLUSH_INTERVAL": 0.5,
+    # seconds a client is asked to wait when the ingest buffer is full
+    "INGEST_RETRY_AFTER": 1,
+    # json lines file of buffered events that could not be written,
+    # BASE_DIR / "ingest_dead_letter.ndjson" when None
+    "INGEST_DEAD_LETTER": None,
+    # serve /log/ with the native async views, for deployments under ASGI
+    "ASYNC_VIEWS": False,
+    # record per route latency, sql and response size for /metrics
+    "METRICS": True,
+    # days events are kept when neither their channel nor project sets it, None is forever
+    "RETENTION_DAYS": None,
+    # events deleted per transaction by purges, and seconds to pause between them
+    "PURGE_CHUNK_SIZE": 1000,
+    "PURGE_PAUSE": 0.05,
+    # directory of archived event segments, BASE_DIR / "archive" when None
+    "ARCHIVE_DIR": None,
+    # most events per segment file, and decoded segments kept in memory for reads
+    "ARCHIVE_SEGMENT_SIZE": 10000,
+    "ARCHIVE_CACHE_SIZE": 32,
+    # token bucket limits on ingest, in events per second per user token and per
+    # project (Project.rate_limit overrides), None is unlimited
+    "RATE_LIMITING": False,
+    "RATE_LIMIT_USER": None,
+    "RATE_LIMIT_PROJECT": None,
+    # seconds worth of events a bucket holds for bursts
+    "RATE_LIMIT_BURST": 2.0,
+    # file shared by the worker processes of a host, buckets are per process when None
+    "RATE_LIMIT_STORE": None,
+    "RATE_LIMIT_SLOTS": 65536,
+    # open dedup windows kept in memory, and seconds between writes of their repeat counts
+    "DEDUP_MAX_KEYS": 100000,
+    "DEDUP_FLUSH_INTERVAL": 1.0,
+    # idempotency keys remembered in memory, and for how many seconds
+    "IDEMPOTENCY_CACHE_SIZE": 100000,
+    "IDEMPOTENCY_TTL": 86400,
+    # newest events kept rendered per channel for the recent endpoint, json bytes
+    # kept across channels, and seconds before a ring is read from the database again
+    "RECENT_EVENTS_SIZE": 500,
+    "RECENT_EVENTS_MAX_BYTES": 64 * 1024 * 1024,
+    "RECENT_EVENTS_TTL": 60,
+    # ETag and Last-Modified on listings from project and channel versions, and
+    # rendered listing responses kept in memory by version, 0 turns the cache off
+    "CONDITIONAL_GET": True,
+    "RESPONSE_CACHE_MAX_BYTES": 0,
+    # events written per transaction by import_events
+    "IMPORT_CHUNK_SIZE": 10000,
+}
+
+
+def get_setting(name: str):
+    """Get a Copy Cat setting
+
+    Args:
+        name (str): key in the COPYCAT settings dict
+
+    Returns:
+        the configured value, or the default if it is not set
+    """
+    return getattr(settings, "COPYCAT", {}).get(name, DEFAULTS[name])
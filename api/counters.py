@@ -0,0 +1,162 @@
+"""
+Copy Cat Counters
+=================
+
+Event count and first and last event time of every project and channel,
+stored on their own rows so overviews read them together with the names.
+Ingest adds every written batch with one UPDATE per channel and project,
+using F() expressions so that concurrent writers never lose a count.
+Archived events keep counting. reconcile() recomputes the fields from
+the Event table and the archive segments to repair drift. Every update
+also raises the row's version, see api/versions.py.
+"""
+from django.db.models import Count, DateTimeField, F, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Channel, Event, Project
+from .versions import bump, changed
+
+
+def summarize(events: list, field: str) -> dict:
+    """Count saved events and find their time range per project or channel
+
+    Args:
+        events (list): saved events with created_at set
+        field (str): attname grouped on, project_id_id or channel_id_id
+
+    Returns:
+        dict: id -> [count, first created_at, last created_at]
+    """
+    summary = {}
+    for event in events:
+        key = getattr(event, field)
+        entry = summary.get(key)
+        if entry is None:
+            summary[key] = [1, event.created_at, event.created_at]
+        else:
+            entry[0] += 1
+            if event.created_at < entry[1]:
+                entry[1] = event.created_at
+            if event.created_at > entry[2]:
+                entry[2] = event.created_at
+    return summary
+
+
+def add_counts(model, summary: dict) -> None:
+    """Add event counts and widen the event time range of projects or channels
+
+    Args:
+        model: Project or Channel
+        summary (dict): id -> [count, first created_at, last created_at]
+    """
+    for pk, (count, first, last) in summary.items():
+        first = Value(first, output_field=DateTimeField())
+        last = Value(last, output_field=DateTimeField())
+        # Least and Greatest are NULL while the row has no events yet
+        model.objects.filter(pk=pk).update(
+            event_count=F("event_count") + count,
+            first_event_at=Coalesce(Least("first_event_at", first), first),
+            last_event_at=Coalesce(Greatest("last_event_at", last), last),
+            **changed(),
+        )
+
+
+def remove_counts(model, counts: dict) -> None:
+    """Subtract deleted events from the counts of projects or channels
+
+    Args:
+        model: Project or Channel
+        counts (dict): id -> number of its events that were deleted
+    """
+    for pk, count in counts.items():
+        model.objects.filter(pk=pk).update(
+            event_count=Greatest(F("event_count") - count, 0), **changed()
+        )
+
+
+def refresh_time_range(model, pk: int, events, segments=None) -> None:
+    """Re-read the first and last event time of a project or channel
+
+    Args:
+        model: Project or Channel
+        pk (int): id of the project or channel
+        events (QuerySet): its events, filtered on the columns of a created_at index
+        segments (QuerySet, optional): its archive segments
+    """
+    times = events.order_by("created_at").values_list("created_at", flat=True)
+    first, last = times.first(), times.last()
+    if segments is not None:
+        archived = segments.aggregate(first=Min("min_created_at"), last=Max("max_created_at"))
+        first = min(filter(None, (first, archived["first"])), default=None)
+        last = max(filter(None, (last, archived["last"])), default=None)
+    model.objects.filter(pk=pk).update(first_event_at=first, last_event_at=last, **changed())
+
+
+def update_counters(events: list) -> None:
+    """Add a batch of just written events to the project and channel counters
+
+    Args:
+        events (list): saved events
+    """
+    add_counts(Channel, summarize(events, "channel_id_id"))
+    add_counts(Project, summarize(events, "project_id_id"))
+
+
+def reconcile(model, field: str, events, segments=None, segment_field=None) -> int:
+    """Recompute the counters of every project or channel from its events
+
+    Args:
+        model: Project or Channel
+        field (str): event field pointing at the model, project_id or channel_id
+        events (QuerySet): all events
+        segments (QuerySet, optional): all archive segments
+        segment_field (str, optional): segment field pointing at the model
+
+    Returns:
+        int: number of rows whose counters were wrong and have been repaired
+    """
+    actual = {
+        row[field]: (row["count"], row["first"], row["last"])
+        for row in events.values(field)
+        .annotate(count=Count("id"), first=Min("created_at"), last=Max("created_at"))
+        .order_by()
+    }
+    if segments is not None:
+        for row in (
+            segments.values(segment_field)
+            .annotate(
+                count=Sum("count"), first=Min("min_created_at"), last=Max("max_created_at")
+            )
+            .order_by()
+        ):
+            count, first, last = actual.get(row[segment_field], (0, None, None))
+            actual[row[segment_field]] = (
+                count + row["count"],
+                min(filter(None, (first, row["first"]))),
+                max(filter(None, (last, row["last"]))),
+            )
+    drifted = []
+    fields = ["event_count", "first_event_at", "last_event_at"]
+    for row in model.objects.only("id", *fields).iterator():
+        expected = actual.get(row.id, (0, None, None))
+        if (row.event_count, row.first_event_at, row.last_event_at) != expected:
+            row.event_count, row.first_event_at, row.last_event_at = expected
+            drifted.append(row)
+    model.objects.bulk_update(drifted, fields, batch_size=500)
+    if drifted:
+        ids = [row.id for row in drifted]
+        bump(model, ids)
+        if model is Channel:
+            bump(Project, Channel.objects.filter(id__in=ids).values("project_id"))
+    return len(drifted)
+
+
+@receiver(post_delete, sender=Channel)
+def remove_channel_counts(sender, instance: Channel, **kwargs) -> None:
+    # the project's time range can only be narrowed by reconcile()
+    if instance.event_count:
+        Project.objects.filter(pk=instance.project_id_id).update(
+            event_count=Greatest(F("event_count") - instance.event_count, 0), **changed()
+        )
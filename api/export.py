@@ -0,0 +1,128 @@
+"""
+Copy Cat Export
+===============
+
+Generators that stream events out of the database in constant memory.
+Rows are read with QuerySet.iterator() and encoded one database chunk at a
+time, so an export of any size holds at most one chunk in memory, besides
+the archive segments being merged in.
+
+Under ASGI, Django reads a sync iterator given to StreamingHttpResponse
+into a list before sending any of it, so the export view hands the ASGI
+server the same generators wrapped by astream() instead.
+"""
+import csv
+import io
+import json
+import zlib
+from heapq import merge
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+
+from .archive import row_key
+from .serializers import EVENT_FIELDS, event_row, serialize_rows
+
+EXPORT_FIELDS = EVENT_FIELDS
+CHUNK_SIZE = 2000
+
+
+def iter_rows(events: QuerySet, chunk_size: int = CHUNK_SIZE, archive=None):
+    """Yield lists of event dicts, one list per database chunk
+
+    Args:
+        events (QuerySet): filtered events
+        chunk_size (int): rows fetched from the database at a time
+        archive (ArchiveReader, optional): merge in archived rows
+
+    Yields:
+        list: up to chunk_size event dicts, as EventSerializer renders them
+    """
+    rows = events.order_by("created_at", "id").values_list(*EXPORT_FIELDS)
+    rows = rows.iterator(chunk_size=chunk_size)
+    if archive is not None:
+        rows = merge(rows, archive.rows(), key=row_key)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield serialize_rows(chunk, event_row)
+            chunk = []
+    if chunk:
+        yield serialize_rows(chunk, event_row)
+
+
+def ndjson_stream(events: QuerySet, chunk_size: int = CHUNK_SIZE, archive=None):
+    """Stream events as newline delimited json
+
+    Args:
+        events (QuerySet): filtered events
+        chunk_size (int): rows fetched from the database at a time
+        archive (ArchiveReader, optional): merge in archived rows
+
+    Yields:
+        bytes: encoded lines for one chunk of events
+    """
+    for chunk in iter_rows(events, chunk_size, archive):
+        yield "".join(
+            json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for event in chunk
+        ).encode()
+
+
+def csv_stream(events: QuerySet, chunk_size: int = CHUNK_SIZE, archive=None):
+    """Stream events as csv with a header row
+
+    Args:
+        events (QuerySet): filtered events
+        chunk_size (int): rows fetched from the database at a time
+        archive (ArchiveReader, optional): merge in archived rows
+
+    Yields:
+        bytes: encoded csv rows for one chunk of events
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    # send the header straight away so the first byte does not wait on the query
+    yield buffer.getvalue().encode()
+    for chunk in iter_rows(events, chunk_size, archive):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([event[field] for field in EXPORT_FIELDS] for event in chunk)
+        yield buffer.getvalue().encode()
+
+
+def gzip_stream(stream):
+    """Gzip a byte stream, flushing after every chunk so output is not held back
+
+    Args:
+        stream: iterable of bytes
+
+    Yields:
+        bytes: gzip encoded data
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for data in stream:
+        yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+async def astream(stream):
+    """Iterate a byte stream from the event loop, one chunk at a time
+
+    Args:
+        stream: iterable of bytes, such as ndjson_stream()
+
+    Yields:
+        bytes: the chunks of stream
+    """
+    iterator = iter(stream)
+    # thread sensitive, so every chunk is read on the thread, and over the
+    # database connection, that started the query
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        data = await next_chunk(iterator, None)
+        if data is None:
+            return
+        yield data
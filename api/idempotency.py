@@ -0,0 +1,148 @@
+"""
+Copy Cat Idempotency
+====================
+
+Clients may send an idempotency_key with an event so that a retried POST
+does not store it twice. A unique index on (user, idempotency_key) is the
+source of truth, and the keys written recently are remembered in a
+bounded in-process map, so a retry is answered without a query and a new
+key costs none either. A key the map does not know, because another
+process or an earlier run wrote it, is caught by the index: the insert,
+run in a savepoint when events carry keys, fails, the conflicting keys
+are read into the map and the other events are written again.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from .conf import get_setting
+from .models import Event
+from .rules import EventSkipped
+
+IDEMPOTENCY_KEY_MAX_LENGTH = Event._meta.get_field("idempotency_key").max_length
+
+
+class RecentKeys:
+    """Bounded map of (user id, idempotency key) -> event id with a time horizon
+
+    Queued events are stored as the event itself until the buffer has
+    written it and its id is known.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id: int, key: str):
+        """Look up a key
+
+        Returns:
+            the event id, or the queued event, or None if the key is not known
+        """
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic():
+            with self._lock:
+                self._entries.pop((user_id, key), None)
+            return None
+        self.hits += 1
+        return value
+
+    def add(self, user_id: int, key: str, value) -> None:
+        with self._lock:
+            self._entries[(user_id, key)] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def add_events(self, events: list) -> None:
+        for event in events:
+            if event.idempotency_key is not None:
+                self.add(event.user_id, event.idempotency_key, event.pk if event.pk else event)
+
+    def forget_events(self, events: list) -> None:
+        """Forget the keys of queued events that were not written
+
+        A key is only forgotten while it still maps to the queued event itself.
+        """
+        with self._lock:
+            for event in events:
+                if event.idempotency_key is None:
+                    continue
+                entry = self._entries.get((event.user_id, event.idempotency_key))
+                if entry is not None and entry[0] is event:
+                    del self._entries[(event.user_id, event.idempotency_key)]
+
+    def load(self, user_id: int, keys) -> set:
+        """Read which keys are already taken from the database and remember them
+
+        Returns:
+            set: the keys that exist
+        """
+        found = set()
+        keys = list(keys)
+        # chunked to stay under the sqlite bound parameter limit
+        for offset in range(0, len(keys), 500):
+            for key, event_id in Event.objects.filter(
+                user=user_id, idempotency_key__in=keys[offset : offset + 500]
+            ).values_list("idempotency_key", "id"):
+                self.add(user_id, key, event_id)
+                found.add(key)
+        return found
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+recent_keys = RecentKeys(get_setting("IDEMPOTENCY_CACHE_SIZE"), get_setting("IDEMPOTENCY_TTL"))
+
+
+def idempotency_key(item) -> Optional[str]:
+    key = item.get("idempotency_key")
+    return None if key is None else str(key)
+
+
+def duplicate(user_id: int, key: Optional[str]) -> Optional[EventSkipped]:
+    """Check a key against the recently written ones, without a query
+
+    Args:
+        user_id (int): owner of the event
+        key (Optional[str]): idempotency key of the event, if any
+
+    Returns:
+        Optional[EventSkipped]: the 200 answer of a retry, None for a new key
+    """
+    if key is None:
+        return None
+    value = recent_keys.get(user_id, key)
+    if value is None:
+        return None
+    event_id = value if isinstance(value, int) else value.pk
+    return EventSkipped("Duplicate idempotency key.", event_id, status=200)
+
+
+def load_taken(events: list) -> set:
+    """Read which idempotency keys of unsaved events are already taken
+
+    Args:
+        events (list): unsaved events, of any users
+
+    Returns:
+        set: (user id, key) of the events that must not be written
+    """
+    keys = {}
+    for event in events:
+        if event.idempotency_key is not None:
+            keys.setdefault(event.user_id, set()).add(event.idempotency_key)
+    return {
+        (user_id, key)
+        for user_id, user_keys in keys.items()
+        for key in recent_keys.load(user_id, user_keys)
+    }
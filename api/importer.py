@@ -0,0 +1,297 @@
+"""
+Copy Cat Import
+===============
+
+Bulk loading of events from newline delimited json, as written by the
+export endpoint or another logging service. Lines are parsed as they are
+read, project and channel names are resolved once through an in-memory
+map, creating the missing ones, and every chunk is written in its own
+transaction together with its rollups and counters. The byte offset after
+the last committed chunk is reported, so an interrupted load can resume
+from there.
+
+Events are inserted with one prepared statement per chunk instead of
+bulk_create, whose multi row statements are capped by the sqlite bound
+parameter limit, and imported events keep the created_at of the source.
+They keep their idempotency_key too: a line whose key an earlier line or a
+stored event already took is reported and skipped, so importing the same
+dump twice does not store its keyed events twice.
+"""
+import gzip
+import json
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import counters, rollups
+from .idempotency import idempotency_key
+from .ingest import validate_item
+from .models import Channel, Event, Project
+from .recent import recent_events
+from .renderers import orjson
+
+GZIP_MAGIC = b"\x1f\x8b"
+COLUMNS = [
+    "project_id",
+    "channel_id",
+    "event_name",
+    "description",
+    "icon",
+    "user",
+    "created_at",
+    "repeat_count",
+    "idempotency_key",
+]
+CREATED_AT = COLUMNS.index("created_at")
+IDEMPOTENCY_KEY = COLUMNS.index("idempotency_key")
+
+
+def loads(line: bytes):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def open_dump(path: str, offset: int = 0):
+    """Open a plain or gzipped dump at a byte offset of its decompressed content
+
+    Args:
+        path (str): path of the file
+        offset (int): bytes to skip, from a previous interrupted import
+
+    Returns:
+        binary file object positioned at the offset
+    """
+    with open(path, "rb") as raw:
+        compressed = raw.read(2) == GZIP_MAGIC
+    dump = gzip.open(path, "rb") if compressed else open(path, "rb")
+    # gzip streams can only seek forward by decompressing up to the offset
+    dump.seek(offset)
+    return dump
+
+
+def parse_created_at(value) -> datetime:
+    """Read the created_at of an imported event, now when it has none
+
+    Raises:
+        ValueError: the value is not an iso 8601 datetime
+    """
+    if value is None:
+        return timezone.now()
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = timezone.make_aware(value)
+    return value.astimezone(dt_timezone.utc)
+
+
+class EventImporter:
+    """Write parsed events of one user in chunks, creating projects and channels on demand"""
+
+    def __init__(self, user_id: int) -> None:
+        self.user_id = user_id
+        # (project name, channel name) -> (project id, channel id)
+        self.channels = {}
+        self.projects = dict(
+            Project.objects.filter(user=user_id).values_list("name", "id")
+        )
+        qn = connection.ops.quote_name
+        columns = ", ".join(qn(Event._meta.get_field(name).column) for name in COLUMNS)
+        self.sql = (
+            f"INSERT INTO {qn(Event._meta.db_table)} ({columns}) "
+            f"VALUES ({', '.join(['%s'] * len(COLUMNS))})"
+        )
+
+    def resolve(self, project: str, channel: str) -> tuple:
+        ids = self.channels.get((project, channel))
+        if ids is not None:
+            return ids
+        project_id = self.projects.get(project)
+        if project_id is None:
+            project_id = Project.objects.get_or_create(user_id=self.user_id, name=project)[0].id
+            self.projects[project] = project_id
+        channel_id = Channel.objects.get_or_create(
+            user_id=self.user_id, project_id_id=project_id, name=channel
+        )[0].id
+        ids = self.channels[(project, channel)] = (project_id, channel_id)
+        return ids
+
+    def parse(self, line: bytes) -> tuple:
+        """Turn one line into an insert row
+
+        Raises:
+            ValueError: the line is not a valid event
+
+        Returns:
+            tuple: (row, channel id, created_at)
+        """
+        try:
+            item = loads(line)
+        except ValueError:
+            raise ValueError("Invalid json.")
+        return self.row(item)
+
+    def row(self, item) -> tuple:
+        """Turn one decoded item into an insert row, like parse()"""
+        error = validate_item(item)
+        if error:
+            raise ValueError(error)
+        try:
+            created_at = parse_created_at(item.get("created_at"))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid created_at.")
+        try:
+            # exports carry the repeat count of collapsed events
+            repeat_count = int(item.get("repeat_count") or 1)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid repeat_count.")
+        project_id, channel_id = self.resolve(str(item["project"]), str(item["channel"]))
+        row = (
+            project_id,
+            channel_id,
+            str(item["event"]),
+            item.get("description"),
+            item.get("icon"),
+            self.user_id,
+            # what adapt_datetimefield_value stores for a utc datetime, without
+            # going through the connection proxy for every row
+            created_at.isoformat(" ")[:-6],
+            repeat_count,
+            idempotency_key(item),
+        )
+        return row, channel_id, created_at
+
+    def taken(self, rows: list) -> set:
+        """Find the rows whose idempotency key is already taken
+
+        Args:
+            rows (list): (row, channel id, created_at) tuples from parse()
+
+        Returns:
+            set: positions of the rows that an earlier row or a stored event has the key of
+        """
+        keys = list({row[IDEMPOTENCY_KEY] for row, _, _ in rows} - {None})
+        stored = set()
+        # chunked to stay under the sqlite bound parameter limit
+        for offset in range(0, len(keys), 500):
+            stored.update(
+                Event.objects.filter(
+                    user=self.user_id, idempotency_key__in=keys[offset : offset + 500]
+                ).values_list("idempotency_key", flat=True)
+            )
+        positions = set()
+        for position, (row, _, _) in enumerate(rows):
+            key = row[IDEMPOTENCY_KEY]
+            if key in stored:
+                positions.add(position)
+            elif key is not None:
+                stored.add(key)
+        return positions
+
+    def write(self, rows: list) -> None:
+        """Insert a chunk of parsed rows with its rollups and counters in one transaction
+
+        Args:
+            rows (list): (row, channel id, created_at) tuples from parse()
+        """
+        # counted on the "YYYY-MM-DD HH:MM" prefix of the stored value, so only
+        # the distinct minutes are turned back into datetimes
+        prefixes = Counter()
+        channels = {}
+        for row, channel_id, created_at in rows:
+            prefixes[(channel_id, row[CREATED_AT][:16])] += 1
+            entry = channels.get(channel_id)
+            if entry is None:
+                channels[channel_id] = [1, created_at, created_at]
+            else:
+                entry[0] += 1
+                if created_at < entry[1]:
+                    entry[1] = created_at
+                if created_at > entry[2]:
+                    entry[2] = created_at
+
+        minutes = Counter()
+        for (channel_id, prefix), count in prefixes.items():
+            minute = datetime.fromisoformat(prefix).replace(tzinfo=dt_timezone.utc)
+            minutes[(channel_id, minute)] = count
+
+        project_of = {channel_id: project_id for project_id, channel_id in self.channels.values()}
+        projects = {}
+        for channel_id, (count, first, last) in channels.items():
+            entry = projects.get(project_of[channel_id])
+            if entry is None:
+                projects[project_of[channel_id]] = [count, first, last]
+            else:
+                entry[0] += count
+                entry[1] = min(entry[1], first)
+                entry[2] = max(entry[2], last)
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.executemany(self.sql, [row for row, _, _ in rows])
+            rollups.add_counts(rollups.count_minutes(minutes))
+            counters.add_counts(Channel, channels)
+            counters.add_counts(Project, projects)
+        # imported events keep their created_at, so they may belong anywhere in a ring
+        recent_events.invalidate(channels)
+
+
+def max_event_id() -> int:
+    return Event.objects.order_by("-id").values_list("id", flat=True).first() or 0
+
+
+def import_lines(importer: EventImporter, dump, chunk_size: int, offset: int = 0):
+    """Parse and write the lines of a dump in chunks
+
+    Args:
+        importer (EventImporter): writer for the user
+        dump: binary file object positioned at offset
+        chunk_size (int): events written per transaction
+        offset (int): position of dump in the decompressed content
+
+    Yields:
+        tuple: (offset after the chunk, events written, errors) after every
+        committed chunk, errors being (line offset, message) pairs
+    """
+    rows = []
+    offsets = []
+    errors = []
+    for line in dump:
+        line_offset = offset
+        offset += len(line)
+        if not line.strip():
+            continue
+        try:
+            rows.append(importer.parse(line))
+        except ValueError as error:
+            errors.append((line_offset, str(error)))
+            continue
+        offsets.append(line_offset)
+        if len(rows) >= chunk_size:
+            yield offset, write_chunk(importer, rows, offsets, errors), errors
+            rows = []
+            offsets = []
+            errors = []
+    yield offset, write_chunk(importer, rows, offsets, errors), errors
+
+
+def write_chunk(importer: EventImporter, rows: list, offsets: list, errors: list) -> int:
+    """Write a chunk of parsed rows, leaving out those with a taken idempotency key
+
+    Args:
+        importer (EventImporter): writer for the user
+        rows (list): (row, channel id, created_at) tuples from parse()
+        offsets (list): line offset of every row
+        errors (list): (line offset, message) pairs of the chunk, the skipped
+            rows are added in line order
+
+    Returns:
+        int: number of events written
+    """
+    taken = importer.taken(rows)
+    if taken:
+        errors += [(offsets[i], "Duplicate idempotency key.") for i in sorted(taken)]
+        errors.sort()
+        rows = [row for i, row in enumerate(rows) if i not in taken]
+    if rows:
+        importer.write(rows)
+    return len(rows)
@@ -0,0 +1,450 @@
+"""
+Copy Cat Ingest
+===============
+
+Helpers for writing events. Every distinct (project, channel) pair in a
+request is resolved once, through the name cache, missing channels are
+created together and all events are written with a single bulk insert,
+either in the request or, in the buffered ingest mode, by the buffer flusher.
+The sampling and dedup rules of the channels run before either.
+"""
+from typing import Optional
+
+from django.db import IntegrityError, transaction
+
+from .buffer import BufferFull, dead_letter, get_buffer
+from .cache import name_cache
+from .counters import update_counters
+from .idempotency import (
+    IDEMPOTENCY_KEY_MAX_LENGTH,
+    duplicate,
+    idempotency_key,
+    load_taken,
+    recent_keys,
+)
+from .metrics import span
+from .models import Channel, Event, Project
+from .notifier import notifier
+from .recent import recent_events
+from .rollups import update_rollups
+from .rules import EventSkipped, apply_rules, repeats
+from .versions import bump
+
+ICON_MAX_LENGTH = Event._meta.get_field("icon").max_length
+CHANNEL_NAME_MAX_LENGTH = Channel._meta.get_field("name").max_length
+
+
+def validate_item(item) -> Optional[str]:
+    """Check a single batch item before it is resolved
+
+    Args:
+        item: one element of the batch body
+
+    Returns:
+        Optional[str]: error message, or None if the item is valid
+    """
+    if not isinstance(item, dict):
+        return "Batch items must be objects."
+    if item.get("project") is None or item.get("channel") is None or item.get("event") is None:
+        return "Required fields are empty."
+    # a blank channel would otherwise be created, nameless
+    if not str(item["project"]).strip() or not str(item["channel"]).strip():
+        return "Project and channel names may not be blank."
+    if str(item["event"]) == "":
+        return "Event name may not be blank."
+    if len(str(item["channel"])) > CHANNEL_NAME_MAX_LENGTH:
+        return "Channel name is too long."
+    icon = item.get("icon")
+    if icon is not None and len(str(icon)) > ICON_MAX_LENGTH:
+        return "Icon is too long."
+    key = item.get("idempotency_key")
+    if key is not None and len(str(key)) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return "Idempotency key is too long."
+    return None
+
+
+def resolve_channels(user_id: int, pairs) -> dict:
+    """Resolve (project name, channel name) pairs to ids, creating missing channels
+
+    Args:
+        user_id (int): owner of the projects and channels
+        pairs: iterable of (project name, channel name) tuples
+
+    Returns:
+        dict: (project name, channel name) -> (project id, channel id), or None
+        when the project does not exist for the user
+    """
+    resolved = {}
+    for pair in set(pairs):
+        resolved[pair] = name_cache.get((user_id, *pair))
+    pairs = {pair for pair, ids in resolved.items() if ids is None}
+    if not pairs:
+        return resolved
+
+    projects = dict(
+        Project.objects.filter(
+            user=user_id, name__in={project for project, _ in pairs}
+        ).values_list("name", "id")
+    )
+    channels = {
+        (project_id, name): channel_id
+        for project_id, name, channel_id in Channel.objects.filter(
+            user=user_id,
+            project_id__in=projects.values(),
+            name__in={channel for _, channel in pairs},
+        ).values_list("project_id", "name", "id")
+    }
+
+    # create every missing channel with one insert. a concurrent request may
+    # create the same channel first, so conflicts are ignored and re-read
+    missing = {
+        (projects[project], channel)
+        for project, channel in pairs
+        if project in projects and (projects[project], channel) not in channels
+    }
+    if missing:
+        Channel.objects.bulk_create(
+            [
+                Channel(project_id_id=project_id, name=name, user_id=user_id)
+                for project_id, name in missing
+            ],
+            ignore_conflicts=True,
+        )
+        # the new channels show up in the channel listings of their projects
+        bump(Project, {project_id for project_id, _ in missing})
+        channels.update(
+            {
+                (project_id, name): channel_id
+                for project_id, name, channel_id in Channel.objects.filter(
+                    user=user_id,
+                    project_id__in={project_id for project_id, _ in missing},
+                    name__in={name for _, name in missing},
+                ).values_list("project_id", "name", "id")
+            }
+        )
+
+    found = {}
+    for project, channel in pairs:
+        project_id = projects.get(project)
+        if project_id is not None:
+            ids = (project_id, channels[(project_id, channel)])
+            resolved[(project, channel)] = found[(user_id, project, channel)] = ids
+
+    # cached once the caller's transaction commits, so a rolled back request
+    # does not leave the ids of channels that were never created
+    def remember() -> None:
+        for key, ids in found.items():
+            name_cache.set(key, ids)
+
+    transaction.on_commit(remember)
+    return resolved
+
+
+def build_event(user_id: int, ids: tuple, item) -> Event:
+    """Build an unsaved event for a validated item
+
+    Args:
+        user_id (int): owner of the event
+        ids (tuple): resolved (project id, channel id)
+        item: validated request item
+
+    Returns:
+        Event: unsaved event
+    """
+    return Event(
+        project_id_id=ids[0],
+        channel_id_id=ids[1],
+        event_name=str(item["event"]),
+        description=item.get("description"),
+        icon=item.get("icon"),
+        user_id=user_id,
+        idempotency_key=idempotency_key(item),
+    )
+
+
+def write_events(events: list) -> list:
+    """Insert events with one bulk insert
+
+    Both the direct ingest path and the buffer flusher write through here,
+    inside a transaction, so the rollups and the project and channel counters
+    are updated together with the events.
+
+    Args:
+        events (list): unsaved events
+
+    Returns:
+        list: the saved events
+    """
+    events = Event.objects.bulk_create(events)
+    update_rollups(events)
+    update_counters(events)
+    # after the commit, so the counts stay pending if this transaction rolls back
+    if repeats.due():
+        transaction.on_commit(repeats.flush)
+
+    # wake up live tails once the events are visible to other connections
+    latest = {}
+    for event in events:
+        latest[event.channel_id_id] = max(latest.get(event.channel_id_id, 0), event.id)
+    transaction.on_commit(lambda: notifier.publish(latest))
+    transaction.on_commit(lambda: recent_keys.add_events(events))
+    transaction.on_commit(lambda: recent_events.add(events))
+    return events
+
+
+def write_new_events(events: list) -> list:
+    """Write events, leaving out those whose idempotency key is already taken
+
+    Events without a key are written like write_events does. With keys, the
+    insert runs in a savepoint: when the unique index rejects it, the taken
+    keys are read and the other events written again.
+
+    Args:
+        events (list): unsaved events
+
+    Returns:
+        list: None for every written event, EventSkipped for the duplicates
+    """
+    # events the buffer writes again still carry the ids of the rolled back insert
+    for event in events:
+        event.pk = None
+    if all(event.idempotency_key is None for event in events):
+        write_events(events)
+        return [None] * len(events)
+    try:
+        with transaction.atomic():
+            write_events(events)
+        return [None] * len(events)
+    except IntegrityError:
+        taken = load_taken(events)
+        if not taken:
+            raise
+
+    outcomes = []
+    new = []
+    for event in events:
+        if (event.user_id, event.idempotency_key) in taken:
+            outcomes.append(duplicate(event.user_id, event.idempotency_key))
+        else:
+            outcomes.append(None)
+            new.append(event)
+    repeats.forget([event for event, skipped in zip(events, outcomes) if skipped])
+    write_events(new)
+    return outcomes
+
+
+def ingest_event(user_id: int, item) -> Optional[Event]:
+    """Resolve and write a single validated event
+
+    Args:
+        user_id (int): owner of the event
+        item: validated request item
+
+    Raises:
+        EventSkipped: the channel's rules dropped or collapsed the event, or its
+            idempotency key was already used
+
+    Returns:
+        Optional[Event]: the saved event, or None if the project does not exist
+    """
+    skipped = duplicate(user_id, idempotency_key(item))
+    if skipped is not None:
+        raise skipped
+    pair = (str(item["project"]), str(item["channel"]))
+    event = None
+    try:
+        with transaction.atomic():
+            with span("lookup"):
+                ids = resolve_channels(user_id, [pair])[pair]
+            if ids is None:
+                return None
+            event = build_event(user_id, ids, item)
+            skipped = apply_rules([event])[0]
+            if skipped is None:
+                with span("write"):
+                    skipped = write_new_events([event])[0]
+            elif repeats.due():
+                transaction.on_commit(repeats.flush)
+    except Exception:
+        # a window opened by the event would count repeats of a row that is gone
+        if event is not None:
+            repeats.forget([event])
+        raise
+    # raised outside the transaction, so a channel created for the event stays
+    if skipped is not None:
+        raise skipped
+    return event
+
+
+def queue_event(user_id: int, item) -> bool:
+    """Resolve a single validated event and queue it on the ingest buffer
+
+    Args:
+        user_id (int): owner of the event
+        item: validated request item
+
+    Raises:
+        BufferFull: the ingest buffer has no room for the event
+        EventSkipped: the channel's rules dropped or collapsed the event, or its
+            idempotency key was already used
+
+    Returns:
+        bool: False if the project does not exist, True once the event is queued
+    """
+    skipped = duplicate(user_id, idempotency_key(item))
+    if skipped is not None:
+        raise skipped
+    pair = (str(item["project"]), str(item["channel"]))
+    ids = resolve_channels(user_id, [pair])[pair]
+    if ids is None:
+        return False
+    event = build_event(user_id, ids, item)
+    skipped = apply_rules([event])[0]
+    if skipped is not None:
+        raise skipped
+    enqueue([event])
+    return True
+
+
+def enqueue(events: list) -> None:
+    """Queue events on the ingest buffer, remembering their idempotency keys
+
+    The keys are remembered before the events are queued, so a retry that
+    arrives while they wait is answered as a duplicate, and forgotten if the
+    buffer is full.
+
+    Raises:
+        BufferFull: the ingest buffer has no room for the events
+    """
+    recent_keys.add_events(events)
+    try:
+        get_buffer().put(events)
+    except BufferFull:
+        recent_keys.forget_events(events)
+        raise
+
+
+def reject_events(events: list) -> None:
+    """Give up on queued events the buffer could not write
+
+    Their idempotency keys and dedup windows are forgotten, so the client's
+    retry is stored, and the events go to the dead letter file.
+    """
+    recent_keys.forget_events(events)
+    repeats.forget(events)
+    dead_letter(events)
+
+
+def prepare_batch(user_id: int, items: list) -> tuple:
+    """Validate and resolve a batch, building unsaved events for the valid items
+
+    Args:
+        user_id (int): owner of the events
+        items (list): request items with project, channel, event, description and icon
+
+    Returns:
+        tuple: (results, events, positions) where results holds the error for every
+        rejected or skipped item and positions[i] is the index of events[i] in the batch
+    """
+    results = [None] * len(items)
+    valid = []
+    keys = set()
+    for index, item in enumerate(items):
+        error = validate_item(item)
+        if error:
+            results[index] = {"status": 400, "message": error}
+            continue
+        key = idempotency_key(item)
+        skipped = duplicate(user_id, key)
+        if skipped is None and key in keys:
+            skipped = EventSkipped("Duplicate idempotency key.", status=200)
+        if skipped is not None:
+            results[index] = skipped.result()
+            continue
+        if key is not None:
+            keys.add(key)
+        valid.append(index)
+
+    with span("lookup"):
+        resolved = resolve_channels(
+            user_id,
+            ((str(items[i]["project"]), str(items[i]["channel"])) for i in valid),
+        )
+
+    events = []
+    positions = []
+    for index in valid:
+        item = items[index]
+        ids = resolved[(str(item["project"]), str(item["channel"]))]
+        if ids is None:
+            results[index] = {
+                "status": 400,
+                "message": "Project does not exist for user.",
+            }
+            continue
+        events.append(build_event(user_id, ids, item))
+        positions.append(index)
+
+    kept = []
+    kept_positions = []
+    for event, index, skipped in zip(events, positions, apply_rules(events)):
+        if skipped is None:
+            kept.append(event)
+            kept_positions.append(index)
+        else:
+            results[index] = skipped.result()
+    return results, kept, kept_positions
+
+
+def ingest_batch(user_id: int, items: list) -> list:
+    """Validate, resolve and write a batch of events in one transaction
+
+    Args:
+        user_id (int): owner of the events
+        items (list): request items with project, channel, event, description and icon
+
+    Returns:
+        list: one result dict per item, in request order
+    """
+    events = []
+    try:
+        with transaction.atomic():
+            results, events, positions = prepare_batch(user_id, items)
+            with span("write"):
+                outcomes = write_new_events(events)
+    except Exception:
+        repeats.forget(events)
+        raise
+
+    for index, event, skipped in zip(positions, events, outcomes):
+        if skipped is not None:
+            results[index] = skipped.result()
+            continue
+        results[index] = {
+            "status": 201,
+            "id": event.id,
+            "created_at": event.created_at,
+        }
+    return results
+
+
+def queue_batch(user_id: int, items: list) -> list:
+    """Validate and resolve a batch and queue its events on the ingest buffer
+
+    Args:
+        user_id (int): owner of the events
+        items (list): request items with project, channel, event, description and icon
+
+    Raises:
+        BufferFull: the ingest buffer has no room for the valid events
+
+    Returns:
+        list: one result dict per item, in request order
+    """
+    results, events, positions = prepare_batch(user_id, items)
+    if events:
+        enqueue(events)
+
+    for index in positions:
+        results[index] = {"status": 202}
+    return results
@@ -0,0 +1,47 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...archive import archive_channel, archive_dir
+from ...models import Channel
+
+
+class Command(BaseCommand):
+    help = (
+        "Move events older than a number of days out of the Event table into "
+        "compressed segment files, per channel and month"
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "days",
+            type=int,
+            help="archive events created more than this many days ago",
+        )
+        parser.add_argument(
+            "--channel",
+            type=int,
+            action="append",
+            help="only archive this channel id, may be repeated",
+        )
+        parser.add_argument(
+            "--segment-size",
+            type=int,
+            help="most events per segment file",
+        )
+
+    def handle(self, *args, **options) -> None:
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        channels = Channel.objects.all()
+        if options["channel"]:
+            channels = channels.filter(id__in=options["channel"])
+        total = 0
+        for channel in channels.iterator():
+            archived = archive_channel(channel, cutoff, options["segment_size"])
+            if archived:
+                self.stdout.write(f"channel {channel.id}: {archived} events")
+            total += archived
+        self.stdout.write(
+            self.style.SUCCESS(f"Archived {total} events to {archive_dir()}.")
+        )
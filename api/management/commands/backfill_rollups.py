@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import Trunc
+
+from ...models import Event, EventRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild the minute, hour and day event count rollups from the Event table"
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--channel",
+            type=int,
+            action="append",
+            help="only rebuild the rollups of this channel id, may be repeated",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="rollup rows inserted per statement",
+        )
+
+    def handle(self, *args, **options) -> None:
+        events = Event.objects.all()
+        rollups = EventRollup.objects.all()
+        if options["channel"]:
+            events = events.filter(channel_id__in=options["channel"])
+            rollups = rollups.filter(channel_id__in=options["channel"])
+
+        # rebuild in one transaction so ingest cannot add to a half built table
+        with transaction.atomic():
+            rollups.delete()
+            for bucket in EventRollup.BUCKETS:
+                counts = (
+                    events.annotate(start=Trunc("created_at", bucket))
+                    .values("channel_id", "start")
+                    .annotate(count=Count("id"))
+                    .order_by()
+                )
+                created = EventRollup.objects.bulk_create(
+                    (
+                        EventRollup(
+                            channel_id_id=row["channel_id"],
+                            bucket=bucket,
+                            bucket_start=row["start"],
+                            count=row["count"],
+                        )
+                        for row in counts.iterator()
+                    ),
+                    batch_size=options["batch_size"],
+                )
+                self.stdout.write(f"{bucket}: {len(created)} buckets")
+        self.stdout.write(self.style.SUCCESS("Rollups rebuilt."))
@@ -0,0 +1,185 @@
+import asyncio
+import io
+import json
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+
+from ...models import Channel, Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many concurrent clients one worker sustains with the async "
+        "views under ASGI and the sync views under WSGI. Requests are sent to "
+        "the applications in process, against a throwaway bench user."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "levels",
+            nargs="*",
+            type=int,
+            default=[1, 10, 50, 100],
+            help="number of concurrent clients, one run per level",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=500,
+            help="requests sent at each concurrency level",
+        )
+        parser.add_argument(
+            "--endpoint",
+            choices=["read", "write"],
+            action="append",
+            help="endpoints to measure, both by default",
+        )
+
+    def handle(self, *args, **options) -> None:
+        from copycat.asgi import application as asgi_application
+        from copycat.wsgi import application as wsgi_application
+
+        # failed requests are counted in the report instead of logged one by one
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        user = User.objects.create(username=f"bench-concurrency-{time.time_ns()}")
+        try:
+            token = Token.objects.get_or_create(user=user)[0].key
+            project = Project.objects.create(name="bench", user=user)
+            Channel.objects.create(project_id=project, name="bench", user=user)
+            body = json.dumps(
+                {"project": "bench", "channel": "bench", "event": "bench"}
+            ).encode()
+
+            self.stdout.write(
+                f"{'endpoint':>8} {'stack':>6} {'clients':>8} {'req/s':>9} "
+                f"{'p50 ms':>8} {'p99 ms':>8} {'errors':>7}"
+            )
+            for endpoint in options["endpoint"] or ["read", "write"]:
+                if endpoint == "read":
+                    request = ("GET", "log/bench/bench/", b"")
+                else:
+                    request = ("POST", "log/", body)
+                for clients in options["levels"]:
+                    for stack, run in (
+                        ("asgi", self.run_asgi),
+                        ("wsgi", self.run_wsgi),
+                    ):
+                        app = asgi_application if stack == "asgi" else wsgi_application
+                        elapsed, latencies, errors = run(
+                            app, token, request, clients, options["requests"]
+                        )
+                        self.report(endpoint, stack, clients, elapsed, latencies, errors)
+        finally:
+            user.delete()
+
+    def report(self, endpoint, stack, clients, elapsed, latencies, errors) -> None:
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        self.stdout.write(
+            f"{endpoint:>8} {stack:>6} {clients:>8} {len(latencies) / elapsed:>9.1f} "
+            f"{p50:>8.2f} {p99:>8.2f} {errors:>7}"
+        )
+
+    def run_asgi(self, application, token: str, request: tuple, clients: int, total: int):
+        method, path, body = request
+        # the async views are mounted under /api/async/
+        path = f"/api/async/{path}"
+        latencies = []
+        errors = 0
+
+        async def send_request() -> None:
+            nonlocal errors
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": method,
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "query_string": b"",
+                "root_path": "",
+                "server": ("localhost", 80),
+                "client": ("127.0.0.1", 0),
+                "headers": [
+                    (b"host", b"localhost"),
+                    (b"authorization", f"Token {token}".encode()),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            }
+            messages = [{"type": "http.request", "body": body, "more_body": False}]
+            status_code = None
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                # the request is complete, wait like a client that stays connected
+                await asyncio.Future()
+
+            async def send(message):
+                nonlocal status_code
+                if message["type"] == "http.response.start":
+                    status_code = message["status"]
+
+            started = time.perf_counter()
+            await application(scope, receive, send)
+            latencies.append(time.perf_counter() - started)
+            if status_code >= 400:
+                errors += 1
+
+        async def client(remaining: list) -> None:
+            while remaining:
+                remaining.pop()
+                await send_request()
+
+        async def main() -> float:
+            remaining = list(range(total))
+            started = time.perf_counter()
+            await asyncio.gather(*(client(remaining) for _ in range(clients)))
+            return time.perf_counter() - started
+
+        elapsed = asyncio.run(main())
+        return elapsed, latencies, errors
+
+    def run_wsgi(self, application, token: str, request: tuple, clients: int, total: int):
+        method, path, body = request
+        # the sync views are mounted under /api/sync/
+        path = f"/api/sync/{path}"
+
+        def send_request(_) -> tuple:
+            environ = {
+                "REQUEST_METHOD": method,
+                "PATH_INFO": path,
+                "HTTP_HOST": "localhost",
+                "HTTP_AUTHORIZATION": f"Token {token}",
+                "CONTENT_TYPE": "application/json",
+                "CONTENT_LENGTH": str(len(body)),
+                "wsgi.input": io.BytesIO(body),
+            }
+            setup_testing_defaults(environ)
+            status_line = []
+
+            def start_response(status, headers, exc_info=None):
+                status_line.append(status)
+
+            started = time.perf_counter()
+            result = application(environ, start_response)
+            b"".join(result)
+            if hasattr(result, "close"):
+                result.close()
+            return time.perf_counter() - started, int(status_line[0].split()[0]) >= 400
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(send_request, range(total)))
+        elapsed = time.perf_counter() - started
+        return elapsed, [latency for latency, _ in results], sum(error for _, error in results)
@@ -0,0 +1,74 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from ...models import Channel, Event, Project
+from ...renderers import FastJSONRenderer, orjson
+from ...serializers import EVENT_FIELDS, EventSerializer, event_row, serialize_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare EventSerializer + JSONRenderer with the values_list + FastJSONRenderer "
+        "read path. Rows are written inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "sizes",
+            nargs="*",
+            type=int,
+            default=[10000, 100000, 1000000],
+            help="number of events to serialize, one run per size",
+        )
+
+    def handle(self, *args, **options) -> None:
+        self.stdout.write(f"orjson: {'yes' if orjson is not None else 'no'}")
+        self.stdout.write(f"{'rows':>10} {'serializer':>12} {'fast path':>12} {'speedup':>8}")
+        for size in options["sizes"]:
+            with transaction.atomic():
+                events = self.create_events(size)
+                slow, slow_body = self.measure(self.render_serializer, events)
+                fast, fast_body = self.measure(self.render_fast, events)
+                transaction.set_rollback(True)
+
+            if slow_body != fast_body:
+                raise CommandError(f"Output differs at {size} rows.")
+            self.stdout.write(
+                f"{size:>10} {slow:>11.3f}s {fast:>11.3f}s {slow / fast:>7.1f}x"
+            )
+
+    def create_events(self, size: int):
+        user = User.objects.create(username=f"bench-serializers-{time.time_ns()}")
+        project = Project.objects.create(name="bench", user=user)
+        channel = Channel.objects.create(project_id=project, name="bench", user=user)
+        Event.objects.bulk_create(
+            (
+                Event(
+                    project_id=project,
+                    channel_id=channel,
+                    event_name=f"event {i}",
+                    description="bench – ünïcode" if i % 2 else None,
+                    icon="🐱" if i % 3 else None,
+                    user=user,
+                )
+                for i in range(size)
+            ),
+            batch_size=5000,
+        )
+        return Event.objects.filter(user=user.id).order_by("created_at", "id")
+
+    def measure(self, render, events) -> tuple:
+        started = time.perf_counter()
+        body = render(events)
+        return time.perf_counter() - started, body
+
+    def render_serializer(self, events) -> bytes:
+        return JSONRenderer().render(EventSerializer(events, many=True).data)
+
+    def render_fast(self, events) -> bytes:
+        rows = events.values_list(*EVENT_FIELDS)
+        return FastJSONRenderer().render(serialize_rows(rows, event_row))
@@ -0,0 +1,263 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from ...authentication import token_cache
+from ...cache import name_cache
+from ...importer import EventImporter, import_lines
+
+# events per body of the batch POST scenario
+BATCH_SIZE = 100
+# whether a larger value of a metric is better, for the baseline comparison
+HIGHER_IS_BETTER = {
+    "ops_per_s": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "queries": False,
+    "peak_kb": False,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure ingest throughput, listing latency, queries per request and peak "
+        "memory of the sync event views against synthetic data, save the results as "
+        "json and compare them with a baseline. Everything is written inside a "
+        "transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--users", type=int, default=2, help="synthetic users")
+        parser.add_argument("--projects", type=int, default=2, help="projects per user")
+        parser.add_argument("--channels", type=int, default=5, help="channels per project")
+        parser.add_argument(
+            "--events", type=int, default=50000, help="synthetic events over all channels"
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="days the synthetic events are spread over"
+        )
+        parser.add_argument(
+            "--requests", type=int, default=200, help="requests sent per scenario"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="seed of the data generator")
+        parser.add_argument("--output", help="write the results to this json file")
+        parser.add_argument("--baseline", help="compare with results saved by --output")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.3,
+            help="relative change of a metric tolerated before it counts as a regression",
+        )
+
+    def handle(self, *args, **options) -> None:
+        # writes must land in the request for the rollback to undo them
+        copycat = {**getattr(settings, "COPYCAT", {}), "INGEST_MODE": "direct"}
+        try:
+            with override_settings(COPYCAT=copycat), transaction.atomic():
+                users = self.generate(options)
+                results = self.run_scenarios(users[0], options)
+                transaction.set_rollback(True)
+        finally:
+            # rolled back ids are handed out again, drop what the caches know of them
+            name_cache.clear()
+            token_cache.clear()
+
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                **{
+                    name: options[name]
+                    for name in ("users", "projects", "channels", "events", "days", "requests", "seed")
+                },
+            },
+            "results": results,
+        }
+        self.print_results(results)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                json.dump(report, output, indent=2)
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline:
+                regressions = self.compare(json.load(baseline)["results"], results, options["tolerance"])
+            if regressions:
+                raise CommandError(f"{regressions} metrics regressed against the baseline.")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def generate(self, options) -> list:
+        """Create users with a token, projects, channels and their events
+
+        Returns:
+            list: (user, token key, [(project name, channel name)]) per user
+        """
+        rng = random.Random(options["seed"])
+        prefix = f"bench-suite-{time.time_ns()}"
+        users = []
+        for index in range(options["users"]):
+            user = User.objects.create(username=f"{prefix}-{index}")
+            pairs = [
+                (f"project-{p}", f"channel-{c}")
+                for p in range(options["projects"])
+                for c in range(options["channels"])
+            ]
+            users.append((user, Token.objects.get_or_create(user=user)[0].key, pairs))
+
+        # events go through the bulk importer, one importer per user
+        importers = [EventImporter(user.id) for user, _, _ in users]
+        end = timezone.now()
+        step = timedelta(days=options["days"]) / max(options["events"], 1)
+        start = end - step * options["events"]
+        batches = [[] for _ in users]
+        for i in range(options["events"]):
+            owner = rng.randrange(len(users))
+            project, channel = rng.choice(users[owner][2])
+            batches[owner].append(
+                {
+                    "project": project,
+                    "channel": channel,
+                    "event": f"event {rng.randrange(1000)}",
+                    "description": "synthetic event" if rng.random() < 0.5 else None,
+                    "icon": "🐱" if rng.random() < 0.3 else None,
+                    "created_at": (start + step * i).isoformat(),
+                }
+            )
+        for importer, items in zip(importers, batches):
+            lines = (json.dumps(item).encode() + b"\n" for item in items)
+            for _ in import_lines(importer, lines, 10000):
+                pass
+        return users
+
+    def run_scenarios(self, user: tuple, options) -> dict:
+        _, token, pairs = user
+        project, channel = pairs[0]
+        client = Client(SERVER_NAME="localhost", HTTP_AUTHORIZATION=f"Token {token}")
+        now = timezone.now()
+        day = {"start": (now - timedelta(days=1)).isoformat(), "end": now.isoformat()}
+        event = {"project": project, "channel": channel, "event": "bench", "description": "bench"}
+
+        def post():
+            return client.post("/api/sync/log/", event, content_type="application/json")
+
+        def post_batch():
+            return client.post(
+                "/api/sync/log/", [event] * BATCH_SIZE, content_type="application/json"
+            )
+
+        def get(path, params=None):
+            return lambda: client.get(path, params)
+
+        project_path = f"/api/sync/log/{project}/"
+        channel_path = f"/api/sync/log/{project}/{channel}/"
+        scenarios = {
+            "post": (post, 1),
+            "post_batch": (post_batch, BATCH_SIZE),
+            "list_project": (get(project_path), 1),
+            "list_project_range": (get(project_path, day), 1),
+            "list_channel": (get(channel_path), 1),
+            "list_channel_range": (get(channel_path, day), 1),
+        }
+        return {
+            name: self.measure(send, per_request, options["requests"])
+            for name, (send, per_request) in scenarios.items()
+        }
+
+    def measure(self, send, per_request: int, requests: int) -> dict:
+        """Time a scenario, then count its queries and trace its memory once
+
+        Args:
+            send: callable sending one request
+            per_request (int): operations one request stands for, events for posts
+            requests (int): timed requests
+
+        Returns:
+            dict: ops_per_s, p50_ms, p95_ms, queries and peak_kb
+        """
+        # warm up connections and caches before timing
+        self.check_response(send())
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = send()
+            latencies.append(time.perf_counter() - started)
+            self.check_response(response)
+
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        # counted with a wrapper, the query log is reset when a request starts
+        with connection.execute_wrapper(count_query):
+            send()
+        tracemalloc.start()
+        try:
+            send()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        latencies.sort()
+        return {
+            "ops_per_s": round(requests * per_request / sum(latencies), 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 3),
+            "p95_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 3),
+            "queries": queries,
+            "peak_kb": round(peak / 1024, 1),
+        }
+
+    def check_response(self, response) -> None:
+        if response.status_code >= 400:
+            raise CommandError(
+                f"{response.request['REQUEST_METHOD']} {response.request['PATH_INFO']} "
+                f"returned {response.status_code}."
+            )
+
+    def print_results(self, results: dict) -> None:
+        self.stdout.write(
+            f"{'scenario':<20} {'ops/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'peak kb':>9}"
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<20} {result['ops_per_s']:>10.1f} {result['p50_ms']:>8.2f} "
+                f"{result['p95_ms']:>8.2f} {result['queries']:>8} {result['peak_kb']:>9.1f}"
+            )
+
+    def compare(self, baseline: dict, results: dict, tolerance: float) -> int:
+        """Print the change of every metric against the baseline
+
+        Returns:
+            int: number of metrics worse than the baseline by more than the tolerance
+        """
+        regressions = 0
+        self.stdout.write(f"{'scenario':<20} {'metric':<10} {'baseline':>10} {'now':>10} {'change':>8}")
+        for name, result in results.items():
+            for metric, value in result.items():
+                before = baseline.get(name, {}).get(metric)
+                if before is None:
+                    continue
+                change = (value - before) / before if before else 0.0
+                worse = -change if HIGHER_IS_BETTER[metric] else change
+                # query counts are exact, any extra query is a regression
+                limit = 0 if metric == "queries" else tolerance
+                line = f"{name:<20} {metric:<10} {before:>10} {value:>10} {change:>+8.1%}"
+                if worse > limit:
+                    regressions += 1
+                    line = self.style.ERROR(f"{line} regressed")
+                self.stdout.write(line)
+        return regressions
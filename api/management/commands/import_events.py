@@ -0,0 +1,94 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import search
+from ...conf import get_setting
+from ...importer import EventImporter, import_lines, max_event_id, open_dump
+
+# invalid lines printed before the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        "Import events of one user from a newline delimited json file, optionally "
+        "gzipped, creating missing projects and channels. Each line holds project, "
+        "channel, event and optionally description, icon, created_at, repeat_count "
+        "and idempotency_key."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("path", help="ndjson or ndjson.gz file")
+        parser.add_argument("--user", required=True, help="username owning the events")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="events written per transaction",
+        )
+        parser.add_argument(
+            "--offset",
+            type=int,
+            default=0,
+            help="byte offset of the decompressed file to resume from",
+        )
+        parser.add_argument(
+            "--progress",
+            type=float,
+            default=2.0,
+            help="seconds between progress lines",
+        )
+        parser.add_argument(
+            "--keep-search-index",
+            action="store_true",
+            help="index every event as it is inserted instead of once at the end",
+        )
+
+    def handle(self, *args, **options) -> None:
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+        chunk_size = options["chunk_size"] or get_setting("IMPORT_CHUNK_SIZE")
+
+        importer = EventImporter(user.id)
+        # the search triggers cost more than the insert itself, so the index
+        # catches up in one pass once the import stops
+        suspend_search = not options["keep_search_index"] and search.supported()
+        if suspend_search:
+            last_id = max_event_id()
+            search.suspend()
+
+        started = last_report = time.perf_counter()
+        offset = options["offset"]
+        written = failed = 0
+        try:
+            with open_dump(options["path"], offset) as dump:
+                for offset, count, errors in import_lines(importer, dump, chunk_size, offset):
+                    written += count
+                    for line_offset, message in errors:
+                        if failed < MAX_REPORTED_ERRORS:
+                            self.stderr.write(f"skipped line at offset {line_offset}: {message}")
+                        failed += 1
+                    now = time.perf_counter()
+                    if now - last_report >= options["progress"]:
+                        last_report = now
+                        self.stdout.write(
+                            f"{written} events, {written / (now - started):.0f}/s, "
+                            f"offset {offset}"
+                        )
+        except BaseException:
+            self.stderr.write(f"Import stopped, resume with --offset {offset}")
+            raise
+        finally:
+            if suspend_search:
+                self.stdout.write("Indexing imported events for search...")
+                search.resume(last_id)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"imported {written} events in {elapsed:.1f}s "
+            f"({written / elapsed if elapsed else 0:.0f}/s), skipped {failed} lines"
+        )
+        self.stdout.write(self.style.SUCCESS("Import finished."))
@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from ...models import Channel, Project
+
+# endpoints a mix can name, with the default share of requests
+DEFAULT_MIX = "post:60,batch:10,channel:20,project:10"
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class ASGITransport:
+    """Send requests to the ASGI application in process"""
+
+    def __init__(self, application) -> None:
+        self.application = application
+
+    async def request(self, method: str, path: str, headers: list, body: bytes) -> int:
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query.encode(),
+            "root_path": "",
+            "server": ("localhost", 80),
+            "client": ("127.0.0.1", 0),
+            "headers": [(b"host", b"localhost")]
+            + [(name.lower().encode(), value.encode()) for name, value in headers],
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status_code = None
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # the request is complete, wait like a client that stays connected
+            await asyncio.Future()
+
+        async def send(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        await self.application(scope, receive, send)
+        return status_code
+
+    async def close(self) -> None:
+        pass
+
+
+class HTTPTransport:
+    """Send requests over one keep-alive HTTP/1.1 connection to a running server"""
+
+    def __init__(self, url: str) -> None:
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise CommandError("Only http:// urls are supported.")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, headers: list, body: bytes) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {self.prefix}{path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        try:
+            return await self.read_response()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            await self.close()
+            raise
+
+    async def read_response(self) -> int:
+        status_code = int((await self.reader.readuntil(b"\r\n")).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            # no length, the body runs until the server closes the connection
+            await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status_code
+
+    async def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive a mix of event POSTs and log listings from many async workers with "
+        "token auth, against the ASGI application in process or a running server, "
+        "and report throughput, errors and latency percentiles per endpoint."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--url",
+            help="base url of a running server, e.g. http://127.0.0.1:8000, in process when omitted",
+        )
+        parser.add_argument(
+            "--token",
+            help="auth token, needed with --url. in process a throwaway user is created",
+        )
+        parser.add_argument("--workers", type=int, default=50, help="concurrent workers")
+        parser.add_argument(
+            "--duration", type=float, default=10.0, help="seconds to send requests for"
+        )
+        parser.add_argument(
+            "--mix",
+            default=DEFAULT_MIX,
+            help="endpoint:weight pairs out of post, batch, channel and project",
+        )
+        parser.add_argument("--batch-size", type=int, default=100, help="events per batch POST")
+        parser.add_argument("--project", default="loadtest", help="project name to write to")
+        parser.add_argument("--channels", type=int, default=5, help="channels to spread events over")
+        parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+
+    def handle(self, *args, **options) -> None:
+        mix = self.parse_mix(options["mix"])
+        if options["url"]:
+            if not options["token"]:
+                raise CommandError("--token is required with --url.")
+            self.run(options, mix, options["token"], lambda: HTTPTransport(options["url"]))
+            return
+
+        from copycat.asgi import application
+
+        # failed requests are counted in the report instead of logged one by one
+        logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        user = User.objects.create(username=f"loadtest-{time.time_ns()}")
+        try:
+            project = Project.objects.create(name=options["project"], user=user)
+            for index in range(options["channels"]):
+                Channel.objects.create(project_id=project, name=f"channel-{index}", user=user)
+            token = Token.objects.get_or_create(user=user)[0].key
+            self.run(options, mix, token, lambda: ASGITransport(application))
+        finally:
+            user.delete()
+
+    def parse_mix(self, value: str) -> dict:
+        mix = {}
+        try:
+            for part in value.split(","):
+                name, _, weight = part.partition(":")
+                mix[name.strip()] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f"Invalid mix {value}.")
+        unknown = set(mix) - {"post", "batch", "channel", "project"}
+        if unknown or not any(mix.values()):
+            raise CommandError(f"Invalid mix {value}.")
+        return mix
+
+    def build_requests(self, options, token: str) -> tuple:
+        """Build the auth headers and a request maker per endpoint returning (method, path, body)"""
+        project = options["project"]
+        channels = [f"channel-{index}" for index in range(options["channels"])]
+        headers = [("Authorization", f"Token {token}"), ("Content-Type", "application/json")]
+
+        def item(rng) -> dict:
+            return {
+                "project": project,
+                "channel": rng.choice(channels),
+                "event": f"load {rng.randrange(100)}",
+                "description": "loadtest",
+            }
+
+        def post(rng) -> tuple:
+            return "POST", "/api/log/", json.dumps(item(rng)).encode()
+
+        def batch(rng) -> tuple:
+            body = [item(rng) for _ in range(options["batch_size"])]
+            return "POST", "/api/log/", json.dumps(body).encode()
+
+        def channel(rng) -> tuple:
+            return "GET", f"/api/log/{project}/{rng.choice(channels)}/", b""
+
+        def project_listing(rng) -> tuple:
+            return "GET", f"/api/log/{project}/", b""
+
+        makers = {"post": post, "batch": batch, "channel": channel, "project": project_listing}
+        return headers, makers
+
+    def run(self, options, mix: dict, token: str, transport_factory) -> None:
+        headers, makers = self.build_requests(options, token)
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        latencies = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        statuses = {}
+
+        async def worker(seed: int, deadline: float) -> None:
+            rng = random.Random(seed)
+            transport = transport_factory()
+            try:
+                while time.perf_counter() < deadline:
+                    name = rng.choices(names, weights)[0]
+                    method, path, body = makers[name](rng)
+                    request_headers = headers + [("Content-Length", str(len(body)))]
+                    started = time.perf_counter()
+                    try:
+                        status_code = await transport.request(method, path, request_headers, body)
+                    except (OSError, asyncio.IncompleteReadError, ValueError):
+                        status_code = None
+                    latencies[name].append(time.perf_counter() - started)
+                    statuses[status_code] = statuses.get(status_code, 0) + 1
+                    if status_code is None or status_code >= 400:
+                        errors[name] += 1
+            finally:
+                await transport.close()
+
+        async def main() -> float:
+            started = time.perf_counter()
+            deadline = started + options["duration"]
+            await asyncio.gather(
+                *(worker(options["seed"] + index, deadline) for index in range(options["workers"]))
+            )
+            return time.perf_counter() - started
+
+        elapsed = asyncio.run(main())
+        self.report(elapsed, latencies, errors, statuses, options["batch_size"])
+
+    def report(self, elapsed: float, latencies: dict, errors: dict, statuses: dict, batch_size: int) -> None:
+        self.stdout.write(
+            f"{'endpoint':<8} {'requests':>9} {'req/s':>9} {'errors':>7} {'err %':>6} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        everything = []
+        for name, values in latencies.items():
+            everything.extend(values)
+            self.write_row(name, sorted(values), errors[name], elapsed)
+        self.write_row("total", sorted(everything), sum(errors.values()), elapsed)
+
+        events = len(latencies.get("post", [])) + len(latencies.get("batch", [])) * batch_size
+        self.stdout.write(f"events posted: {events} ({events / elapsed:.0f}/s)")
+        self.stdout.write(
+            "status codes: "
+            + ", ".join(
+                f"{'failed' if code is None else code}: {count}"
+                for code, count in sorted(statuses.items(), key=lambda item: item[0] or 0)
+            )
+        )
+
+    def write_row(self, name: str, values: list, errors: int, elapsed: float) -> None:
+        if not values:
+            self.stdout.write(f"{name:<8} {0:>9}")
+            return
+        self.stdout.write(
+            f"{name:<8} {len(values):>9} {len(values) / elapsed:>9.1f} {errors:>7} "
+            f"{errors / len(values):>6.1%} {percentile(values, 0.5) * 1000:>8.2f} "
+            f"{percentile(values, 0.95) * 1000:>8.2f} {percentile(values, 0.99) * 1000:>8.2f} "
+            f"{values[-1] * 1000:>8.2f}"
+        )
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...models import Channel
+from ...retention import purge_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete events older than the retention of their channel or project, in "
+        "short chunked transactions. With --interval it keeps running as a worker."
+    )
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument(
+            "--channel",
+            type=int,
+            action="append",
+            help="only purge this channel id, may be repeated",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="events deleted per transaction",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            help="seconds to sleep between chunks",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="purge again every this many seconds instead of exiting",
+        )
+
+    def handle(self, *args, **options) -> None:
+        channels = Channel.objects.all()
+        if options["channel"]:
+            channels = channels.filter(id__in=options["channel"])
+        while True:
+            started = time.perf_counter()
+            deleted = purge_expired(
+                channels, chunk_size=options["chunk_size"], pause=options["pause"]
+            )
+            self.stdout.write(
+                f"deleted {deleted} events in {time.perf_counter() - started:.1f}s"
+            )
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(self.style.SUCCESS("Purge finished."))
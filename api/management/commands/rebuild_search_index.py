@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import search
+
+
+class Command(BaseCommand):
+    help = "Recreate the event search table and triggers and re-index every event"
+
+    def handle(self, *args, **options) -> None:
+        if not search.supported():
+            raise CommandError("Event search needs the SQLite database backend.")
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
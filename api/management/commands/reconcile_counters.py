@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...counters import reconcile
+from ...models import ArchiveSegment, Channel, Event, Project
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the event count and first and last event time of every "
+        "project and channel from the Event table and the archive, repairing any drift"
+    )
+
+    def handle(self, *args, **options) -> None:
+        # one transaction, so ingest cannot add events between the count and the repair
+        with transaction.atomic():
+            channels = reconcile(
+                Channel,
+                "channel_id",
+                Event.objects.all(),
+                ArchiveSegment.objects.all(),
+                "channel_id",
+            )
+            projects = reconcile(
+                Project,
+                "project_id",
+                Event.objects.all(),
+                ArchiveSegment.objects.all(),
+                "channel_id__project_id",
+            )
+        self.stdout.write(f"channels repaired: {channels}")
+        self.stdout.write(f"projects repaired: {projects}")
+        self.stdout.write(self.style.SUCCESS("Counters reconciled."))
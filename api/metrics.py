@@ -0,0 +1,387 @@
+"""
+Copy Cat Metrics
+================
+
+Per route request latency, SQL query count and time, response size, and
+optional timing spans around the phases of a view, exposed in the
+Prometheus text format at /metrics.
+
+Recording takes no locks. Every thread writes to its own shard of
+counters, and a scrape sums the shards. Histograms use fixed buckets, so
+observing a value is a bisect and two additions. SQL is timed by an
+execute wrapper installed once per database connection, which finds the
+current request through a context variable, so queries run from
+sync_to_async threads are counted against the request that made them.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .conf import get_setting
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds of the histogram buckets, in seconds and in bytes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Counts of observed values per bucket, with their sum"""
+
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram") -> None:
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+
+class RouteStats:
+    """Everything recorded for one route, method and status"""
+
+    __slots__ = ("latency", "size", "queries", "sql_seconds")
+
+    def __init__(self) -> None:
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+    def merge(self, other: "RouteStats") -> None:
+        self.latency.merge(other.latency)
+        self.size.merge(other.size)
+        self.queries += other.queries
+        self.sql_seconds += other.sql_seconds
+
+
+class Shard:
+    """Counters written by a single thread"""
+
+    __slots__ = ("routes", "spans")
+
+    def __init__(self) -> None:
+        # (route, method, status) -> RouteStats
+        self.routes = {}
+        # (route, phase) -> Histogram
+        self.spans = {}
+
+    def merge(self, other: "Shard") -> None:
+        for key, stats in list(other.routes.items()):
+            self.routes.setdefault(key, RouteStats()).merge(stats)
+        for key, histogram in list(other.spans.items()):
+            self.spans.setdefault(key, Histogram(LATENCY_BUCKETS)).merge(histogram)
+
+
+class ShardOwner:
+    """Held only by a thread's local storage, so it dies with the thread"""
+
+    __slots__ = ("__weakref__",)
+
+
+class RequestStats:
+    """SQL and span timings of the request being handled"""
+
+    __slots__ = ("queries", "sql_seconds", "spans")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.spans = []
+
+
+current: ContextVar[Optional[RequestStats]] = ContextVar("copycat_request_stats", default=None)
+
+
+class Metrics:
+    """Process wide registry of per thread shards"""
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._shards = set()
+        # shards of finished threads are folded in here so they are not lost
+        self._retired = Shard()
+        self._lock = threading.Lock()
+
+    def record(self, route: str, method: str, status: int, seconds: float,
+               size: Optional[int], stats: RequestStats) -> None:
+        """Record a finished request in the calling thread's shard
+
+        Args:
+            route (str): url pattern the request resolved to
+            method (str): http method
+            status (int): response status code
+            seconds (float): time spent handling the request
+            size (Optional[int]): response body size, None if it was streamed
+            stats (RequestStats): SQL and span timings of the request
+        """
+        shard = self._shard()
+        key = (route, method, status)
+        route_stats = shard.routes.get(key)
+        if route_stats is None:
+            route_stats = shard.routes[key] = RouteStats()
+        route_stats.latency.observe(seconds)
+        if size is not None:
+            route_stats.size.observe(size)
+        route_stats.queries += stats.queries
+        route_stats.sql_seconds += stats.sql_seconds
+        for phase, elapsed in stats.spans:
+            histogram = shard.spans.get((route, phase))
+            if histogram is None:
+                histogram = shard.spans[(route, phase)] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+
+    def collect(self) -> Shard:
+        """Sum the shards of every thread
+
+        Returns:
+            Shard: totals since the process started
+        """
+        total = Shard()
+        with self._lock:
+            shards = [self._retired, *self._shards]
+        for shard in shards:
+            total.merge(shard)
+        return total
+
+    def _shard(self) -> Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = Shard()
+            # the local's values are released when the thread exits
+            self._local.owner = owner = ShardOwner()
+            weakref.finalize(owner, self._retire, shard)
+            with self._lock:
+                self._shards.add(shard)
+        return shard
+
+    def _retire(self, shard: Shard) -> None:
+        with self._lock:
+            self._shards.discard(shard)
+            self._retired.merge(shard)
+
+
+metrics = Metrics()
+
+
+class Span:
+    """Time a phase of the current request, a no-op outside a request"""
+
+    __slots__ = ("phase", "stats", "started")
+
+    def __init__(self, phase: str) -> None:
+        self.phase = phase
+
+    def __enter__(self) -> "Span":
+        self.stats = current.get()
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.stats is not None:
+            self.stats.spans.append((self.phase, perf_counter() - self.started))
+
+
+def span(phase: str) -> Span:
+    """Time a block as a phase of the current request
+
+    Args:
+        phase (str): name of the phase, such as auth, lookup, query or serialize
+
+    Returns:
+        Span: context manager recording the block's duration
+    """
+    return Span(phase)
+
+
+def record_sql(execute, sql, params, many, context):
+    stats = current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.sql_seconds += perf_counter() - started
+
+
+@receiver(connection_created)
+def install_sql_wrapper(sender, connection, **kwargs) -> None:
+    # first in the list, so execute_wrapper() blocks still pop their own wrapper
+    if get_setting("METRICS") and record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_sql)
+
+
+class MetricsMiddleware:
+    """Record latency, SQL and response size of every request"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        if not get_setting("METRICS"):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        stats = RequestStats()
+        token = current.set(stats)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        self.record(request, response, perf_counter() - started, stats)
+        return response
+
+    async def acall(self, request):
+        stats = RequestStats()
+        token = current.set(stats)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        self.record(request, response, perf_counter() - started, stats)
+        return response
+
+    def record(self, request, response, seconds: float, stats: RequestStats) -> None:
+        # unresolved paths share one label so scanners cannot grow the registry
+        match = request.resolver_match
+        route = match.route if match is not None else "unmatched"
+        size = None if response.streaming else len(response.content)
+        metrics.record(route, request.method, response.status_code, seconds, size, stats)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+def format_histogram(name: str, labels: dict, histogram: Histogram) -> list:
+    prefix = format_labels(labels)
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix},le="{bound}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{prefix}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{prefix}}} {cumulative}")
+    return lines
+
+
+def render() -> str:
+    """Render every metric in the Prometheus text exposition format
+
+    Returns:
+        str: metrics page
+    """
+    from .authentication import token_cache
+    from .buffer import get_buffer, buffering_enabled
+    from .cache import name_cache
+    from .notifier import notifier
+    from .recent import recent_events
+    from .rules import repeats
+    from .versions import response_cache
+
+    total = metrics.collect()
+    routes = sorted(total.routes.items())
+    lines = [
+        "# HELP copycat_request_duration_seconds Time spent handling requests.",
+        "# TYPE copycat_request_duration_seconds histogram",
+    ]
+    for (route, method, status), stats in routes:
+        labels = {"route": route, "method": method, "status": status}
+        lines += format_histogram("copycat_request_duration_seconds", labels, stats.latency)
+
+    lines += [
+        "# HELP copycat_response_size_bytes Size of non streaming response bodies.",
+        "# TYPE copycat_response_size_bytes histogram",
+    ]
+    for (route, method, status), stats in routes:
+        labels = {"route": route, "method": method, "status": status}
+        lines += format_histogram("copycat_response_size_bytes", labels, stats.size)
+
+    lines += [
+        "# HELP copycat_sql_queries_total SQL queries run while handling requests.",
+        "# TYPE copycat_sql_queries_total counter",
+    ]
+    for (route, method, status), stats in routes:
+        labels = format_labels({"route": route, "method": method, "status": status})
+        lines.append(f"copycat_sql_queries_total{{{labels}}} {stats.queries}")
+
+    lines += [
+        "# HELP copycat_sql_seconds_total Time spent in SQL while handling requests.",
+        "# TYPE copycat_sql_seconds_total counter",
+    ]
+    for (route, method, status), stats in routes:
+        labels = format_labels({"route": route, "method": method, "status": status})
+        lines.append(f"copycat_sql_seconds_total{{{labels}}} {stats.sql_seconds}")
+
+    lines += [
+        "# HELP copycat_span_duration_seconds Time spent in each phase of a view.",
+        "# TYPE copycat_span_duration_seconds histogram",
+    ]
+    for (route, phase), histogram in sorted(total.spans.items()):
+        labels = {"route": route, "phase": phase}
+        lines += format_histogram("copycat_span_duration_seconds", labels, histogram)
+
+    gauges = [
+        ("copycat_name_cache_hits_total", "counter", name_cache.hits),
+        ("copycat_name_cache_misses_total", "counter", name_cache.misses),
+        ("copycat_name_cache_size", "gauge", name_cache.stats()["size"]),
+        ("copycat_token_cache_hits_total", "counter", token_cache.hits),
+        ("copycat_token_cache_misses_total", "counter", token_cache.misses),
+        ("copycat_tail_waiting", "gauge", notifier.waiting()),
+        ("copycat_dedup_windows", "gauge", repeats.stats()["windows"]),
+        ("copycat_dedup_collapsed_total", "counter", repeats.collapsed),
+        ("copycat_recent_events_channels", "gauge", recent_events.stats()["channels"]),
+        ("copycat_recent_events_bytes", "gauge", recent_events.bytes),
+        ("copycat_recent_events_hits_total", "counter", recent_events.hits),
+        ("copycat_recent_events_misses_total", "counter", recent_events.misses),
+        ("copycat_response_cache_bytes", "gauge", response_cache.bytes),
+        ("copycat_response_cache_hits_total", "counter", response_cache.hits),
+        ("copycat_response_cache_misses_total", "counter", response_cache.misses),
+    ]
+    if buffering_enabled():
+        buffer = get_buffer().stats()
+        gauges += [
+            ("copycat_ingest_buffer_depth", "gauge", buffer["depth"]),
+            ("copycat_ingest_buffer_flushed_total", "counter", buffer["flushed"]),
+            ("copycat_ingest_buffer_rejected_total", "counter", buffer["rejected"]),
+            ("copycat_ingest_buffer_failed_total", "counter", buffer["failed"]),
+            ("copycat_ingest_flushes_total", "counter", buffer["flushes"]),
+            ("copycat_ingest_flush_seconds_total", "counter", buffer["flush_seconds_total"]),
+            ("copycat_ingest_flush_seconds_last", "gauge", buffer["last_flush_seconds"]),
+            ("copycat_ingest_flush_seconds_max", "gauge", buffer["max_flush_seconds"]),
+        ]
+    for name, kind, value in gauges:
+        lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
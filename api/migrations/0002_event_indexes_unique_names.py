@@ -0,0 +1,80 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:12
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_names(apps, schema_editor):
+    # names created twice by concurrent requests would fail the unique
+    # constraints, so every duplicate is merged into its oldest row first
+    Project = apps.get_model("api", "Project")
+    Channel = apps.get_model("api", "Channel")
+    Event = apps.get_model("api", "Event")
+    for row in (
+        Project.objects.values("user", "name")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    ):
+        ids = list(
+            Project.objects.filter(user=row["user"], name=row["name"])
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        # channels move along and are merged by name below
+        Channel.objects.filter(project_id__in=ids[1:]).update(project_id=ids[0])
+        Event.objects.filter(project_id__in=ids[1:]).update(project_id=ids[0])
+        Project.objects.filter(id__in=ids[1:]).delete()
+    for row in (
+        Channel.objects.values("user", "project_id", "name")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by()
+    ):
+        ids = list(
+            Channel.objects.filter(
+                user=row["user"], project_id=row["project_id"], name=row["name"]
+            )
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        Event.objects.filter(channel_id__in=ids[1:]).update(channel_id=ids[0])
+        Channel.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["user", "project_id", "created_at"],
+                name="event_user_project_created",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["user", "channel_id", "created_at"],
+                name="event_user_channel_created",
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="channel",
+            constraint=models.UniqueConstraint(
+                fields=("user", "project_id", "name"),
+                name="unique_channel_name_per_project",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="project",
+            constraint=models.UniqueConstraint(
+                fields=("user", "name"), name="unique_project_name_per_user"
+            ),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_event_indexes_unique_names"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="event",
+            index=models.Index(
+                fields=["user", "created_at"], name="event_user_created"
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:29
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def fill_counters(apps, schema_editor):
+    # historical models only, api.counters follows the current schema
+    Event = apps.get_model("api", "Event")
+    for model_name, field in (("Channel", "channel_id"), ("Project", "project_id")):
+        model = apps.get_model("api", model_name)
+        rows = []
+        for row in (
+            Event.objects.values(field)
+            .annotate(count=Count("id"), first=Min("created_at"), last=Max("created_at"))
+            .order_by()
+        ):
+            rows.append(
+                model(
+                    id=row[field],
+                    event_count=row["count"],
+                    first_event_at=row["first"],
+                    last_event_at=row["last"],
+                )
+            )
+        model.objects.bulk_update(
+            rows, ["event_count", "first_event_at", "last_event_at"], batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_event_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="channel",
+            name="event_count",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="first_event_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="last_event_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="event_count",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="first_event_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="last_event_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_project_channel_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="channel",
+            name="retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="project",
+            name="retention_days",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_archivesegment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="project",
+            name="rate_limit",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
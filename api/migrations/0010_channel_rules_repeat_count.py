@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:47
+
+import django.core.validators
+from django.db import migrations, models
+
+from api import search
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    # adding repeat_count rebuilds api_event on SQLite, which drops its triggers
+    search.install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_project_rate_limit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="channel",
+            name="dedup_window",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="channel",
+            name="sample_rate",
+            field=models.FloatField(
+                blank=True,
+                null=True,
+                validators=[
+                    django.core.validators.MinValueValidator(0.0),
+                    django.core.validators.MaxValueValidator(1.0),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name="event",
+            name="repeat_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+    ]
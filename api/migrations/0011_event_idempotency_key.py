@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+from api import search
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    # a rebuild of api_event on SQLite drops its triggers
+    search.install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0010_channel_rules_repeat_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="event",
+            name="idempotency_key",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="event",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("idempotency_key__isnull", False)),
+                fields=("user", "idempotency_key"),
+                name="unique_event_idempotency_key",
+            ),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+    ]
@@ -8,6 +8,13 @@ id*
 name*
 create_at* (autogen)
 user
+event_count* (maintained by ingest)
+first_event_at (maintained by ingest)
+last_event_at (maintained by ingest)
+retention_days
+rate_limit
+version* (raised by every change)
+changed_at*
 
 Channel
 -------
@@ -16,6 +23,14 @@ project_id*
 name*
 created_at* (autogen)
 user
+event_count* (maintained by ingest)
+first_event_at (maintained by ingest)
+last_event_at (maintained by ingest)
+retention_days (falls back to the project's)
+sample_rate
+dedup_window
+version* (raised by every change)
+changed_at*
 
 Event
 -----
@@ -26,12 +41,33 @@ description
 icon
 created_at (autogen)
 user
+repeat_count* (raised by dedup)
+idempotency_key (unique per user)
+
+EventRollup
+-----------
+channel_id*
+bucket* (minute, hour or day)
+bucket_start*
+count*
+
+ArchiveSegment
+--------------
+channel_id*
+path*
+min_created_at*
+max_created_at*
+count*
+size*
+created_at (autogen)
 """
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
 
@@ -39,6 +75,37 @@ class Project(models.Model):
     name = models.CharField(max_length=35)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # denormalized from Event by ingest, see api/counters.py
+    event_count = models.PositiveBigIntegerField(default=0)
+    first_event_at = models.DateTimeField(null=True)
+    last_event_at = models.DateTimeField(null=True)
+    # days events are kept, None keeps them forever, see api/retention.py
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    # events per second accepted, None uses the RATE_LIMIT_PROJECT setting and
+    # 0 lifts it, see api/ratelimit.py
+    rate_limit = models.PositiveIntegerField(null=True, blank=True)
+    # raised with every change to the project, its channels or events, see api/versions.py
+    version = models.PositiveBigIntegerField(default=1)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "name"], name="unique_project_name_per_user"
+            ),
+        ]
+
+    def delete(self, using=None, keep_parents=False, **kwargs):
+        # events go in chunks first instead of in one long cascade, kwargs are the
+        # chunk_size and pause of delete_events, see api/retention.py
+        from .retention import delete_project_events
+
+        deleted = delete_project_events(self, **kwargs)
+        with transaction.atomic(using=using):
+            total, counts = super().delete(using, keep_parents)
+        # the chunked events count like the ones the cascade deleted
+        counts[Event._meta.label] = counts.get(Event._meta.label, 0) + deleted
+        return total + deleted, counts
 
 
 class Channel(models.Model):
@@ -46,6 +113,44 @@ class Channel(models.Model):
     name = models.CharField(max_length=35)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # denormalized from Event by ingest, see api/counters.py
+    event_count = models.PositiveBigIntegerField(default=0)
+    first_event_at = models.DateTimeField(null=True)
+    last_event_at = models.DateTimeField(null=True)
+    # days events are kept, None keeps them forever, see api/retention.py
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    # fraction of events kept and seconds identical events are collapsed for,
+    # None turns either off, see api/rules.py
+    sample_rate = models.FloatField(
+        null=True, blank=True, validators=[MinValueValidator(0.0), MaxValueValidator(1.0)]
+    )
+    dedup_window = models.PositiveIntegerField(null=True, blank=True)
+    # raised with every change to the channel or its events, see api/versions.py
+    version = models.PositiveBigIntegerField(default=1)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "project_id", "name"],
+                name="unique_channel_name_per_project",
+            ),
+        ]
+
+    def delete(self, using=None, keep_parents=False, **kwargs):
+        # events go in chunks first instead of in one long cascade, kwargs are the
+        # chunk_size and pause of delete_events, see api/retention.py
+        from .retention import delete_channel_events, refresh_project_time_range
+
+        deleted = delete_channel_events(self, **kwargs)
+        with transaction.atomic(using=using):
+            # the counts were already taken off the project chunk by chunk
+            self.refresh_from_db(fields=["event_count"])
+            # events written since the last chunk and archive segments go with the cascade
+            total, counts = super().delete(using, keep_parents)
+        refresh_project_time_range(self.project_id_id, self.user_id)
+        counts[Event._meta.label] = counts.get(Event._meta.label, 0) + deleted
+        return total + deleted, counts
 
 
 class Event(models.Model):
@@ -56,6 +161,79 @@ class Event(models.Model):
     icon = models.CharField(max_length=2, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # identical events collapsed into this row by the channel's dedup window
+    repeat_count = models.PositiveIntegerField(default=1)
+    # client supplied, makes retried POSTs store the event once, see api/idempotency.py
+    idempotency_key = models.CharField(max_length=100, null=True, blank=True)
+
+    class Meta:
+        # listings filter on user and project or channel, then on a created_at range,
+        # and page through the result in (created_at, id) order
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="event_user_created"),
+            models.Index(
+                fields=["user", "project_id", "created_at"],
+                name="event_user_project_created",
+            ),
+            models.Index(
+                fields=["user", "channel_id", "created_at"],
+                name="event_user_channel_created",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "idempotency_key"],
+                condition=models.Q(idempotency_key__isnull=False),
+                name="unique_event_idempotency_key",
+            ),
+        ]
+
+
+class EventRollup(models.Model):
+    """Event count of a channel per minute, hour and day bucket, kept up to date by ingest"""
+
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+    BUCKETS = [MINUTE, HOUR, DAY]
+
+    channel_id = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    bucket = models.CharField(
+        max_length=6, choices=[(bucket, bucket) for bucket in BUCKETS]
+    )
+    bucket_start = models.DateTimeField()
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["channel_id", "bucket", "bucket_start"],
+                name="unique_rollup_bucket_per_channel",
+            ),
+        ]
+
+
+class ArchiveSegment(models.Model):
+    """Compressed file of a channel's archived events, see api/archive.py"""
+
+    channel_id = models.ForeignKey(Channel, on_delete=models.CASCADE)
+    # relative to the ARCHIVE_DIR setting
+    path = models.CharField(max_length=255, unique=True)
+    min_created_at = models.DateTimeField()
+    max_created_at = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    # compressed size in bytes
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # reads look up the segments of a channel overlapping a created_at range
+        indexes = [
+            models.Index(
+                fields=["channel_id", "min_created_at"],
+                name="segment_channel_created",
+            ),
+        ]
 
 
 # auto generate token when user is created
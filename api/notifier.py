@@ -0,0 +1,83 @@
+"""
+Copy Cat Notifier
+=================
+
+In process announcements of new events for live tailing. Ingest publishes
+the newest event id of every channel it wrote to once the transaction
+commits, and tailing requests wait on an asyncio event instead of polling
+the database. Publishing is thread safe, so it works from request threads
+and the buffer flusher alike.
+
+Only writes made by this process are announced. Tailing requests still
+re-check the database every heartbeat, which bounds the delay for events
+written by other processes.
+"""
+import asyncio
+import threading
+
+
+class ChannelNotifier:
+    """Wakes up coroutines waiting for new events on a channel"""
+
+    def __init__(self) -> None:
+        self._latest = {}
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def publish(self, latest: dict) -> None:
+        """Announce new events
+
+        Args:
+            latest (dict): channel id -> id of the newest event written to it
+        """
+        with self._lock:
+            waiters = []
+            for channel_id, event_id in latest.items():
+                if event_id > self._latest.get(channel_id, 0):
+                    self._latest[channel_id] = event_id
+                waiters += self._waiters.get(channel_id, ())
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def latest(self, channel_id: int) -> int:
+        """Newest event id announced for a channel, 0 if none was announced"""
+        return self._latest.get(channel_id, 0)
+
+    async def wait(self, channel_id: int, since_id: int, timeout: float) -> bool:
+        """Wait until an event newer than since_id is announced for a channel
+
+        Args:
+            channel_id (int): channel to wait on
+            since_id (int): id of the newest event the caller has seen
+            timeout (float): seconds to wait at most
+
+        Returns:
+            bool: True if a newer event was announced, False on timeout
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if self._latest.get(channel_id, 0) > since_id:
+                return True
+            self._waiters.setdefault(channel_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(channel_id)
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[channel_id]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._latest.clear()
+
+    def waiting(self) -> int:
+        """Number of coroutines currently waiting on any channel"""
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+
+notifier = ChannelNotifier()
@@ -0,0 +1,149 @@
+"""
+Copy Cat Pagination
+===================
+
+Keyset pagination for event listings. Pages are ordered on
+(created_at, id) and the next page starts after the last row of the
+previous one, so page N is a seek on the created_at indexes instead of an
+OFFSET scan. The cursor handed to clients is opaque.
+"""
+import base64
+import binascii
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.db.models import QuerySet
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework import status
+
+from .conf import get_setting
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Encode the position after a row into an opaque cursor
+
+    Args:
+        created_at (datetime): created_at of the last row on the page
+        id (int): id of the last row on the page
+
+    Returns:
+        str: url safe cursor
+    """
+    position = f"{created_at.isoformat()}|{id}".encode()
+    return base64.urlsafe_b64encode(position).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Decode a cursor made by encode_cursor
+
+    Args:
+        cursor (str): cursor from a previous page
+
+    Raises:
+        ParseError: the cursor is malformed
+
+    Returns:
+        tuple: (created_at, id) of the last row on the previous page
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = position.decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ParseError({"message": "Invalid cursor."})
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over (created_at, id) with a limit query parameter"""
+
+    cursor_query_param = "cursor"
+    limit_query_param = "limit"
+
+    def paginate_queryset(
+        self, queryset: QuerySet, request: Request, view=None, fields=None, archive=None
+    ) -> list:
+        """Get one page of events
+
+        Args:
+            queryset (QuerySet): filtered events, not yet ordered
+            request (Request): incoming http request with optional cursor and limit
+            fields (list, optional): select these fields as values_list() rows
+                instead of building model instances
+            archive (ArchiveReader, optional): merge in archived rows, needs
+                fields to be EVENT_FIELDS
+
+        Returns:
+            list: events or rows on the page
+        """
+        queryset = self.page_queryset(queryset, request, fields)
+        page = list(queryset)
+        if archive is not None:
+            page = archive.merge(page, self.position, self.limit + 1)
+        return self.finish_page(page, fields)
+
+    async def apaginate_queryset(
+        self, queryset: QuerySet, request, fields=None, archive=None
+    ) -> list:
+        """Async version of paginate_queryset, for async views"""
+        queryset = self.page_queryset(queryset, request, fields)
+        page = [row async for row in queryset]
+        if archive is not None:
+            # segment files are read and decompressed off the event loop
+            page = await sync_to_async(archive.merge)(page, self.position, self.limit + 1)
+        return self.finish_page(page, fields)
+
+    def page_queryset(self, queryset: QuerySet, request, fields=None) -> QuerySet:
+        self.limit = self.get_limit(request)
+        queryset = queryset.order_by("created_at", "id")
+
+        cursor = self.get_query_params(request).get(self.cursor_query_param)
+        self.position = None
+        if cursor:
+            created_at, id = self.position = decode_cursor(cursor)
+            # created_at >= c keeps the index range seek, the exclude drops the
+            # rows at c that were already on the previous page
+            queryset = queryset.filter(created_at__gte=created_at).exclude(
+                created_at=created_at, id__lte=id
+            )
+        if fields is not None:
+            queryset = queryset.values_list(*fields)
+
+        # fetch one extra row to know whether there is a next page
+        return queryset[: self.limit + 1]
+
+    def finish_page(self, page: list, fields=None) -> list:
+        self.next_cursor = None
+        if len(page) > self.limit:
+            page = page[: self.limit]
+            if fields is None:
+                self.next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+            else:
+                last = page[-1]
+                self.next_cursor = encode_cursor(
+                    last[fields.index("created_at")], last[fields.index("id")]
+                )
+        return page
+
+    def get_query_params(self, request) -> dict:
+        # DRF requests carry query_params, plain Django requests in async views GET
+        return getattr(request, "query_params", request.GET)
+
+    def get_limit(self, request) -> int:
+        limit = self.get_query_params(request).get(self.limit_query_param)
+        if limit is None:
+            return get_setting("PAGE_SIZE")
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ParseError({"message": "Limit must be an integer."})
+        if limit < 1:
+            raise ParseError({"message": "Limit must be positive."})
+        return min(limit, get_setting("MAX_PAGE_SIZE"))
+
+    def get_paginated_response(self, data) -> Response:
+        return Response(
+            {"next": self.next_cursor, "results": data}, status=status.HTTP_200_OK
+        )
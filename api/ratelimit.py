@@ -0,0 +1,299 @@
+"""
+Copy Cat Rate Limits
+====================
+
+Token buckets limiting how many events a user, through their token, and
+a project may ingest per second. A bucket refills at the rate and holds
+RATE_LIMIT_BURST seconds worth of events, so short bursts pass while a
+sustained flood is turned away with 429 and a Retry-After header.
+
+A check costs one bucket update per user and project in the request and
+never touches the database once the project limits are cached. Project
+limits come from Project.rate_limit, falling back to the RATE_LIMIT_PROJECT
+setting, and are cached for at most NAME_CACHE_SIZE names. Names that match
+no project are not limited, since ingest turns their events away.
+Buckets live in process memory, or with the RATE_LIMIT_STORE setting in
+a memory mapped file that every worker process on the host shares.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .conf import get_setting
+from .ingest import validate_item
+from .models import Project
+
+# key hash, tokens and time of the last update
+SLOT = struct.Struct("<Qdd")
+# slots looked at for a key before the stalest of them is taken over
+PROBES = 8
+
+
+class RateLimited(Exception):
+    """Raised when a user or project has no tokens left for the submitted events"""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+def refill(tokens: float, stamp: float, rate: float, burst: float, now: float) -> float:
+    return min(burst, tokens + (now - stamp) * rate)
+
+
+class MemoryBuckets:
+    """Token buckets of this process"""
+
+    def __init__(self) -> None:
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, costs: list) -> float:
+        """Take tokens from every bucket, or from none of them
+
+        A request larger than the burst passes once the bucket is full and
+        leaves it in debt, so batches bigger than the burst are not refused
+        forever.
+
+        Args:
+            costs (list): (key, rate, burst, count) per bucket
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they refill
+        """
+        now = time.monotonic()
+        with self._lock:
+            left = []
+            for key, rate, burst, count in costs:
+                tokens, stamp = self._buckets.get(key, (burst, now))
+                tokens = refill(tokens, stamp, rate, burst, now)
+                needed = min(count, burst)
+                if tokens < needed:
+                    return (needed - tokens) / rate
+                left.append(tokens - count)
+            for (key, _, _, _), tokens in zip(costs, left):
+                self._buckets[key] = (tokens, now)
+        return 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedBuckets:
+    """Token buckets in a memory mapped file, shared by the processes of a host
+
+    Keys are hashed into a fixed number of slots with linear probing. When
+    every probed slot belongs to another key, the least recently used one is
+    taken over and its bucket starts full again. CLOCK_MONOTONIC is system
+    wide on Linux, so stamps written by one process are valid in another.
+    """
+
+    def __init__(self, path: str, slots: int) -> None:
+        self.slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = SLOT.size * slots
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()
+
+    def take(self, costs: list) -> float:
+        """Take tokens from every bucket, or from none of them, like MemoryBuckets.take"""
+        now = time.monotonic()
+        # the thread lock keeps threads of this process off each other's flock
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                left = []
+                for key, rate, burst, count in costs:
+                    offset, tokens, stamp = self._find(key, burst, now)
+                    tokens = refill(tokens, stamp, rate, burst, now)
+                    needed = min(count, burst)
+                    if tokens < needed:
+                        return (needed - tokens) / rate
+                    left.append((offset, key, tokens - count))
+                for offset, key, tokens in left:
+                    SLOT.pack_into(self._map, offset, self._hash(key), tokens, now)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._map[:] = bytes(len(self._map))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _hash(self, key: str) -> int:
+        # builtin hash() is salted per process, 0 marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+    def _find(self, key: str, burst: float, now: float) -> tuple:
+        key_hash = self._hash(key)
+        stalest = None
+        for probe in range(PROBES):
+            offset = (key_hash + probe) % self.slots * SLOT.size
+            slot_hash, tokens, stamp = SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, stamp
+            if slot_hash == 0:
+                return offset, burst, now
+            if stalest is None or stamp < stalest[1]:
+                stalest = (offset, stamp)
+        return stalest[0], burst, now
+
+
+class ProjectLimits:
+    """Events per second allowed per (user id, project name), in a bounded LRU cache
+
+    Names of projects that do not exist are cached as well, as unlimited, so
+    they take no bucket and requests naming them again run no query.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached(self, user_id: int, names) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            for name in names:
+                entry = self._entries.get((user_id, name))
+                if entry is None or entry[1] < now:
+                    return False
+        return True
+
+    def get(self, user_id: int, name: str) -> Optional[float]:
+        """Get the limit of a project, reading it from the database on a miss
+
+        Returns:
+            Optional[float]: events per second, None when the project is not
+            limited or does not exist
+        """
+        key = (user_id, name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        row = Project.objects.filter(user=user_id, name=name).values_list("rate_limit").first()
+        # ingest turns away events of unknown projects, they need no bucket
+        limit = None
+        if row is not None:
+            limit = row[0] if row[0] is not None else get_setting("RATE_LIMIT_PROJECT")
+            # 0 on the project lifts the default limit
+            limit = limit or None
+        with self._lock:
+            self._entries[key] = (limit, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return limit
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_buckets = None
+_lock = threading.Lock()
+project_limits = ProjectLimits(get_setting("NAME_CACHE_SIZE"), get_setting("NAME_CACHE_TTL"))
+
+
+def get_buckets():
+    """Get the process wide buckets, opening the shared store on first use"""
+    global _buckets
+    if _buckets is None:
+        with _lock:
+            if _buckets is None:
+                path = get_setting("RATE_LIMIT_STORE")
+                if path:
+                    _buckets = SharedBuckets(path, get_setting("RATE_LIMIT_SLOTS"))
+                else:
+                    _buckets = MemoryBuckets()
+    return _buckets
+
+
+def rate_limiting_enabled() -> bool:
+    return get_setting("RATE_LIMITING")
+
+
+def project_counts(items) -> dict:
+    """Count events per project name in a single item or a batch
+
+    Args:
+        items (list): request items, invalid ones are skipped
+
+    Returns:
+        dict: project name -> number of events
+    """
+    counts = {}
+    for item in items:
+        # items ingest rejects are not written, so they cost no tokens
+        if validate_item(item) is None:
+            name = str(item["project"])
+            counts[name] = counts.get(name, 0) + 1
+    return counts
+
+
+def check_ingest(user_id: int, projects: dict) -> None:
+    """Take tokens for the events of a request from the user's and projects' buckets
+
+    Args:
+        user_id (int): user posting the events
+        projects (dict): project name -> number of events, from project_counts()
+
+    Raises:
+        RateLimited: a bucket has too few tokens, nothing was taken
+    """
+    burst_seconds = get_setting("RATE_LIMIT_BURST")
+    costs = []
+    user_rate = get_setting("RATE_LIMIT_USER")
+    if user_rate:
+        costs.append(
+            (f"user:{user_id}", user_rate, user_rate * burst_seconds, sum(projects.values()))
+        )
+    for name, count in projects.items():
+        rate = project_limits.get(user_id, name)
+        if rate:
+            costs.append((f"project:{user_id}:{name}", rate, rate * burst_seconds, count))
+    if not costs:
+        return
+    wait = get_buckets().take(costs)
+    if wait:
+        raise RateLimited(wait)
+
+
+async def acheck_ingest(user_id: int, projects: dict) -> None:
+    """Async version of check_ingest, only leaving the event loop to read project limits"""
+    if project_limits.cached(user_id, projects):
+        check_ingest(user_id, projects)
+    else:
+        await sync_to_async(check_ingest)(user_id, projects)
+
+
+def retry_after(exc: RateLimited) -> str:
+    return str(max(1, math.ceil(exc.retry_after)))
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_limits(sender, instance=None, **kwargs) -> None:
+    project_limits.clear()
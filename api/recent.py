@@ -0,0 +1,285 @@
+"""
+Copy Cat Recent Events
+======================
+
+Dashboards mostly want the newest events of a channel. The recent events
+endpoint answers them from an in process ring per channel, holding the
+newest RECENT_EVENTS_SIZE events already rendered to json, so a read
+joins bytes instead of querying and serializing rows.
+
+A ring is filled from the database the first time its channel is read,
+topped up from the archive when the hot table holds fewer events. From
+then on ingest adds every event it commits to the rings that exist, so
+channels nobody reads cost nothing. Rings are evicted least recently read
+first once they hold RECENT_EVENTS_MAX_BYTES of json together, and are
+read again after RECENT_EVENTS_TTL seconds, which bounds how long writes
+made by other processes go unseen.
+
+Purges, archiving, imports and channel deletes drop the rings of the
+channels they touch; repeat counts written by the dedup rules are applied
+to the rendered events in place.
+"""
+import threading
+import time
+from bisect import insort
+from collections import OrderedDict
+from typing import Optional
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .conf import get_setting
+from .models import ArchiveSegment, Channel, Event
+from .renderers import FastJSONRenderer
+from .serializers import EVENT_FIELDS, event_row
+
+CREATED_AT = EVENT_FIELDS.index("created_at")
+ID = EVENT_FIELDS.index("id")
+# model attributes holding the EVENT_FIELDS values of an Event, foreign keys by id
+ATTNAMES = [Event._meta.get_field(name).attname for name in EVENT_FIELDS]
+
+renderer = FastJSONRenderer()
+
+
+def event_values(event: Event) -> tuple:
+    return tuple(getattr(event, name) for name in ATTNAMES)
+
+
+def render_rows(rows) -> list:
+    """Render EVENT_FIELDS rows to ring entries
+
+    Returns:
+        list: ((created_at, id), json) per row
+    """
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    return [
+        ((row[CREATED_AT], row[ID]), renderer.encode(event_row(row, tz)))
+        for row in rows
+    ]
+
+
+def newest_rows(user_id: int, channel_id: int, count: int) -> list:
+    """Read the newest events of a channel, hot and archived
+
+    Returns:
+        list: up to count EVENT_FIELDS rows, newest first
+    """
+    rows = list(
+        Event.objects.filter(user=user_id, channel_id=channel_id)
+        .order_by("-created_at", "-id")
+        .values_list(*EVENT_FIELDS)[:count]
+    )
+    if len(rows) == count:
+        return rows
+
+    # take segments from the newest until they cover the missing events and
+    # no older segment can overlap them
+    from .archive import read_segment
+
+    wanted = count - len(rows)
+    archived = []
+    lowest = None
+    for segment in ArchiveSegment.objects.filter(channel_id=channel_id).order_by(
+        "-max_created_at"
+    ):
+        if wanted <= 0 and segment.max_created_at < lowest:
+            break
+        archived += read_segment(segment.path)[1]
+        wanted -= segment.count
+        if lowest is None or segment.min_created_at < lowest:
+            lowest = segment.min_created_at
+    archived.sort(key=lambda row: (row[CREATED_AT], row[ID]), reverse=True)
+    return rows + archived[: count - len(rows)]
+
+
+class Ring:
+    """Newest events of one channel as ((created_at, id), json) entries, oldest first"""
+
+    __slots__ = ("ready", "expires", "entries", "ids", "size")
+
+    def __init__(self, expires: float) -> None:
+        self.ready = False
+        self.expires = expires
+        self.entries = []
+        self.ids = set()
+        self.size = 0
+
+    def insert(self, entry: tuple, limit: int) -> int:
+        """Add an entry, dropping the oldest beyond limit
+
+        Returns:
+            int: change in json bytes held
+        """
+        key = entry[0]
+        if key[1] in self.ids:
+            return 0
+        before = self.size
+        if not self.entries or key > self.entries[-1][0]:
+            self.entries.append(entry)
+        else:
+            # the (created_at, id) key is unique, so the json is never compared
+            insort(self.entries, entry)
+        self.ids.add(key[1])
+        self.size += len(entry[1])
+        while len(self.entries) > limit:
+            old = self.entries.pop(0)
+            self.ids.discard(old[0][1])
+            self.size -= len(old[1])
+        return self.size - before
+
+
+class RecentEvents:
+    """Rings of the channels read recently, bounded in events per ring and in total bytes"""
+
+    def __init__(self, size: int, max_bytes: int, ttl: float) -> None:
+        self.size = size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._rings = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, channel_id: int, count: int) -> Optional[list]:
+        """Get the newest events of a channel from its ring, without a query
+
+        Args:
+            channel_id (int): channel to read
+            count (int): number of events wanted, at most size
+
+        Returns:
+            Optional[list]: json of the events, oldest first, or None when the
+            ring has to be read from the database first
+        """
+        with self._lock:
+            ring = self._rings.get(channel_id)
+            if ring is None or not ring.ready or ring.expires < time.monotonic():
+                return None
+            self._rings.move_to_end(channel_id)
+            self.hits += 1
+            return [data for _, data in ring.entries[-count:]]
+
+    def read(self, user_id: int, channel_id: int, count: int) -> list:
+        """Get the newest events of a channel, filling its ring on a miss
+
+        Args:
+            user_id (int): owner of the channel
+            channel_id (int): channel to read
+            count (int): number of events wanted, at most size
+
+        Returns:
+            list: json of the events, oldest first
+        """
+        cached = self.get(channel_id, count)
+        if cached is not None:
+            return cached
+
+        # the empty ring is registered before the query, so events committed
+        # while it runs are added to it, and a purge meanwhile drops it
+        ring = Ring(time.monotonic() + self.ttl)
+        with self._lock:
+            self.misses += 1
+            self._replace(channel_id, ring)
+        entries = render_rows(newest_rows(user_id, channel_id, self.size))
+        with self._lock:
+            for entry in entries:
+                added = ring.insert(entry, self.size)
+                if self._rings.get(channel_id) is ring:
+                    self.bytes += added
+            ring.ready = True
+            self._evict(channel_id)
+            return [data for _, data in ring.entries[-count:]]
+
+    def add(self, events: list) -> None:
+        """Add written events to the rings of their channels, if they have one"""
+        events = [event for event in events if event.channel_id_id in self._rings]
+        if not events:
+            return
+        entries = render_rows([event_values(event) for event in events])
+        with self._lock:
+            for event, entry in zip(events, entries):
+                ring = self._rings.get(event.channel_id_id)
+                if ring is not None:
+                    self.bytes += ring.insert(entry, self.size)
+            self._evict()
+
+    def update(self, events: list) -> None:
+        """Render events again whose repeat count changed, if their ring holds them"""
+        events = [event for event in events if event.channel_id_id in self._rings]
+        if not events:
+            return
+        entries = render_rows([event_values(event) for event in events])
+        with self._lock:
+            for event, entry in zip(events, entries):
+                ring = self._rings.get(event.channel_id_id)
+                if ring is None or event.pk not in ring.ids:
+                    continue
+                for index, (key, data) in enumerate(ring.entries):
+                    if key == entry[0]:
+                        ring.entries[index] = entry
+                        ring.size += len(entry[1]) - len(data)
+                        self.bytes += len(entry[1]) - len(data)
+                        break
+
+    def invalidate(self, channel_ids) -> None:
+        with self._lock:
+            for channel_id in channel_ids:
+                self._replace(channel_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rings.clear()
+            self.bytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._rings),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _replace(self, channel_id: int, ring: Optional[Ring]) -> None:
+        old = self._rings.pop(channel_id, None)
+        if old is not None:
+            self.bytes -= old.size
+        if ring is not None:
+            self._rings[channel_id] = ring
+            self.bytes += ring.size
+
+    def _evict(self, keep: Optional[int] = None) -> None:
+        # least recently read rings go first, the one being read stays
+        while self.bytes > self.max_bytes and len(self._rings) > 1:
+            channel_id = next(iter(self._rings))
+            if channel_id == keep:
+                self._rings.move_to_end(channel_id)
+                channel_id = next(iter(self._rings))
+            self._replace(channel_id, None)
+
+
+recent_events = RecentEvents(
+    get_setting("RECENT_EVENTS_SIZE"),
+    get_setting("RECENT_EVENTS_MAX_BYTES"),
+    get_setting("RECENT_EVENTS_TTL"),
+)
+
+
+def render_recent(events: list) -> bytes:
+    """Response body of the recent events endpoint
+
+    Args:
+        events (list): json of the events, oldest first
+
+    Returns:
+        bytes: {"results": [...]}, as the renderer would output it
+    """
+    return b'{"results":[' + b",".join(events) + b"]}"
+
+
+@receiver(post_delete, sender=Channel)
+def invalidate_recent_events(sender, instance=None, **kwargs) -> None:
+    recent_events.invalidate([instance.id])
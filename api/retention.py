@@ -0,0 +1,212 @@
+"""
+Copy Cat Retention
+==================
+
+Deletes old events, and the events of deleted projects and channels, in
+bounded chunks. Each chunk is a range of ids removed in its own short
+transaction, followed by an optional pause, so ingest keeps getting the
+write lock while a purge runs. Project.delete() and Channel.delete()
+remove their events this way, taking the chunk_size and pause of
+delete_events as keyword arguments, and leave only the project and channel
+rows to the cascade; QuerySet.delete() and the cascade from a deleted user
+do not.
+Archive segments are deleted whole, once their newest event has expired.
+
+Events are kept for the channel's retention_days, falling back to its
+project's and then to the RETENTION_DAYS setting. None keeps events forever.
+"""
+import time
+from datetime import timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .archive import delete_segments
+from .conf import get_setting
+from .counters import refresh_time_range, remove_counts
+from .models import ArchiveSegment, Channel, Event, Project
+from .recent import recent_events
+
+
+def retention_days(channel: Channel) -> Optional[int]:
+    """Number of days a channel's events are kept
+
+    Args:
+        channel (Channel): channel with its project selected
+
+    Returns:
+        Optional[int]: days to keep events, None to keep them forever
+    """
+    if channel.retention_days is not None:
+        return channel.retention_days
+    if channel.project_id.retention_days is not None:
+        return channel.project_id.retention_days
+    return get_setting("RETENTION_DAYS")
+
+
+def delete_events(events, chunk_size: Optional[int] = None, pause: Optional[float] = None) -> int:
+    """Delete events chunk by chunk, in id order
+
+    The project and channel counters are adjusted in the same transaction
+    as every chunk.
+
+    Args:
+        events (QuerySet): events to delete
+        chunk_size (int, optional): events deleted per transaction
+        pause (float, optional): seconds to sleep between chunks
+
+    Returns:
+        int: number of deleted events
+    """
+    chunk_size = chunk_size or get_setting("PURGE_CHUNK_SIZE")
+    pause = get_setting("PURGE_PAUSE") if pause is None else pause
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = list(
+            events.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return deleted
+        # the range holds exactly the selected ids once filtered like the select
+        chunk = events.filter(id__gte=ids[0], id__lte=ids[-1])
+        with transaction.atomic():
+            channels = {}
+            projects = {}
+            for project_id, channel_id, count in (
+                chunk.values_list("project_id", "channel_id")
+                .annotate(count=Count("id"))
+                .order_by()
+            ):
+                channels[channel_id] = count
+                projects[project_id] = projects.get(project_id, 0) + count
+            deleted += chunk.delete()[0]
+            remove_counts(Channel, channels)
+            remove_counts(Project, projects)
+        recent_events.invalidate(channels)
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def refresh_project_time_range(project_id: int, user_id: int) -> None:
+    refresh_time_range(
+        Project,
+        project_id,
+        Event.objects.filter(user=user_id, project_id=project_id),
+        ArchiveSegment.objects.filter(channel_id__project_id=project_id),
+    )
+
+
+def purge_channel(channel: Channel, days: int, **kwargs) -> int:
+    """Delete the events of a channel older than its retention
+
+    Args:
+        channel (Channel): channel to purge
+        days (int): number of days of events to keep
+        **kwargs: chunk_size and pause, passed to delete_events
+
+    Returns:
+        int: number of deleted events
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    events = Event.objects.filter(
+        user=channel.user_id, channel_id=channel.id, created_at__lt=cutoff
+    )
+    deleted = delete_events(events, **kwargs)
+    deleted += delete_segments(
+        ArchiveSegment.objects.filter(channel_id=channel.id, max_created_at__lt=cutoff)
+    )
+    if deleted:
+        refresh_time_range(
+            Channel,
+            channel.id,
+            Event.objects.filter(user=channel.user_id, channel_id=channel.id),
+            ArchiveSegment.objects.filter(channel_id=channel.id),
+        )
+        refresh_project_time_range(channel.project_id_id, channel.user_id)
+    return deleted
+
+
+def purge_expired(channels=None, **kwargs) -> int:
+    """Delete the events of every channel that are older than its retention
+
+    Args:
+        channels (QuerySet, optional): channels to purge, all of them by default
+        **kwargs: chunk_size and pause, passed to delete_events
+
+    Returns:
+        int: number of deleted events
+    """
+    channels = (Channel.objects.all() if channels is None else channels).select_related(
+        "project_id"
+    )
+    deleted = 0
+    for channel in channels.iterator():
+        days = retention_days(channel)
+        if days is not None:
+            deleted += purge_channel(channel, days, **kwargs)
+    return deleted
+
+
+def delete_channel_events(channel: Channel, **kwargs) -> int:
+    """Delete the events of a channel in chunks, ahead of the channel itself
+
+    Args:
+        channel (Channel): channel about to be deleted
+        **kwargs: chunk_size and pause, passed to delete_events
+
+    Returns:
+        int: number of deleted events
+    """
+    return delete_events(
+        Event.objects.filter(user=channel.user_id, channel_id=channel.id), **kwargs
+    )
+
+
+def delete_project_events(project: Project, **kwargs) -> int:
+    """Delete the events of a project in chunks, channel by channel, ahead of the project
+
+    Args:
+        project (Project): project about to be deleted
+        **kwargs: chunk_size and pause, passed to delete_events
+
+    Returns:
+        int: number of deleted events
+    """
+    deleted = 0
+    for channel_id in Channel.objects.filter(project_id=project.id).values_list("id", flat=True):
+        deleted += delete_events(
+            Event.objects.filter(user=project.user_id, channel_id=channel_id), **kwargs
+        )
+    return deleted
+
+
+def delete_channel(channel: Channel, **kwargs) -> int:
+    """Delete a channel, removing its events in chunks first
+
+    Args:
+        channel (Channel): channel to delete
+        **kwargs: chunk_size and pause, passed to delete_events
+
+    Returns:
+        int: number of deleted events
+    """
+    return channel.delete(**kwargs)[1].get(Event._meta.label, 0)
+
+
+def delete_project(project: Project, **kwargs) -> int:
+    """Delete a project, removing the events of its channels in chunks first
+
+    Args:
+        project (Project): project to delete
+        **kwargs: chunk_size and pause, passed to delete_events
+
+    Returns:
+        int: number of deleted events
+    """
+    return project.delete(**kwargs)[1].get(Event._meta.label, 0)
@@ -0,0 +1,115 @@
+"""
+Copy Cat Rollups
+================
+
+Per channel event counts in minute, hour and day buckets. Ingest adds the
+counts of every written batch with a single upsert, so reading stats never
+touches the Event table.
+"""
+from collections import Counter
+from datetime import datetime
+
+from django.db import connection
+
+from .models import EventRollup
+
+ROWS_PER_STATEMENT = 1000
+
+
+def truncate(value: datetime, bucket: str) -> datetime:
+    """Truncate a datetime to the start of its bucket
+
+    Args:
+        value (datetime): aware datetime
+        bucket (str): minute, hour or day
+
+    Returns:
+        datetime: start of the bucket the datetime falls in
+    """
+    value = value.replace(second=0, microsecond=0)
+    if bucket in (EventRollup.HOUR, EventRollup.DAY):
+        value = value.replace(minute=0)
+    if bucket == EventRollup.DAY:
+        value = value.replace(hour=0)
+    return value
+
+
+def count_events(events: list) -> Counter:
+    """Count saved events per (channel id, bucket, bucket start)
+
+    Args:
+        events (list): saved events with created_at set
+
+    Returns:
+        Counter: event count per rollup key
+    """
+    counts = Counter()
+    for event in events:
+        for bucket in EventRollup.BUCKETS:
+            counts[(event.channel_id_id, bucket, truncate(event.created_at, bucket))] += 1
+    return counts
+
+
+def count_minutes(minutes: Counter) -> Counter:
+    """Spread event counts per (channel id, minute) over every bucket
+
+    Bulk loads count events per minute first, so each distinct minute is
+    truncated once instead of every event three times.
+
+    Args:
+        minutes (Counter): event count per (channel id, start of the minute)
+
+    Returns:
+        Counter: event count per rollup key
+    """
+    counts = Counter()
+    for (channel_id, minute), count in minutes.items():
+        for bucket in EventRollup.BUCKETS:
+            counts[(channel_id, bucket, truncate(minute, bucket))] += count
+    return counts
+
+
+def add_counts(counts: Counter) -> None:
+    """Add event counts to the rollups in one statement
+
+    Args:
+        counts (Counter): event count per (channel id, bucket, bucket start)
+    """
+    if not counts:
+        return
+
+    qn = connection.ops.quote_name
+    table = qn(EventRollup._meta.db_table)
+    channel = qn(EventRollup._meta.get_field("channel_id").column)
+    count = qn("count")
+    rows = [
+        (
+            channel_id,
+            bucket,
+            connection.ops.adapt_datetimefield_value(bucket_start),
+            value,
+        )
+        for (channel_id, bucket, bucket_start), value in counts.items()
+    ]
+    with connection.cursor() as cursor:
+        # keep each statement well under the sqlite bound parameter limit
+        for offset in range(0, len(rows), ROWS_PER_STATEMENT):
+            chunk = rows[offset : offset + ROWS_PER_STATEMENT]
+            # insert new buckets and add to the count of existing ones
+            cursor.execute(
+                f"INSERT INTO {table} "
+                f"({channel}, {qn('bucket')}, {qn('bucket_start')}, {count}) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))} "
+                f"ON CONFLICT ({channel}, {qn('bucket')}, {qn('bucket_start')}) "
+                f"DO UPDATE SET {count} = {table}.{count} + excluded.{count}",
+                [param for row in chunk for param in row],
+            )
+
+
+def update_rollups(events: list) -> None:
+    """Add a batch of just written events to the rollups
+
+    Args:
+        events (list): saved events
+    """
+    add_counts(count_events(events))
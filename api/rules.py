@@ -0,0 +1,252 @@
+"""
+Copy Cat Ingest Rules
+=====================
+
+Per channel sampling and deduplication, applied to resolved events before
+anything is written. A channel's sample_rate keeps that fraction of its
+events at random and drops the rest. With a dedup_window, an event with
+the same (channel, event_name, description) as one written less than
+dedup_window seconds before is not written either; the repeat_count of
+the first row is raised instead. Events with an idempotency key are never
+collapsed, so that a retry is recognized by its key.
+
+Rules are cached in process and dropped when a channel is saved. Repeats
+are counted in memory and added to the rows with one UPDATE per row,
+at most every DEDUP_FLUSH_INTERVAL seconds, after a write of events
+commits and at interpreter exit. Project and channel counters and rollups count
+written rows, not repeats.
+"""
+import atexit
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .conf import get_setting
+from .models import Channel, Event, Project
+from .recent import recent_events
+from .versions import bump
+
+# seconds after its window closed that a repeat of a never written event is forgotten
+UNWRITTEN_GRACE = 60
+
+
+class EventSkipped(Exception):
+    """Raised when a rule or a repeated idempotency key keeps an event from being written"""
+
+    def __init__(self, message: str, event_id: Optional[int] = None, status: int = 202) -> None:
+        super().__init__(message)
+        self.message = message
+        self.event_id = event_id
+        self.status = status
+
+    def body(self) -> dict:
+        """Response body for the skipped event, with the id of the row it went to"""
+        body = {"message": self.message}
+        if self.event_id is not None:
+            body["id"] = self.event_id
+        return body
+
+    def result(self) -> dict:
+        """Batch result of the skipped event"""
+        return {"status": self.status, **self.body()}
+
+
+class ChannelRules:
+    """(sample rate, dedup window) per channel id, cached in process"""
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._entries = {}
+
+    def cached(self, channel_ids) -> bool:
+        now = time.monotonic()
+        for channel_id in channel_ids:
+            entry = self._entries.get(channel_id)
+            if entry is None or entry[1] < now:
+                return False
+        return True
+
+    def get(self, channel_ids) -> dict:
+        """Get the rules of channels, reading the missing ones with one query
+
+        Returns:
+            dict: channel id -> (sample rate or None, dedup window or None)
+        """
+        now = time.monotonic()
+        rules = {}
+        missing = []
+        for channel_id in channel_ids:
+            entry = self._entries.get(channel_id)
+            if entry is None or entry[1] < now:
+                missing.append(channel_id)
+            else:
+                rules[channel_id] = entry[0]
+        if missing:
+            for channel_id, sample_rate, dedup_window in Channel.objects.filter(
+                id__in=missing
+            ).values_list("id", "sample_rate", "dedup_window"):
+                rules[channel_id] = (sample_rate, dedup_window)
+                self._entries[channel_id] = (rules[channel_id], now + self.ttl)
+        return rules
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class Repeats:
+    """First event of every open dedup window and the repeats not yet written"""
+
+    def __init__(self, max_keys: int, flush_interval: float) -> None:
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        self.collapsed = 0
+        # (channel id, event name, description) -> [event, window end, repeats]
+        self._windows = OrderedDict()
+        self._dirty = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def collapse(self, event: Event, window: int, now: float) -> Optional[Event]:
+        """Count an event as a repeat of an open window, or open one for it
+
+        Args:
+            event (Event): unsaved event
+            window (int): dedup window of its channel in seconds
+            now (float): monotonic time of the request
+
+        Returns:
+            Optional[Event]: the first event of the window when the event is
+            a repeat, None when it has to be written
+        """
+        key = (event.channel_id_id, event.event_name, event.description)
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is not None and now < entry[1]:
+                entry[2] += 1
+                self._dirty[key] = entry
+                self.collapsed += 1
+                return entry[0]
+            if entry is not None:
+                self._retire(key, entry)
+            self._windows[key] = [event, now + window, 0]
+            # windows open in time order, so the oldest ones are evicted first
+            while len(self._windows) > self.max_keys:
+                self._retire(*self._windows.popitem(last=False))
+        return None
+
+    def forget(self, events: list) -> None:
+        """Close the windows of events that were not written or whose insert rolled back"""
+        with self._lock:
+            for event in events:
+                key = (event.channel_id_id, event.event_name, event.description)
+                entry = self._windows.get(key)
+                if entry is not None and entry[0] is event:
+                    del self._windows[key]
+                    self._dirty.pop(key, None)
+
+    def due(self) -> bool:
+        return bool(self._dirty) and time.monotonic() - self._last_flush >= self.flush_interval
+
+    def flush(self) -> None:
+        """Add the counted repeats to the rows of written events
+
+        Runs in its own transaction, outside the one writing events, and puts
+        the counts back when it fails.
+        """
+        with self._lock:
+            now = self._last_flush = time.monotonic()
+            pending = []
+            for key, entry in list(self._dirty.items()):
+                # queued events are counted once the buffer has written them
+                if entry[0].pk is not None:
+                    pending.append((key, entry, entry[2]))
+                    entry[2] = 0
+                    del self._dirty[key]
+                elif now > entry[1] + UNWRITTEN_GRACE:
+                    # the event was turned away by a full buffer
+                    del self._dirty[key]
+        if not pending:
+            return
+        try:
+            with transaction.atomic():
+                for key, entry, repeats in pending:
+                    Event.objects.filter(pk=entry[0].pk).update(
+                        repeat_count=F("repeat_count") + repeats
+                    )
+                events = [entry[0] for _, entry, _ in pending]
+                bump(Channel, {event.channel_id_id for event in events})
+                bump(Project, {event.project_id_id for event in events})
+                transaction.on_commit(lambda: self._written(pending))
+        except Exception:
+            # the counts go back, so the next flush writes them
+            with self._lock:
+                for key, entry, repeats in pending:
+                    entry[2] += repeats
+                    if self._dirty.get(key, entry) is not entry:
+                        key = (key, id(entry))
+                    self._dirty[key] = entry
+            raise
+
+    def stats(self) -> dict:
+        return {"windows": len(self._windows), "pending": len(self._dirty), "collapsed": self.collapsed}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._windows.clear()
+            self._dirty.clear()
+
+    def _written(self, pending: list) -> None:
+        for _, entry, repeats in pending:
+            entry[0].repeat_count += repeats
+        recent_events.update([entry[0] for _, entry, _ in pending])
+
+    def _retire(self, key: tuple, entry: list) -> None:
+        # a closed window keeps its unwritten repeats until the next flush
+        self._windows.pop(key, None)
+        if self._dirty.pop(key, None) is not None:
+            self._dirty[(key, id(entry))] = entry
+
+
+channel_rules = ChannelRules(get_setting("NAME_CACHE_TTL"))
+repeats = Repeats(get_setting("DEDUP_MAX_KEYS"), get_setting("DEDUP_FLUSH_INTERVAL"))
+
+
+def apply_rules(events: list) -> list:
+    """Sample and collapse resolved events
+
+    Args:
+        events (list): unsaved events with channel ids set
+
+    Returns:
+        list: None for every event to write, EventSkipped for the others
+    """
+    rules = channel_rules.get({event.channel_id_id for event in events})
+    now = time.monotonic()
+    skipped = []
+    for event in events:
+        sample_rate, dedup_window = rules.get(event.channel_id_id, (None, None))
+        if sample_rate is not None and random.random() >= sample_rate:
+            skipped.append(EventSkipped("Event dropped by sampling."))
+            continue
+        first = None
+        if dedup_window and event.idempotency_key is None:
+            first = repeats.collapse(event, dedup_window, now)
+        if first is not None:
+            skipped.append(EventSkipped("Event collapsed into a repeat.", first.pk))
+            continue
+        skipped.append(None)
+    return skipped
+
+
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+def invalidate_channel_rules(sender, instance=None, **kwargs) -> None:
+    channel_rules.clear()
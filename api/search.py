@@ -0,0 +1,163 @@
+"""
+Copy Cat Search
+===============
+
+Full text search over event names and descriptions with an SQLite FTS5
+table. The table indexes api_event as external content, so the text is
+not stored twice, and triggers on api_event keep it in sync with every
+insert, update and delete, bulk inserts included.
+
+SQLite drops a table's triggers when Django rebuilds that table during a
+migration, so migrations that alter Event must call install() again.
+"""
+from django.db import connection as default_connection
+from django.db import transaction
+
+from .models import Event
+
+FTS_TABLE = "api_event_fts"
+
+CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    event_name, description, content='api_event', content_rowid='id'
+)
+"""
+
+CREATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON api_event BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, event_name, description)
+        VALUES (new.id, new.event_name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON api_event BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, event_name, description)
+        VALUES ('delete', old.id, old.event_name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF event_name, description ON api_event BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, event_name, description)
+        VALUES ('delete', old.id, old.event_name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, event_name, description)
+        VALUES (new.id, new.event_name, new.description);
+    END
+    """,
+]
+
+DROP_TRIGGERS = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+]
+
+DROP = DROP_TRIGGERS + [f"DROP TABLE IF EXISTS {FTS_TABLE}"]
+
+
+def supported(connection=default_connection) -> bool:
+    return connection.vendor == "sqlite"
+
+
+def install(connection=default_connection) -> None:
+    """Create the search table and its triggers if they do not exist
+
+    Args:
+        connection: database connection, the default one if not given
+    """
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for sql in CREATE_TRIGGERS:
+            cursor.execute(sql)
+
+
+def uninstall(connection=default_connection) -> None:
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in DROP:
+            cursor.execute(sql)
+
+
+def rebuild(connection=default_connection) -> None:
+    """Re-index every event from api_event
+
+    Args:
+        connection: database connection, the default one if not given
+    """
+    install(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def suspend(connection=default_connection) -> None:
+    """Stop indexing inserts one by one, for bulk loads
+
+    resume() must follow, or rebuild() if the process dies before it can.
+
+    Args:
+        connection: database connection, the default one if not given
+    """
+    if not supported(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in DROP_TRIGGERS:
+            cursor.execute(sql)
+
+
+def resume(after_id: int, connection=default_connection) -> None:
+    """Index the events written since suspend() in one pass and recreate the triggers
+
+    Args:
+        after_id (int): largest event id when the index was suspended
+        connection: database connection, the default one if not given
+    """
+    if not supported(connection):
+        return
+    # in one transaction, so no event lands between the catch up and the triggers
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, event_name, description) "
+            f"SELECT id, event_name, description FROM {Event._meta.db_table} WHERE id > %s",
+            [after_id],
+        )
+        for sql in CREATE_TRIGGERS:
+            cursor.execute(sql)
+
+
+def quote_query(query: str) -> str:
+    """Turn free text into an FTS5 query matching every word
+
+    Each word becomes a quoted string, so punctuation in ids such as
+    ORD-1234 is matched as a phrase instead of being parsed as FTS5 syntax.
+
+    Args:
+        query (str): text typed by the user
+
+    Returns:
+        str: FTS5 match expression
+    """
+    return " ".join('"' + word.replace('"', '""') + '"' for word in query.split())
+
+
+def search_events(events, query: str):
+    """Restrict events to full text matches, best match first
+
+    Args:
+        events (QuerySet): events already filtered by user, project, channel and time
+        query (str): text typed by the user
+
+    Returns:
+        QuerySet: matching events ordered by bm25 rank
+    """
+    table = Event._meta.db_table
+    return events.extra(
+        tables=[FTS_TABLE],
+        where=[f"{FTS_TABLE}.rowid = {table}.id", f"{FTS_TABLE} MATCH %s"],
+        params=[quote_query(query)],
+        select={"rank": f"{FTS_TABLE}.rank"},
+        order_by=["rank", "-id"],
+    )
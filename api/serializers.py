@@ -1,3 +1,6 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Project, Channel, Event
 
@@ -10,7 +13,15 @@ class ProjectSerializer(serializers.ModelSerializer):
             "name",
             "created_at",
             "user",
+            "event_count",
+            "first_event_at",
+            "last_event_at",
+            "retention_days",
+            "rate_limit",
         ]
+        read_only_fields = ["event_count", "first_event_at", "last_event_at"]
+        # name uniqueness is enforced by the database constraint, not a read before write
+        validators = []
 
 
 class ChannelSerializer(serializers.ModelSerializer):
@@ -22,7 +33,16 @@ class ChannelSerializer(serializers.ModelSerializer):
             "name",
             "created_at",
             "user",
+            "event_count",
+            "first_event_at",
+            "last_event_at",
+            "retention_days",
+            "sample_rate",
+            "dedup_window",
         ]
+        read_only_fields = ["event_count", "first_event_at", "last_event_at"]
+        # name uniqueness is enforced by the database constraint, not a read before write
+        validators = []
 
 
 class EventSerializer(serializers.ModelSerializer):
@@ -37,4 +57,73 @@ class EventSerializer(serializers.ModelSerializer):
             "icon",
             "created_at",
             "user",
+            "repeat_count",
         ]
+
+
+def format_datetime(value, tz):
+    """Format a datetime the way DRF's DateTimeField renders it
+
+    Args:
+        value (datetime): aware datetime, or None
+        tz: timezone the output is converted to, None when USE_TZ is off
+
+    Returns:
+        str: iso 8601 string with a Z suffix for UTC
+    """
+    if not value:
+        return None
+    if tz is not None:
+        value = value.astimezone(tz)
+    value = value.isoformat()
+    if value.endswith("+00:00"):
+        value = value[:-6] + "Z"
+    return value
+
+
+def compile_row_serializer(serializer_class) -> tuple:
+    """Build a fast read path for a ModelSerializer with only model fields
+
+    The returned function turns one values_list() row into the same dict the
+    serializer outputs for that model instance, without building the instance
+    or walking serializer fields. The fields are looked up once, at import time.
+
+    Args:
+        serializer_class: ModelSerializer whose Meta lists the output fields
+
+    Returns:
+        tuple: (values_list field names, function taking (row, timezone))
+    """
+    fields = list(serializer_class.Meta.fields)
+    opts = serializer_class.Meta.model._meta
+    columns = [
+        (index, name, isinstance(opts.get_field(name), models.DateTimeField))
+        for index, name in enumerate(fields)
+    ]
+
+    def row_serializer(row, tz) -> dict:
+        return {
+            name: format_datetime(row[index], tz) if is_datetime else row[index]
+            for index, name, is_datetime in columns
+        }
+
+    return fields, row_serializer
+
+
+PROJECT_FIELDS, project_row = compile_row_serializer(ProjectSerializer)
+CHANNEL_FIELDS, channel_row = compile_row_serializer(ChannelSerializer)
+EVENT_FIELDS, event_row = compile_row_serializer(EventSerializer)
+
+
+def serialize_rows(rows, row_serializer) -> list:
+    """Serialize values_list() rows with a compiled row serializer
+
+    Args:
+        rows: iterable of rows selected with the serializer's field names
+        row_serializer: function from compile_row_serializer
+
+    Returns:
+        list: serialized dicts, equal to ModelSerializer(many=True).data
+    """
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    return [row_serializer(row, tz) for row in rows]
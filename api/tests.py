@@ -1,3 +1,1584 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
+import re
+import tempfile
+import time
+from collections import Counter
+from unittest import mock
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Count, Max, Min
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from . import (
+    archive,
+    buffer,
+    export,
+    importer,
+    ingest,
+    metrics,
+    ratelimit,
+    retention,
+    rollups,
+    rules,
+)
+from .backends.sqlite3.base import DatabaseWrapper
+from .buffer import IngestBuffer
+from .renderers import FastJSONRenderer
+from .serializers import (
+    CHANNEL_FIELDS,
+    EVENT_FIELDS,
+    PROJECT_FIELDS,
+    ChannelSerializer,
+    EventSerializer,
+    ProjectSerializer,
+    channel_row,
+    event_row,
+    project_row,
+    serialize_rows,
+)
+from .authentication import token_cache
+from .cache import name_cache
+from .idempotency import recent_keys
+from .models import Channel, Event, EventRollup, Project
+from .notifier import notifier
+from .recent import recent_events
+from .versions import response_cache
+from .views import async_event_view, tail_view
+from .views.event_view import MAX_BATCH_SIZE
+
+
+class APITestCase(TransactionTestCase):
+    """User u with project p and its channel c, caches emptied"""
+
+    def setUp(self) -> None:
+        # the in process caches outlive the rows of earlier tests
+        for cache in (
+            token_cache,
+            name_cache,
+            notifier,
+            ratelimit.project_limits,
+            recent_keys,
+            recent_events,
+            response_cache,
+            rules.channel_rules,
+            rules.repeats,
+        ):
+            cache.clear()
+        self.user = User.objects.create_user("u")
+        self.token = Token.objects.get_or_create(user=self.user)[0].key
+        self.project = Project.objects.create(name="p", user=self.user)
+        self.channel = Channel.objects.create(name="c", project_id=self.project, user=self.user)
+
+    def get(self, path: str, **extra):
+        return self.client.get(path, HTTP_AUTHORIZATION=f"Token {self.token}", **extra)
+
+    def post(self, path: str, data, **extra):
+        return self.client.post(
+            path,
+            data,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Token {self.token}",
+            **extra,
+        )
+
+    def log(self, data, **extra):
+        return self.post("/api/sync/log/", data, **extra)
+
+
+class IndexTests(APITestCase):
+    def query_plan(self, path: str) -> str:
+        """EXPLAIN QUERY PLAN of the event listing a GET on path runs"""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(path).status_code, 200)
+        listing = [query["sql"] for query in queries if 'FROM "api_event"' in query["sql"]]
+        self.assertEqual(len(listing), 1, listing)
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN QUERY PLAN " + listing[0])
+            return "\n".join(row[-1] for row in cursor.fetchall())
+
+    def test_user_listing(self):
+        self.assertIn("USING INDEX event_user_created", self.query_plan("/api/sync/log/"))
+
+    def test_project_listing(self):
+        plan = self.query_plan("/api/sync/log/p/")
+        self.assertIn("USING INDEX event_user_project_created", plan)
+
+    def test_project_range(self):
+        plan = self.query_plan("/api/sync/log/p/?start=2023-01-01&end=2030-01-01")
+        self.assertIn("USING INDEX event_user_project_created", plan)
+        self.assertIn("created_at>", plan)
+
+    def test_channel_listing(self):
+        plan = self.query_plan(
+            "/api/sync/log/p/c/?start=2023-01-01T00:00:00Z&end=2030-01-01T00:00:00Z"
+        )
+        self.assertIn("USING INDEX event_user_channel_created", plan)
+        self.assertIn("created_at>", plan)
+
+
+class UniqueNameTests(APITestCase):
+    def test_project_name(self):
+        response = self.post("/api/project/", {"name": "p"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"message": "Project name already exists for user."})
+        self.assertEqual(Project.objects.count(), 1)
+        # the failed insert leaves the connection usable
+        self.assertEqual(self.post("/api/project/", {"name": "q"}).status_code, 201)
+
+    def test_project_name_other_user(self):
+        other = User.objects.create_user("v")
+        Project.objects.create(name="q", user=other)
+        self.assertEqual(self.post("/api/project/", {"name": "q"}).status_code, 201)
+
+    def test_channel_name(self):
+        response = self.post("/api/channel/", {"project_id": self.project.id, "name": "c"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"message": "Channel name already exists for project."})
+        self.assertEqual(Channel.objects.count(), 1)
+        self.assertEqual(
+            self.post("/api/channel/", {"project_id": self.project.id, "name": "d"}).status_code,
+            201,
+        )
+
+    def test_channel_name_other_project(self):
+        other = Project.objects.create(name="q", user=self.user)
+        response = self.post("/api/channel/", {"project_id": other.id, "name": "c"})
+        self.assertEqual(response.status_code, 201)
+
+
+class SearchTests(APITestCase):
+    def search(self, query: str) -> dict:
+        response = self.get("/api/search/?" + query)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def names(self, query: str) -> list:
+        return [event["event_name"] for event in self.search(query)["results"]]
+
+    def test_ranking(self):
+        self.log(
+            [
+                {"project": "p", "channel": "c", "event": "cpu", "description": "disk"},
+                {
+                    "project": "p",
+                    "channel": "c",
+                    "event": "disk full",
+                    "description": "disk full on disk 2",
+                },
+                {"project": "p", "channel": "c", "event": "memory"},
+            ]
+        )
+        self.assertEqual(self.names("q=disk"), ["disk full", "cpu"])
+        # every word has to match
+        self.assertEqual(self.names("q=disk+cpu"), ["cpu"])
+        # punctuation is matched as text, not parsed as query syntax
+        self.log({"project": "p", "channel": "c", "event": "ORD-1234"})
+        self.assertEqual(self.names("q=ORD-1234"), ["ORD-1234"])
+
+    def test_pagination(self):
+        self.log([{"project": "p", "channel": "c", "event": f"job {i}"} for i in range(5)])
+        first = self.search("q=job&limit=2")
+        self.assertEqual(first["next"], 2)
+        second = self.search("q=job&limit=2&offset=2")
+        third = self.search("q=job&limit=2&offset=4")
+        self.assertIsNone(third["next"])
+        names = [
+            event["event_name"]
+            for page in (first, second, third)
+            for event in page["results"]
+        ]
+        self.assertEqual(sorted(names), [f"job {i}" for i in range(5)])
+        self.assertEqual(self.get("/api/search/?q=job&limit=0").status_code, 400)
+        self.assertEqual(self.get("/api/search/?q=job&offset=x").status_code, 400)
+
+    def test_filters(self):
+        Channel.objects.create(name="d", project_id=self.project, user=self.user)
+        self.log(
+            [
+                {"project": "p", "channel": "c", "event": "deploy"},
+                {"project": "p", "channel": "d", "event": "deploy"},
+            ]
+        )
+        self.assertEqual(len(self.names("q=deploy")), 2)
+        self.assertEqual(len(self.names("q=deploy&project=p&channel=d")), 1)
+        self.assertEqual(len(self.names("q=deploy&start=2000-01-01")), 2)
+        self.assertEqual(self.names("q=deploy&end=2000-01-01"), [])
+        self.assertEqual(self.get("/api/search/?q=deploy&project=x").status_code, 400)
+
+    def test_bad_date(self):
+        for query in ("start=yesterday", "end=2023-13-45", "start=2023-02-30T00:00:00"):
+            response = self.get("/api/search/?q=deploy&" + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json(), {"message": "Invalid start or end date."})
+
+
+class RollupTests(APITestCase):
+    def counts(self, bucket: str) -> dict:
+        return dict(
+            EventRollup.objects.filter(bucket=bucket).values_list("bucket_start", "count")
+        )
+
+    def spread(self) -> None:
+        """Move the events of channel c to three points in time"""
+        points = [
+            datetime(2023, 1, 1, 10, 5, tzinfo=dt_timezone.utc),
+            datetime(2023, 1, 1, 10, 5, 30, tzinfo=dt_timezone.utc),
+            datetime(2023, 1, 2, 8, 0, tzinfo=dt_timezone.utc),
+        ]
+        for index, pk in enumerate(Event.objects.order_by("id").values_list("id", flat=True)):
+            Event.objects.filter(pk=pk).update(created_at=points[index % 3])
+
+    def test_add_counts(self):
+        start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        key = (self.channel.id, EventRollup.DAY, start)
+        rollups.add_counts(Counter({key: 2}))
+        rollups.add_counts(Counter({key: 3}))
+        self.assertEqual(self.counts(EventRollup.DAY), {start: 5})
+
+    def test_ingest(self):
+        self.log({"project": "p", "channel": "c", "event": "e"})
+        self.log([{"project": "p", "channel": "c", "event": "e"}] * 4)
+        for bucket in EventRollup.BUCKETS:
+            self.assertEqual(sum(self.counts(bucket).values()), 5, bucket)
+        now = Event.objects.first().created_at
+        self.assertIn(rollups.truncate(now, EventRollup.DAY), self.counts(EventRollup.DAY))
+
+    def test_backfill(self):
+        other = Channel.objects.create(name="d", project_id=self.project, user=self.user)
+        self.log([{"project": "p", "channel": "c", "event": "e"}] * 6)
+        self.log({"project": "p", "channel": "d", "event": "e"})
+        Event.objects.filter(channel_id=other).update(
+            created_at=datetime(2022, 6, 1, tzinfo=dt_timezone.utc)
+        )
+        self.spread()
+        # ingest counted the events when they were written, now
+        call_command("backfill_rollups", "--channel", str(self.channel.id), stdout=io.StringIO())
+        rows = EventRollup.objects.filter(channel_id=self.channel)
+        self.assertEqual(
+            dict(rows.filter(bucket=EventRollup.DAY).values_list("bucket_start", "count")),
+            {
+                datetime(2023, 1, 1, tzinfo=dt_timezone.utc): 4,
+                datetime(2023, 1, 2, tzinfo=dt_timezone.utc): 2,
+            },
+        )
+        self.assertEqual(
+            dict(rows.filter(bucket=EventRollup.MINUTE).values_list("bucket_start", "count")),
+            {
+                datetime(2023, 1, 1, 10, 5, tzinfo=dt_timezone.utc): 4,
+                datetime(2023, 1, 2, 8, 0, tzinfo=dt_timezone.utc): 2,
+            },
+        )
+        # the other channel keeps the rollups ingest wrote
+        self.assertEqual(
+            EventRollup.objects.filter(channel_id=other).get(bucket=EventRollup.DAY).bucket_start,
+            rollups.truncate(timezone.now(), EventRollup.DAY),
+        )
+        # a full rebuild matches what ingest adds up
+        call_command("backfill_rollups", stdout=io.StringIO())
+        fields = ("channel_id", "bucket", "bucket_start", "count")
+        rebuilt = set(EventRollup.objects.values_list(*fields))
+        EventRollup.objects.all().delete()
+        rollups.update_rollups(list(Event.objects.all()))
+        self.assertEqual(set(EventRollup.objects.values_list(*fields)), rebuilt)
+
+    def test_endpoint(self):
+        self.log([{"project": "p", "channel": "c", "event": "e"}] * 6)
+        self.spread()
+        call_command("backfill_rollups", stdout=io.StringIO())
+        response = self.get("/api/stats/p/c/?bucket=day")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(),
+            {
+                "bucket": "day",
+                "results": [
+                    {"bucket_start": "2023-01-01T00:00:00Z", "count": 4},
+                    {"bucket_start": "2023-01-02T00:00:00Z", "count": 2},
+                ],
+            },
+        )
+        hours = self.get("/api/stats/p/c/").json()
+        self.assertEqual(hours["bucket"], "hour")
+        self.assertEqual([row["count"] for row in hours["results"]], [4, 2])
+        ranged = self.get("/api/stats/p/c/?bucket=day&start=2023-01-02").json()["results"]
+        self.assertEqual(ranged, [{"bucket_start": "2023-01-02T00:00:00Z", "count": 2}])
+        ranged = self.get("/api/stats/p/c/?bucket=day&end=2023-01-01T12:00:00Z").json()
+        self.assertEqual(len(ranged["results"]), 1)
+
+    def test_endpoint_errors(self):
+        self.assertEqual(self.get("/api/stats/p/c/?bucket=week").status_code, 400)
+        self.assertEqual(self.get("/api/stats/p/x/").status_code, 400)
+        for query in ("start=soon", "end=2023-01-32"):
+            response = self.get("/api/stats/p/c/?" + query)
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json(), {"message": "Invalid start or end date."})
+
+
+class ExportTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log(
+            [
+                {"project": "p", "channel": "c", "event": f"e{i}", "description": "ü, \"quoted\""}
+                for i in range(7)
+            ]
+        )
+        self.listing = self.get("/api/sync/log/p/c/?limit=100").json()["results"]
+
+    def export(self, query: str = "") -> bytes:
+        response = self.get("/api/log/p/c/export/?" + query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_ndjson(self):
+        lines = self.export().decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], self.listing)
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export("format=csv").decode())))
+        self.assertEqual(rows[0], list(export.EXPORT_FIELDS))
+        names = [row[rows[0].index("event_name")] for row in rows[1:]]
+        self.assertEqual(names, [f"e{i}" for i in range(7)])
+        self.assertEqual(rows[1][rows[0].index("description")], 'ü, "quoted"')
+
+    def test_gzip(self):
+        self.assertEqual(gzip.decompress(self.export("gzip=1")), self.export())
+
+    def test_chunks(self):
+        # one piece per database chunk, every row exactly once
+        events = Event.objects.filter(channel_id=self.channel)
+        chunks = list(export.ndjson_stream(events, chunk_size=3))
+        self.assertEqual([chunk.count(b"\n") for chunk in chunks], [3, 3, 1])
+        self.assertEqual(b"".join(chunks), self.export())
+
+    def test_range(self):
+        self.assertEqual(self.export("end=2000-01-01"), b"")
+        self.assertEqual(len(self.export("start=2000-01-01").splitlines()), 7)
+
+    def test_errors(self):
+        response = self.get("/api/log/p/c/export/?start=never")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {"message": "Invalid start or end date."})
+        self.assertEqual(self.get("/api/log/p/x/export/").status_code, 400)
+
+    def test_asgi(self):
+        async def read():
+            response = await AsyncClient().get(
+                "/api/log/p/c/export/?format=csv",
+                headers={"authorization": f"Token {self.token}"},
+            )
+            # an async iterator is sent chunk by chunk instead of read into a list
+            self.assertTrue(response.is_async)
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(asyncio.run(read()), self.export("format=csv"))
+
+
+class IngestTests(APITestCase):
+    def test_blank_names(self):
+        for item in (
+            {"project": "p", "channel": "", "event": "e"},
+            {"project": "p", "channel": "  ", "event": "e"},
+            {"project": " ", "channel": "c", "event": "e"},
+        ):
+            response = self.log(item)
+            self.assertEqual(response.status_code, 400, item)
+            self.assertEqual(
+                response.json(), {"message": "Project and channel names may not be blank."}
+            )
+        response = self.log([{"project": "p", "channel": "\t", "event": "e"}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()["results"][0]["status"], 400)
+        self.assertEqual(Channel.objects.count(), 1)
+        self.assertEqual(Event.objects.count(), 0)
+
+    def test_batch(self):
+        response = self.log(
+            [
+                {"project": "p", "channel": "c", "event": "a"},
+                {"project": "p", "channel": "new", "event": "b"},
+            ]
+        )
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(body["created"], 2)
+        self.assertEqual([result["status"] for result in body["results"]], [201, 201])
+        self.assertEqual(
+            [result["id"] for result in body["results"]],
+            list(Event.objects.order_by("id").values_list("id", flat=True)),
+        )
+        self.assertTrue(Channel.objects.filter(name="new").exists())
+
+    def test_partial_batch(self):
+        response = self.log(
+            [
+                {"project": "p", "channel": "c", "event": "a"},
+                {"project": "p", "channel": "c"},
+                {"project": "x", "channel": "c", "event": "b"},
+                "event",
+                {"project": "p", "channel": "", "event": "c"},
+                {"project": "p", "channel": "c", "event": "d"},
+            ]
+        )
+        self.assertEqual(response.status_code, 207)
+        body = response.json()
+        self.assertEqual(body["created"], 2)
+        self.assertEqual(
+            [(result["status"], result.get("message")) for result in body["results"]],
+            [
+                (201, None),
+                (400, "Required fields are empty."),
+                (400, "Project does not exist for user."),
+                (400, "Batch items must be objects."),
+                (400, "Project and channel names may not be blank."),
+                (201, None),
+            ],
+        )
+        self.assertEqual(
+            sorted(Event.objects.values_list("event_name", flat=True)), ["a", "d"]
+        )
+
+    def test_batch_errors(self):
+        self.assertEqual(self.log([]).status_code, 400)
+        items = [{"project": "p", "channel": "c", "event": "e"}] * (MAX_BATCH_SIZE + 1)
+        self.assertEqual(self.log(items).status_code, 400)
+        self.assertEqual(Event.objects.count(), 0)
+
+    def test_batch_transaction(self):
+        items = [{"project": "p", "channel": f"c{i % 3}", "event": "e"} for i in range(30)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.log(items).status_code, 201)
+        inserts = [query for query in queries if 'INTO "api_event" ' in query["sql"]]
+        self.assertEqual(len(inserts), 1)
+        # a failure after the events are inserted undoes the whole batch,
+        # channels created for it included
+        Event.objects.all().delete()
+        Channel.objects.exclude(pk=self.channel.pk).delete()
+        with mock.patch.object(ingest, "update_rollups", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                ingest.ingest_batch(self.user.id, items)
+        self.assertEqual(Event.objects.count(), 0)
+        self.assertEqual(Channel.objects.count(), 1)
+
+
+class BufferTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dead_letter = f"{directory.name}/dead_letter.ndjson"
+        settings = override_settings(COPYCAT={"INGEST_DEAD_LETTER": self.dead_letter})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.buffer = IngestBuffer(100, 100, 60, ingest.write_new_events, buffer.dead_letter)
+
+    def event(self, name: str, channel: Channel) -> Event:
+        return ingest.build_event(
+            self.user.id, (self.project.id, channel.id), {"event": name, "idempotency_key": name}
+        )
+
+    def test_failed_flush(self):
+        gone = Channel.objects.create(name="gone", project_id=self.project, user=self.user)
+        events = [self.event(name, self.channel) for name in "abc"]
+        events.insert(1, self.event("lost", gone))
+        gone_id = gone.id
+        # deleted while its event was queued, so the insert fails the deferred
+        # foreign key check at commit
+        gone.delete()
+        self.buffer._queue.extend(events)
+        with self.assertLogs("api.buffer", "ERROR"):
+            self.buffer.flush()
+        self.assertEqual(
+            sorted(Event.objects.values_list("event_name", flat=True)), ["a", "b", "c"]
+        )
+        self.assertEqual((self.buffer.flushed, self.buffer.failed, self.buffer.flushes), (3, 1, 1))
+        with open(self.dead_letter) as file:
+            lines = [json.loads(line) for line in file]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(
+            (lines[0]["event"], lines[0]["channel_id"], lines[0]["idempotency_key"]),
+            ("lost", gone_id, "lost"),
+        )
+
+
+class IdempotencyTests(APITestCase):
+    item = {"project": "p", "channel": "c", "event": "e", "idempotency_key": "k"}
+
+    def test_retry(self):
+        response = self.log(self.item)
+        self.assertEqual(response.status_code, 201)
+        retry = self.log(self.item)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(
+            retry.json(), {"message": "Duplicate idempotency key.", "id": response.json()["id"]}
+        )
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_retry_after_failed_write(self):
+        with mock.patch.object(ingest, "update_rollups", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                ingest.ingest_event(self.user.id, self.item)
+        self.assertEqual(self.log(self.item).status_code, 201)
+        self.assertEqual(self.log(self.item).status_code, 200)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_buffered_retry_after_failed_flush(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        queue = IngestBuffer(100, 100, 60, ingest.write_new_events, ingest.reject_events)
+        self.addCleanup(queue.stop)
+        settings = {"INGEST_MODE": "buffered", "INGEST_DEAD_LETTER": f"{directory.name}/dead"}
+        with override_settings(COPYCAT=settings), mock.patch.object(
+            ingest, "get_buffer", return_value=queue
+        ):
+            self.assertEqual(self.log(self.item).status_code, 202)
+            # answered as a duplicate while the event waits in the queue
+            self.assertEqual(self.log(self.item).status_code, 200)
+            with mock.patch.object(ingest, "update_rollups", side_effect=RuntimeError):
+                with self.assertLogs("api.buffer", "ERROR"):
+                    queue.flush()
+            self.assertEqual(Event.objects.count(), 0)
+
+            self.assertEqual(self.log(self.item).status_code, 202)
+            queue.flush()
+            retry = self.log(self.item)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()["id"], Event.objects.get().id)
+
+    def test_buffer_full(self):
+        queue = IngestBuffer(0, 100, 60, ingest.write_new_events)
+        with override_settings(COPYCAT={"INGEST_MODE": "buffered"}), mock.patch.object(
+            ingest, "get_buffer", return_value=queue
+        ):
+            self.assertEqual(self.log(self.item).status_code, 503)
+        self.assertEqual(self.log(self.item).status_code, 201)
+
+    def test_batch_duplicates(self):
+        response = self.log([self.item, dict(self.item, event="again")])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+            [result["status"] for result in response.json()["results"]], [201, 200]
+        )
+        self.assertEqual(list(Event.objects.values_list("event_name", flat=True)), ["e"])
+
+    def test_taken_key(self):
+        # written by another process, so only the unique index knows the key
+        taken = Event.objects.create(
+            project_id=self.project,
+            channel_id=self.channel,
+            event_name="e",
+            user=self.user,
+            idempotency_key="k",
+        )
+        response = self.log([dict(self.item, event="new", idempotency_key="n"), self.item])
+        self.assertEqual(response.status_code, 207)
+        results = response.json()["results"]
+        self.assertEqual([result["status"] for result in results], [201, 200])
+        self.assertEqual(results[1]["id"], taken.id)
+        self.assertEqual(Event.objects.count(), 2)
+        # the taken key is now known without a query
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(ingest.duplicate(self.user.id, "k"))
+
+
+class TailTests(APITestCase):
+    def tail(self, query: str):
+        return AsyncClient().get(
+            f"/api/log/p/c/tail/?{query}", headers={"authorization": f"Token {self.token}"}
+        )
+
+    def test_wake_up(self):
+        async def read():
+            started = time.monotonic()
+            request = asyncio.ensure_future(self.tail("since_id=0&timeout=30"))
+            while not notifier.waiting() and not request.done():
+                await asyncio.sleep(0.01)
+            event = await Event.objects.acreate(
+                project_id=self.project, channel_id=self.channel, event_name="e", user=self.user
+            )
+            notifier.publish({self.channel.id: event.id})
+            response = await request
+            return response, event, time.monotonic() - started
+
+        response, event, elapsed = asyncio.run(read())
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body["last_id"], event.id)
+        self.assertEqual([result["id"] for result in body["results"]], [event.id])
+        self.assertLess(elapsed, 10)
+
+    def test_timeout(self):
+        self.log({"project": "p", "channel": "c", "event": "e"})
+        started = time.monotonic()
+        response = asyncio.run(self.tail("timeout=1"))
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertEqual(
+            json.loads(response.content), {"last_id": Event.objects.get().id, "results": []}
+        )
+
+    def test_since_id_and_limit(self):
+        for name in "abc":
+            self.log({"project": "p", "channel": "c", "event": name})
+        first = Event.objects.order_by("id").first().id
+        body = json.loads(asyncio.run(self.tail(f"since_id={first}&limit=1")).content)
+        self.assertEqual([result["event_name"] for result in body["results"]], ["b"])
+        self.assertEqual(body["last_id"], first + 1)
+
+    def test_invalid_parameters(self):
+        for query in ("since_id=x", "timeout=x", "timeout=-1", "limit=0", "limit=-1"):
+            response = asyncio.run(self.tail(query))
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(
+                json.loads(response.content),
+                {"message": "since_id, timeout and limit must be integers."},
+            )
+
+    def test_stream_lifetime(self):
+        self.log({"project": "p", "channel": "c", "event": "e"})
+
+        async def read():
+            response = await self.tail("mode=sse&since_id=0")
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        with mock.patch.object(tail_view, "MAX_STREAM_SECONDS", 0.2), mock.patch.object(
+            tail_view, "HEARTBEAT", 0.05
+        ):
+            body = asyncio.run(read())
+        self.assertTrue(body.startswith(b"retry: 1000\n\n"))
+        self.assertIn(b"id: %d\nevent: log\n" % Event.objects.get().id, body)
+        self.assertIn(b": keepalive\n\n", body)
+
+
+class RulesTests(APITestCase):
+    item = {"project": "p", "channel": "c", "event": "e"}
+
+    def setUp(self) -> None:
+        super().setUp()
+        patch = mock.patch.object(rules.repeats, "flush_interval", 3600)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_sampling(self):
+        Channel.objects.filter(pk=self.channel.pk).update(sample_rate=0)
+        response = self.log(self.item)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {"message": "Event dropped by sampling."})
+        rules.channel_rules.clear()
+        Channel.objects.filter(pk=self.channel.pk).update(sample_rate=1)
+        self.assertEqual(self.log(self.item).status_code, 201)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_dedup(self):
+        Channel.objects.filter(pk=self.channel.pk).update(dedup_window=60)
+        first = self.log(self.item).json()["id"]
+        for _ in range(2):
+            response = self.log(self.item)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(
+                response.json(), {"message": "Event collapsed into a repeat.", "id": first}
+            )
+        self.assertEqual(self.log(dict(self.item, description="other")).status_code, 201)
+        self.assertEqual(Event.objects.count(), 2)
+
+        self.assertEqual(Event.objects.get(pk=first).repeat_count, 1)
+        rules.repeats.flush()
+        self.assertEqual(Event.objects.get(pk=first).repeat_count, 3)
+        self.assertEqual(rules.repeats.stats()["pending"], 0)
+
+    def test_flush_after_commit(self):
+        Channel.objects.filter(pk=self.channel.pk).update(dedup_window=60)
+        first = self.log(self.item).json()["id"]
+        self.log(self.item)
+        rules.repeats.flush_interval = 0
+        # the flush waits for the commit, so the rolled back write keeps the count
+        event = ingest.build_event(self.user.id, (self.project.id, self.channel.id), self.item)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                ingest.write_events([event])
+                raise RuntimeError
+        self.assertEqual(rules.repeats.stats()["pending"], 1)
+        # and a failed flush puts it back
+        with mock.patch.object(rules, "bump", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                rules.repeats.flush()
+        self.assertEqual(rules.repeats.stats()["pending"], 1)
+        self.assertEqual(Event.objects.get(pk=first).repeat_count, 1)
+
+        self.assertEqual(self.log(dict(self.item, event="other")).status_code, 201)
+        self.assertEqual(Event.objects.get(pk=first).repeat_count, 2)
+
+    def test_rolled_back_window(self):
+        Channel.objects.filter(pk=self.channel.pk).update(dedup_window=60)
+        with mock.patch.object(ingest, "update_rollups", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                ingest.ingest_event(self.user.id, self.item)
+        # the window of the rolled back row is gone, so the next event is written
+        self.assertEqual(self.log(self.item).status_code, 201)
+        self.assertEqual(self.log(self.item).json()["id"], Event.objects.get().id)
+
+
+class AuthenticationTests(APITestCase):
+    def warm(self) -> None:
+        self.assertEqual(self.get("/api/log/").status_code, 200)
+        # served from the cache, without a Token or User query
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get("/api/log/").status_code, 200)
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertNotIn('"authtoken_token"', tables)
+        self.assertNotIn('"auth_user"', tables)
+
+    def test_deleted_token(self):
+        self.warm()
+        Token.objects.filter(key=self.token).get().delete()
+        response = self.get("/api/log/")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"detail": "Invalid token."})
+
+    def test_deactivated_user(self):
+        self.warm()
+        self.user.is_active = False
+        self.user.save()
+        response = self.get("/api/log/")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json(), {"detail": "User inactive or deleted."})
+
+    def test_async_deleted_token(self):
+        async def read():
+            return await AsyncClient().get(
+                "/api/async/log/", headers={"authorization": f"Token {self.token}"}
+            )
+
+        self.assertEqual(asyncio.run(read()).status_code, 200)
+        Token.objects.filter(key=self.token).get().delete()
+        self.assertEqual(asyncio.run(read()).status_code, 403)
+
+
+class NameCacheTests(APITestCase):
+    pair = ("p", "c")
+
+    def resolve(self, *pair):
+        return ingest.resolve_channels(self.user.id, [pair or self.pair])[pair or self.pair]
+
+    def test_warm(self):
+        self.assertEqual(self.resolve(), (self.project.id, self.channel.id))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolve(), (self.project.id, self.channel.id))
+        self.log({"project": "p", "channel": "c", "event": "e"})
+        with CaptureQueriesContext(connection) as queries:
+            self.log({"project": "p", "channel": "c", "event": "e"})
+        lookups = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT")
+            and ('FROM "api_project"' in query["sql"] or 'FROM "api_channel"' in query["sql"])
+        ]
+        self.assertEqual(lookups, [])
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.assertIsNotNone(self.resolve("p", "new"))
+                raise RuntimeError
+        self.assertIsNone(name_cache.get((self.user.id, "p", "new")))
+        self.assertFalse(Channel.objects.filter(name="new").exists())
+
+    def test_rename(self):
+        self.resolve()
+        self.channel.name = "renamed"
+        self.channel.save()
+        self.assertEqual(self.resolve("p", "renamed"), (self.project.id, self.channel.id))
+        created = self.resolve()
+        self.assertNotEqual(created[1], self.channel.id)
+        self.assertEqual(Channel.objects.get(name="c").id, created[1])
+
+        self.project.name = "q"
+        self.project.save()
+        self.assertIsNone(self.resolve())
+        self.assertEqual(self.resolve("q", "c"), created)
+
+    def test_delete(self):
+        self.resolve()
+        self.channel.delete()
+        created = self.resolve()
+        self.assertEqual(Channel.objects.get().id, created[1])
+        self.project.delete()
+        self.assertIsNone(self.resolve())
+
+
+class PaginationTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log([{"project": "p", "channel": "c", "event": f"e{i}"} for i in range(7)])
+        # two runs of events sharing a created_at, so pages split inside a run
+        self.moments = [
+            datetime(2023, 1, 1, tzinfo=dt_timezone.utc),
+            datetime(2023, 1, 2, tzinfo=dt_timezone.utc),
+        ]
+        ids = list(Event.objects.order_by("id").values_list("id", flat=True))
+        Event.objects.filter(id__in=ids[:4]).update(created_at=self.moments[0])
+        Event.objects.filter(id__in=ids[4:]).update(created_at=self.moments[1])
+        self.ids = ids
+
+    def walk(self, path: str, limit: int) -> list:
+        async def read(url):
+            response = await AsyncClient().get(
+                url, headers={"authorization": f"Token {self.token}"}
+            )
+            return response.json()
+
+        ids = []
+        cursor = ""
+        while True:
+            url = f"{path}?limit={limit}{cursor}"
+            page = asyncio.run(read(url)) if "/async/" in path else self.get(url).json()
+            self.assertLessEqual(len(page["results"]), limit)
+            ids += [event["id"] for event in page["results"]]
+            if page["next"] is None:
+                return ids
+            cursor = "&cursor=" + page["next"]
+
+    def test_shared_created_at(self):
+        for path in ("/api/sync/log/p/c/", "/api/async/log/p/c/", "/api/sync/log/"):
+            for limit in (1, 2, 3, 100):
+                self.assertEqual(self.walk(path, limit), self.ids, (path, limit))
+
+    def test_archived(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive.read_segment.cache_clear()
+        self.addCleanup(archive.read_segment.cache_clear)
+        with override_settings(COPYCAT={"ARCHIVE_DIR": directory.name}):
+            # the first run goes to two segments, the cursor of a page ending
+            # inside it positions the merge
+            moved = archive.archive_channel(self.channel, self.moments[1], segment_size=2)
+            self.assertEqual(moved, 4)
+            for limit in (1, 3):
+                self.assertEqual(self.walk("/api/sync/log/p/c/", limit), self.ids, limit)
+                self.assertEqual(self.walk("/api/async/log/p/c/", limit), self.ids, limit)
+
+    def test_errors(self):
+        for query, message in (
+            ("cursor=nonsense", "Invalid cursor."),
+            ("cursor=" + base64.urlsafe_b64encode(b"2023-01-01|x").decode(), "Invalid cursor."),
+            ("limit=x", "Limit must be an integer."),
+            ("limit=0", "Limit must be positive."),
+            ("limit=-1", "Limit must be positive."),
+        ):
+            response = self.get(f"/api/sync/log/p/c/?{query}")
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json(), {"message": message}, query)
+            response = asyncio.run(
+                AsyncClient().get(
+                    f"/api/async/log/p/c/?{query}",
+                    headers={"authorization": f"Token {self.token}"},
+                )
+            )
+            self.assertEqual((response.status_code, response.json()), (400, {"message": message}))
+        body = self.get("/api/sync/log/p/c/?limit=100000").json()
+        self.assertEqual(len(body["results"]), 7)
+
+
+class CounterTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.log({"project": "p", "channel": "c", "event": "a"})
+        self.log([{"project": "p", "channel": channel, "event": "b"} for channel in "cdd"])
+        self.log({"project": "p", "channel": "d", "event": "c"})
+
+    def assert_counters(self, time_range: bool = True) -> None:
+        for model, field in ((Project, "project_id"), (Channel, "channel_id")):
+            for row in model.objects.all():
+                actual = Event.objects.filter(**{field: row.id}).aggregate(
+                    count=Count("id"), first=Min("created_at"), last=Max("created_at")
+                )
+                stored = (row.event_count, row.first_event_at, row.last_event_at)
+                expected = (actual["count"], actual["first"], actual["last"])
+                if not time_range:
+                    stored, expected = stored[:1], expected[:1]
+                self.assertEqual(stored, expected, (model.__name__, row.name))
+
+    def reconcile(self) -> str:
+        out = io.StringIO()
+        call_command("reconcile_counters", stdout=out)
+        return out.getvalue()
+
+    def test_ingest(self):
+        self.assertEqual(Channel.objects.get(name="d").event_count, 3)
+        self.assertEqual(Project.objects.get().event_count, 5)
+        self.assert_counters()
+        self.assertIn("channels repaired: 0\nprojects repaired: 0", self.reconcile())
+
+    def test_delete_channel(self):
+        # Channel.delete() re-reads the project's time range itself
+        Channel.objects.get(name="c").delete()
+        self.assertEqual(Project.objects.get().event_count, 3)
+        self.assert_counters()
+        self.assertIn("channels repaired: 0\nprojects repaired: 0", self.reconcile())
+
+    def test_delete_channel_queryset(self):
+        Channel.objects.filter(name="d").delete()
+        # the count drops with the channel, the time range waits for reconcile
+        self.assertEqual(Project.objects.get().event_count, 2)
+        self.assert_counters(time_range=False)
+        self.assertIn("projects repaired: 1", self.reconcile())
+        self.assert_counters()
+
+    def test_drift(self):
+        Channel.objects.filter(name="c").update(event_count=10, first_event_at=None)
+        Project.objects.update(last_event_at=datetime(2000, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertIn("channels repaired: 1\nprojects repaired: 1", self.reconcile())
+        self.assert_counters()
+        Event.objects.all().delete()
+        self.reconcile()
+        self.assertEqual(
+            list(Channel.objects.values_list("event_count", "first_event_at", "last_event_at")),
+            [(0, None, None)] * 2,
+        )
+
+
+class ImportTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f"{directory.name}/events.ndjson.gz"
+        start = datetime(2023, 1, 1, 10, tzinfo=dt_timezone.utc)
+        items = [
+            {
+                "project": "p" if i % 3 else "q",
+                "channel": "c" if i % 2 else "d",
+                "event": f"e{i}",
+                "created_at": (start + timedelta(seconds=50 * i)).isoformat(),
+            }
+            for i in range(20)
+        ]
+        items[4]["idempotency_key"] = items[9]["idempotency_key"] = "k"
+        lines = [json.dumps(item) for item in items]
+        lines.insert(7, "not json")
+        with gzip.open(self.path, "wt") as dump:
+            dump.write("\n".join(lines) + "\n")
+
+    def run_import(self, *args) -> tuple:
+        self.out, self.err = io.StringIO(), io.StringIO()
+        call_command(
+            "import_events", self.path, "--user", "u", *args, stdout=self.out, stderr=self.err
+        )
+        return self.out.getvalue(), self.err.getvalue()
+
+    def assert_aggregates(self) -> None:
+        for bucket, start in (
+            (EventRollup.MINUTE, lambda at: at.replace(second=0, microsecond=0)),
+            (EventRollup.HOUR, lambda at: at.replace(minute=0, second=0, microsecond=0)),
+        ):
+            expected = Counter(
+                (channel_id, start(created_at))
+                for channel_id, created_at in Event.objects.values_list("channel_id", "created_at")
+            )
+            stored = {
+                (channel_id, bucket_start): count
+                for channel_id, bucket_start, count in EventRollup.objects.filter(
+                    bucket=bucket
+                ).values_list("channel_id", "bucket_start", "count")
+            }
+            self.assertEqual(stored, dict(expected), bucket)
+        out = io.StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("channels repaired: 0\nprojects repaired: 0", out.getvalue())
+
+    def test_import(self):
+        out, err = self.run_import("--chunk-size", "4")
+        self.assertIn("imported 19 events", out)
+        self.assertIn("skipped 2 lines", out)
+        self.assertIn("Invalid json.", err)
+        self.assertIn("Duplicate idempotency key.", err)
+        self.assertEqual(Event.objects.count(), 19)
+        self.assertEqual(Event.objects.get(idempotency_key="k").event_name, "e4")
+        self.assertEqual(Channel.objects.filter(project_id__name="q").count(), 2)
+        self.assert_aggregates()
+        # keyed events are not stored twice by a second run
+        self.run_import()
+        self.assertEqual(Event.objects.filter(idempotency_key="k").count(), 1)
+
+    def test_resume(self):
+        write = importer.EventImporter.write
+        calls = []
+
+        def fail_third_chunk(self, rows):
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise RuntimeError
+            write(self, rows)
+
+        with mock.patch.object(importer.EventImporter, "write", fail_third_chunk):
+            with self.assertRaises(RuntimeError):
+                self.run_import("--chunk-size", "4")
+        self.assertEqual(Event.objects.count(), 8)
+        offset = int(re.search(r"--offset (\d+)", self.err.getvalue()).group(1))
+        self.run_import("--offset", str(offset), "--chunk-size", "4")
+        self.assertEqual(
+            sorted(Event.objects.values_list("event_name", flat=True)),
+            sorted(f"e{i}" for i in range(20) if i != 9),
+        )
+        self.assert_aggregates()
+
+
+class BackendTests(TransactionTestCase):
+    def connect(self, alias: str, **options) -> DatabaseWrapper:
+        settings = {**connection.settings_dict, "NAME": self.name, "OPTIONS": options}
+        wrapper = DatabaseWrapper(settings, alias)
+        connections[alias] = wrapper
+        self.addCleanup(delattr, connections._connections, alias)
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.name = f"{directory.name}/db.sqlite3"
+
+    def pragma(self, wrapper: DatabaseWrapper, name: str):
+        with wrapper.cursor() as cursor:
+            return cursor.execute(f"PRAGMA {name}").fetchone()[0]
+
+    def test_pragmas(self):
+        wrapper = self.connect("tuned")
+        self.assertEqual(self.pragma(wrapper, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(wrapper, "busy_timeout"), 5000)
+        # 1 is NORMAL
+        self.assertEqual(self.pragma(wrapper, "synchronous"), 1)
+        wrapper = self.connect("custom", pragmas={"busy_timeout": 250})
+        self.assertEqual(self.pragma(wrapper, "busy_timeout"), 250)
+
+    def test_begin_immediate(self):
+        writer = self.connect("writer")
+        other = self.connect("other", pragmas={"busy_timeout": 0})
+        with CaptureQueriesContext(writer) as queries, transaction.atomic(using="writer"):
+            # the write lock is taken at BEGIN, before anything is written
+            with self.assertRaisesMessage(OperationalError, "database is locked"):
+                with transaction.atomic(using="other"):
+                    pass
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+        with transaction.atomic(using="other"):
+            pass
+
+    def test_write_lock(self):
+        wrapper = self.connect("serialized", serialize_writes=True)
+        with transaction.atomic(using="serialized"):
+            self.assertTrue(wrapper.write_lock.locked())
+        self.assertFalse(wrapper.write_lock.locked())
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic(using="serialized"):
+                self.assertTrue(wrapper.write_lock.locked())
+                raise RuntimeError
+        self.assertFalse(wrapper.write_lock.locked())
+
+        wrapper.ensure_connection()
+        wrapper._start_transaction_under_autocommit()
+        self.assertTrue(wrapper.write_lock.locked())
+        wrapper.close()
+        self.assertFalse(wrapper.write_lock.locked())
+
+
+class MigrationTests(TransactionTestCase):
+    def migrate(self, target: str):
+        executor = MigrationExecutor(connection)
+        executor.migrate([("api", target)])
+        return executor.loader.project_state([("api", target)]).apps
+
+    def test_merge_duplicate_names(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes("api")[0][1]
+        apps = self.migrate("0001_initial")
+        self.addCleanup(self.migrate, latest)
+        User = apps.get_model("auth", "User")
+        Project = apps.get_model("api", "Project")
+        Channel = apps.get_model("api", "Channel")
+        Event = apps.get_model("api", "Event")
+
+        user = User.objects.create(username="u")
+        other = User.objects.create(username="v")
+        projects = [Project.objects.create(name=name, user=user) for name in "ppq"]
+        projects.append(Project.objects.create(name="p", user=other))
+        for project, name in zip(projects * 2, "ccccdc"):
+            channel = Channel.objects.create(name=name, project_id=project, user=project.user)
+            Event.objects.create(
+                project_id=project, channel_id=channel, event_name="e", user=project.user
+            )
+        Channel.objects.create(name="c", project_id=projects[2], user=user)
+
+        apps = self.migrate("0002_event_indexes_unique_names")
+        Project = apps.get_model("api", "Project")
+        Channel = apps.get_model("api", "Channel")
+        Event = apps.get_model("api", "Event")
+        self.assertEqual(
+            sorted(Project.objects.values_list("user__username", "name")),
+            [("u", "p"), ("u", "q"), ("v", "p")],
+        )
+        self.assertEqual(
+            sorted(Channel.objects.values_list("user__username", "project_id__name", "name")),
+            [("u", "p", "c"), ("u", "p", "d"), ("u", "q", "c"), ("v", "p", "c")],
+        )
+        # every event is kept, on the surviving project and channel of its names
+        self.assertEqual(Event.objects.count(), 6)
+        counts = Counter(
+            Event.objects.values_list("user__username", "project_id__name", "channel_id__name")
+        )
+        self.assertEqual(
+            counts,
+            {("u", "p", "c"): 3, ("u", "p", "d"): 1, ("u", "q", "c"): 1, ("v", "p", "c"): 1},
+        )
+        for event in Event.objects.select_related("channel_id"):
+            self.assertEqual(event.channel_id.project_id_id, event.project_id_id)
+
+
+class AsyncIngestTests(APITestCase):
+    def apost(self, data, token=None):
+        async def post():
+            return await AsyncClient().post(
+                "/api/async/log/",
+                json.dumps(data),
+                content_type="application/json",
+                headers={"authorization": f"Token {token or self.token}"},
+            )
+
+        return asyncio.run(post())
+
+    def test_authentication(self):
+        for token, detail in (
+            ("wrong", "Invalid token."),
+            (None, "Authentication credentials were not provided."),
+        ):
+            headers = {} if token is None else {"authorization": f"Token {token}"}
+            sync = self.client.get("/api/sync/log/", headers=headers)
+            response = asyncio.run(AsyncClient().get("/api/async/log/", headers=headers))
+            self.assertEqual(
+                (response.status_code, json.loads(response.content)),
+                (sync.status_code, sync.json()),
+            )
+            self.assertEqual(json.loads(response.content), {"detail": detail})
+
+    def test_direct(self):
+        response = self.apost({"project": "p", "channel": "c", "event": "e", "icon": "x"})
+        self.assertEqual(response.status_code, 201)
+        event = Event.objects.get()
+        self.assertEqual(json.loads(response.content)["id"], event.id)
+        self.assertEqual((event.channel_id_id, event.icon), (self.channel.id, "x"))
+
+        response = self.apost([{"project": "p", "channel": "new", "event": "e"}] * 2)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)["created"], 2)
+        self.assertEqual(Event.objects.filter(channel_id__name="new").count(), 2)
+
+        for project, channel, message in (
+            ("x", "c", "Project does not exist for user."),
+            ("p", " ", "Project and channel names may not be blank."),
+        ):
+            response = self.apost({"project": project, "channel": channel, "event": "e"})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {"message": message})
+
+    def test_buffered_fast_path(self):
+        queue = IngestBuffer(100, 100, 60, ingest.write_new_events)
+        self.addCleanup(queue.stop)
+        item = {"project": "p", "channel": "c", "event": "e"}
+        with override_settings(COPYCAT={"INGEST_MODE": "buffered"}), mock.patch.object(
+            ingest, "get_buffer", return_value=queue
+        ):
+            # the first event resolves the channel and its rules in a thread
+            self.assertEqual(self.apost(item).status_code, 202)
+            # the next ones are queued from the cached ids without leaving the loop
+            with mock.patch.object(
+                async_event_view, "queue_event", side_effect=AssertionError
+            ):
+                response = self.apost(dict(item, idempotency_key="k"))
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(json.loads(response.content), {"message": "Event queued."})
+                self.assertEqual(self.apost(dict(item, idempotency_key="k")).status_code, 200)
+        self.assertEqual(len(queue._queue), 2)
+        queue.flush()
+        self.assertEqual(Event.objects.count(), 2)
+        self.assertEqual(Event.objects.filter(idempotency_key="k").count(), 1)
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(COPYCAT={"ARCHIVE_DIR": directory.name})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # segment paths repeat across tests once ids are reused
+        archive.read_segment.cache_clear()
+        self.addCleanup(archive.read_segment.cache_clear)
+
+        Channel.objects.create(name="d", project_id=self.project, user=self.user)
+        self.log(
+            [
+                {"project": "p", "channel": channel, "event": f"{channel}{i}"}
+                for i in range(6)
+                for channel in ("c", "d")
+            ]
+        )
+        # the oldest half of c moves to the archive, interleaved in time with d
+        old = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+        for index, pk in enumerate(Event.objects.order_by("id").values_list("id", flat=True)):
+            Event.objects.filter(pk=pk).update(created_at=old + timedelta(minutes=index))
+        self.expected = self.listing("/api/sync/log/")
+        self.etags = {path: self.get(path)["ETag"] for path in self.paths}
+        self.get("/api/sync/log/p/c/recent/")
+        moved = archive.archive_channel(
+            Channel.objects.get(name="c"), old + timedelta(minutes=6), segment_size=2
+        )
+        self.assertEqual(moved, 3)
+
+    paths = ["/api/sync/log/", "/api/sync/log/p/", "/api/sync/log/p/c/"]
+
+    def listing(self, path: str, limit: int = 100) -> list:
+        results = []
+        cursor = ""
+        while True:
+            page = self.get(f"{path}?limit={limit}{cursor}").json()
+            results += page["results"]
+            if page["next"] is None:
+                return results
+            cursor = "&cursor=" + page["next"]
+
+    def test_versions(self):
+        for path in self.paths:
+            response = self.get(path, HTTP_IF_NONE_MATCH=self.etags[path])
+            self.assertEqual(response.status_code, 200, path)
+
+    def test_recent(self):
+        recent = self.get("/api/sync/log/p/c/recent/").json()["results"]
+        self.assertEqual(recent, self.listing("/api/sync/log/p/c/"))
+        self.assertEqual(len(recent), 6)
+
+    def test_listings(self):
+        self.assertEqual(Event.objects.count(), 9)
+        for limit in (100, 4):
+            self.assertEqual(self.listing("/api/sync/log/", limit), self.expected)
+            self.assertEqual(self.listing("/api/sync/log/p/", limit), self.expected)
+        channel = [event for event in self.expected if event["event_name"].startswith("c")]
+        self.assertEqual(self.listing("/api/sync/log/p/c/", 4), channel)
+
+    def test_async_listings(self):
+        async def read(path):
+            client = AsyncClient()
+            response = await client.get(path, headers={"authorization": f"Token {self.token}"})
+            return response.json()["results"]
+
+        for path in ("/api/async/log/", "/api/async/log/p/"):
+            self.assertEqual(asyncio.run(read(path)), self.expected, path)
+
+    def test_export(self):
+        response = self.get("/api/log/p/c/export/")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        channel = [event for event in self.expected if event["event_name"].startswith("c")]
+        self.assertEqual([json.loads(line) for line in lines], channel)
+        response = self.get("/api/log/p/c/export/?end=2023-01-01T00:03:00Z")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)["event_name"] for line in lines], ["c0", "c1"])
+
+    def test_search(self):
+        body = self.get("/api/search/?q=c0").json()
+        self.assertEqual(body["results"], [])
+        self.assertEqual(body["archived"], 3)
+        self.assertEqual(self.get("/api/search/?q=d0&channel=d&project=p").json()["archived"], 0)
+        self.assertEqual(self.get("/api/search/?q=c0&end=2022-12-31").json()["archived"], 0)
+
+
+@override_settings(
+    COPYCAT={"RATE_LIMITING": True, "RATE_LIMIT_PROJECT": 2, "RATE_LIMIT_BURST": 1}
+)
+class RateLimitTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        ratelimit._buckets = None
+        self.addCleanup(setattr, ratelimit, "_buckets", None)
+
+    def test_project_limit(self):
+        item = {"project": "p", "channel": "c", "event": "e"}
+        self.assertEqual([self.log(item).status_code for _ in range(3)], [201, 201, 429])
+
+    def test_unknown_projects(self):
+        items = [{"project": f"x{i}", "channel": "c", "event": "e"} for i in range(3)]
+        for _ in range(3):
+            self.assertEqual(self.log(items).json()["created"], 0)
+        # no buckets for names that match no project, and one lookup per name
+        self.assertEqual(ratelimit.get_buckets()._buckets, {})
+        with CaptureQueriesContext(connection) as queries:
+            ratelimit.check_ingest(self.user.id, {"x0": 1, "x1": 1, "x2": 1})
+        self.assertEqual(len(queries), 0)
+        # a project created under a cached name is limited from then on
+        Project.objects.create(name="x0", user=self.user)
+        item = {"project": "x0", "channel": "c", "event": "e"}
+        self.assertEqual([self.log(item).status_code for _ in range(3)], [201, 201, 429])
+
+    def test_invalid_items(self):
+        # rejected items take no tokens
+        blank = {"project": "p", "channel": " ", "event": "e"}
+        self.assertEqual([self.log(blank).status_code for _ in range(3)], [400] * 3)
+        self.assertEqual(ratelimit.project_counts([blank, "x", {"project": "p"}]), {})
+        self.assertEqual(self.log({"project": "p", "channel": "c", "event": "e"}).status_code, 201)
+
+    def test_bounded(self):
+        limits = ratelimit.ProjectLimits(2, 60)
+        for name in ("p", "a", "b"):
+            limits.get(self.user.id, name)
+        self.assertFalse(limits.cached(self.user.id, ["p"]))
+        self.assertTrue(limits.cached(self.user.id, ["a", "b"]))
+        self.assertEqual(limits.get(self.user.id, "p"), 2)
+        self.assertIsNone(limits.get(self.user.id, "a"))
+
+
+class MetricsTests(APITestCase):
+    def metric(self, page: str, name: str) -> float:
+        for line in page.splitlines():
+            if line.startswith(name + " "):
+                return float(line.split()[1])
+        self.fail(f"{name} not rendered")
+
+    @override_settings(COPYCAT={"INGEST_MODE": "buffered"})
+    def test_flush_latency(self):
+        def write(batch):
+            if len(batch) == 1:
+                raise RuntimeError
+            time.sleep(0.02)
+
+        buffer = IngestBuffer(10, 2, 60, write)
+        # queued without put(), which would start the flusher thread
+        buffer._queue.extend(["a", "b", "c"])
+        with self.assertLogs("api.buffer", "ERROR"):
+            buffer.flush()
+        with mock.patch("api.buffer.get_buffer", return_value=buffer):
+            page = metrics.render()
+        self.assertEqual(self.metric(page, "copycat_ingest_buffer_flushed_total"), 2)
+        self.assertEqual(self.metric(page, "copycat_ingest_buffer_failed_total"), 1)
+        self.assertEqual(self.metric(page, "copycat_ingest_flushes_total"), 2)
+        total = self.metric(page, "copycat_ingest_flush_seconds_total")
+        longest = self.metric(page, "copycat_ingest_flush_seconds_max")
+        self.assertGreaterEqual(longest, 0.02)
+        self.assertGreaterEqual(total, longest)
+        self.assertLess(self.metric(page, "copycat_ingest_flush_seconds_last"), longest)
+        self.assertIn("# TYPE copycat_ingest_flush_seconds_total counter", page)
+        self.assertIn("# TYPE copycat_ingest_flush_seconds_max gauge", page)
+
+    def labelled(self, page: str, name: str, route: str, method: str, status: int) -> float:
+        labels = metrics.format_labels({"route": route, "method": method, "status": status})
+        try:
+            return self.metric(page, f"{name}{{{labels}}}")
+        except AssertionError:
+            # not rendered before the route's first request
+            return 0
+
+    def test_middleware(self):
+        series = (
+            ("copycat_request_duration_seconds_count", "api/sync/log/", "POST", 201),
+            ("copycat_sql_queries_total", "api/sync/log/", "POST", 201),
+            ("copycat_request_duration_seconds_count", "api/sync/log/<str:project>/", "GET", 200),
+            ("copycat_sql_queries_total", "api/sync/log/<str:project>/", "GET", 200),
+        )
+        def count(execute, sql, params, many, context):
+            queries[-1] += 1
+            return execute(sql, params, many, context)
+
+        # counted with a wrapper, the test client resets the query log per request
+        queries = []
+        before = self.client.get("/metrics").content.decode()
+        with connection.execute_wrapper(count):
+            queries.append(0)
+            self.log({"project": "p", "channel": "c", "event": "e"})
+            queries.append(0)
+            self.get("/api/sync/log/p/")
+        page = self.client.get("/metrics").content.decode()
+        deltas = [
+            self.labelled(page, *labels) - self.labelled(before, *labels) for labels in series
+        ]
+        self.assertEqual(deltas, [1, queries[0], 1, queries[1]])
+        self.assertGreater(min(queries), 0)
+        self.assertIn(
+            'copycat_span_duration_seconds_count{route="api/sync/log/",phase="write"}', page
+        )
+
+    def test_unbuffered(self):
+        self.assertNotIn("copycat_ingest_flush", self.client.get("/metrics").content.decode())
+
+
+class SerializerTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Channel.objects.filter(pk=self.channel.pk).update(sample_rate=0.25, dedup_window=10)
+        self.log(
+            [
+                {"project": "p", "channel": "c", "event": "e", "description": None},
+                {
+                    "project": "p",
+                    "channel": "c",
+                    "event": "ünïcode ✓ \u2028 \u2029",
+                    "description": 'quotes " \\ and\nnewlines',
+                    "icon": "🐈",
+                },
+            ]
+        )
+
+    def test_rows(self):
+        for model, serializer, fields, row in (
+            (Event, EventSerializer, EVENT_FIELDS, event_row),
+            (Project, ProjectSerializer, PROJECT_FIELDS, project_row),
+            (Channel, ChannelSerializer, CHANNEL_FIELDS, channel_row),
+        ):
+            queryset = model.objects.order_by("id")
+            self.assertEqual(
+                serialize_rows(queryset.values_list(*fields), row),
+                serializer(queryset, many=True).data,
+                model.__name__,
+            )
+
+    def test_renderer(self):
+        payloads = [
+            self.get("/api/sync/log/").json(),
+            self.get("/api/project/").json(),
+            self.get("/api/channel/").json(),
+            {"message": "x", "nested": [{"a": None, "b": True, "c": 0.1, "d": -3}, []]},
+            [1.5, 2.25, 0.0, -0.5, 123456789012, "\u2028", ""],
+            {"results": [], "next": None},
+        ]
+        for data in payloads:
+            self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data), data)
+        # indented output is JSONRenderer's own
+        self.assertEqual(
+            FastJSONRenderer().render(payloads[0], "application/json; indent=2"),
+            JSONRenderer().render(payloads[0], "application/json; indent=2"),
+        )
+
+    def test_renderer_exponents(self):
+        # orjson spells exponents differently, the numbers are the same
+        data = [1e16, 1e-5, 2.5e-7]
+        fast = FastJSONRenderer().render(data)
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data)))
+
+
+@override_settings(COPYCAT={"PURGE_CHUNK_SIZE": 10, "PURGE_PAUSE": 0})
+class DeleteTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.other = Channel.objects.create(name="d", project_id=self.project, user=self.user)
+        self.log(
+            [
+                {"project": "p", "channel": channel, "event": "e"}
+                for channel in ("c", "d")
+                for _ in range(45)
+            ]
+        )
+
+    def event_deletes(self, queries) -> list:
+        # chunks delete a range of ids, the cascade then finds nothing left
+        return [
+            query
+            for query in queries
+            if query["sql"].startswith('DELETE FROM "api_event"')
+            and '"api_event"."id" >=' in query["sql"]
+        ]
+
+    def test_project(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.project.delete()
+        # five chunks per channel, each in its own transaction
+        self.assertEqual(len(self.event_deletes(queries)), 10)
+        self.assertEqual(Event.objects.count(), 0)
+        self.assertFalse(Channel.objects.exists())
+        self.assertFalse(Project.objects.exists())
+
+    def test_channel(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.channel.delete()
+        self.assertEqual(len(self.event_deletes(queries)), 5)
+        project = Project.objects.get()
+        self.assertEqual(project.event_count, 45)
+        self.assertEqual(Event.objects.filter(channel_id=self.other).count(), 45)
+        self.assertEqual(list(Channel.objects.values_list("name", flat=True)), ["d"])
+
+    def test_helpers(self):
+        with mock.patch.object(
+            retention, "delete_events", wraps=retention.delete_events
+        ) as delete_events, CaptureQueriesContext(connection) as queries:
+            self.assertEqual(retention.delete_channel(self.other, chunk_size=20, pause=0), 45)
+        # one pass over the events, in chunks of the given size
+        self.assertEqual(delete_events.call_count, 1)
+        self.assertEqual(delete_events.call_args.kwargs, {"chunk_size": 20, "pause": 0})
+        self.assertEqual(len(self.event_deletes(queries)), 3)
+        self.assertEqual(Project.objects.get().event_count, 45)
+
+        with mock.patch.object(
+            retention, "delete_events", wraps=retention.delete_events
+        ) as delete_events:
+            self.assertEqual(retention.delete_project(self.project, chunk_size=20), 45)
+        self.assertEqual(delete_events.call_count, 1)
+        self.assertFalse(Event.objects.exists())
+
+    def test_delete_counts(self):
+        self.assertEqual(self.channel.delete()[1]["api.Event"], 45)
+        total, counts = self.project.delete()
+        self.assertEqual((counts["api.Event"], counts["api.Channel"]), (45, 1))
+        self.assertEqual(total, sum(counts.values()))
+
+
+class ProjectRangeTests(APITestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        Channel.objects.create(name="d", project_id=self.project, user=self.user)
+        self.log([{"project": "p", "channel": ch, "event": ch} for ch in ("c", "d", "c", "d")])
+        days = [datetime(2023, 1, day, tzinfo=dt_timezone.utc) for day in (1, 2, 3, 4)]
+        for pk, day in zip(Event.objects.order_by("id").values_list("id", flat=True), days):
+            Event.objects.filter(pk=pk).update(created_at=day)
+
+    def days(self, response) -> list:
+        self.assertEqual(response.status_code, 200, response.content)
+        return [event["created_at"][:10] for event in response.json()["results"]]
+
+    def test_sync(self):
+        path = "/api/sync/log/p/"
+        self.assertEqual(len(self.days(self.get(path))), 4)
+        self.assertEqual(
+            self.days(self.get(path + "?start=2023-01-02&end=2023-01-03")),
+            ["2023-01-02", "2023-01-03"],
+        )
+        self.assertEqual(self.days(self.get(path + "?end=2023-01-01T12:00:00Z")), ["2023-01-01"])
+        # a cursor pages within the range
+        first = self.get(path + "?start=2023-01-02&limit=1").json()
+        second = self.get(f"{path}?start=2023-01-02&limit=1&cursor={first['next']}")
+        self.assertEqual(self.days(second), ["2023-01-03"])
+        response = self.get(path + "?start=tomorrow")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"message": "Invalid start or end date."})
+
+    def test_async(self):
+        async def read(query):
+            response = await AsyncClient().get(
+                "/api/async/log/p/" + query, headers={"authorization": f"Token {self.token}"}
+            )
+            return response.status_code, response.json()
+
+        status_code, body = asyncio.run(read("?start=2023-01-03"))
+        self.assertEqual(status_code, 200)
+        self.assertEqual([event["event_name"] for event in body["results"]], ["c", "d"])
+        self.assertEqual(
+            asyncio.run(read("?end=2023-02-30")),
+            (400, {"message": "Invalid start or end date."}),
+        )
@@ -1,13 +1,49 @@
 from django.urls import include, path
 
+from .conf import get_setting
 from .views.project_view import ProjectAPIView
 from .views.channel_view import ChannelAPIView
+from .views.async_event_view import (
+    AsyncEventAPIView,
+    AsyncProjectChannelEventsView,
+    AsyncProjectEventsView,
+)
 from .views.event_view import EventAPIView, ProjectEventsView, ProjectChannelEventsView
+from .views.export_view import ProjectChannelExportView
+from .views.recent_view import AsyncRecentEventsView, RecentEventsView
+from .views.search_view import EventSearchView
+from .views.stats_view import ChannelStatsView
+from .views.tail_view import ProjectChannelTailView
+
+# the native async event views only pay off under the ASGI server
+if get_setting("ASYNC_VIEWS"):
+    event_views = [
+        AsyncEventAPIView,
+        AsyncProjectEventsView,
+        AsyncProjectChannelEventsView,
+        AsyncRecentEventsView,
+    ]
+else:
+    event_views = [EventAPIView, ProjectEventsView, ProjectChannelEventsView, RecentEventsView]
 
 urlpatterns = [
     path("project/", ProjectAPIView.as_view()),
     path("channel/", ChannelAPIView.as_view()),
-    path("log/", EventAPIView.as_view()),
-    path("log/<str:project>/", ProjectEventsView.as_view()),
-    path("log/<str:project>/<str:channel>/", ProjectChannelEventsView.as_view()),
+    path("log/", event_views[0].as_view()),
+    path("log/<str:project>/", event_views[1].as_view()),
+    path("log/<str:project>/<str:channel>/", event_views[2].as_view()),
+    path("log/<str:project>/<str:channel>/export/", ProjectChannelExportView.as_view()),
+    path("log/<str:project>/<str:channel>/tail/", ProjectChannelTailView.as_view()),
+    path("log/<str:project>/<str:channel>/recent/", event_views[3].as_view()),
+    path("search/", EventSearchView.as_view()),
+    path("stats/<str:project>/<str:channel>/", ChannelStatsView.as_view()),
+    # both implementations stay reachable for side by side comparison
+    path("sync/log/", EventAPIView.as_view()),
+    path("sync/log/<str:project>/", ProjectEventsView.as_view()),
+    path("sync/log/<str:project>/<str:channel>/", ProjectChannelEventsView.as_view()),
+    path("sync/log/<str:project>/<str:channel>/recent/", RecentEventsView.as_view()),
+    path("async/log/", AsyncEventAPIView.as_view()),
+    path("async/log/<str:project>/", AsyncProjectEventsView.as_view()),
+    path("async/log/<str:project>/<str:channel>/", AsyncProjectChannelEventsView.as_view()),
+    path("async/log/<str:project>/<str:channel>/recent/", AsyncRecentEventsView.as_view()),
 ]
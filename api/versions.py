@@ -0,0 +1,274 @@
+"""
+Copy Cat Versions
+=================
+
+Conditional GETs for the project, channel and event listings. Every write
+that changes what a listing returns raises the version of the projects
+and channels it touches and sets their changed_at, mostly within the
+UPDATE that already maintains their counters, so ingest runs no extra
+query. A project's version also moves with every change to its channels,
+so the versions of a user's projects cover all of the user's listings.
+
+A listing reads its channel's or project's version, or sums those of the
+user's projects, with one small query. It answers If-None-Match and
+If-Modified-Since with 304 before the listing query runs. ETags are
+compared first. Last-Modified has whole second precision, so it is only
+sent once the second of the last change is over; a later write then
+always falls into a later second.
+
+With RESPONSE_CACHE_MAX_BYTES set, rendered 200 responses are also kept in
+memory under the user, url, Accept header and ETag, so identical reads of
+unchanged data skip the listing even for clients without validators. A
+write changes the ETag, so stale entries are never served and age out.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from django.db.models import Count, F, Max, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.template.response import SimpleTemplateResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from .conf import get_setting
+from .models import Channel, Project
+
+# summary of a user's projects, which changes whenever any of their listings does
+USER_AGGREGATES = {
+    "count": Count("id"),
+    "version": Sum("version"),
+    "last": Max("id"),
+    "changed_at": Max("changed_at"),
+}
+
+
+def changed() -> dict:
+    """UPDATE arguments raising the version of projects or channels"""
+    return {"version": F("version") + 1, "changed_at": timezone.now()}
+
+
+def bump(model, pks) -> None:
+    """Raise the version of projects or channels
+
+    Args:
+        model: Project or Channel
+        pks: ids, or a queryset of ids
+    """
+    model.objects.filter(pk__in=pks).update(**changed())
+
+
+def conditional_get_enabled() -> bool:
+    return get_setting("CONDITIONAL_GET")
+
+
+def make_version(parts: tuple, changed_at) -> tuple:
+    # changed_at is part of the tag, so a save writing back a stale version
+    # still produces a new one
+    digest = hashlib.blake2b(repr((parts, changed_at)).encode(), digest_size=8).hexdigest()
+    return quote_etag(digest), changed_at
+
+
+def version_of(kind: str, pk: int, row) -> Optional[tuple]:
+    return None if row is None else make_version((kind, pk, row[0]), row[1])
+
+
+def versions(model, pk: int):
+    return model.objects.filter(pk=pk).values_list("version", "changed_at")
+
+
+def user_version_of(user_id: int, row: dict) -> tuple:
+    return make_version(
+        ("user", user_id, row["count"], row["version"], row["last"]), row["changed_at"]
+    )
+
+
+def channel_version(channel_id: int) -> Optional[tuple]:
+    """Validators of a channel's event listing
+
+    Returns:
+        Optional[tuple]: (etag, changed_at), None when conditional GETs are off
+    """
+    if not conditional_get_enabled():
+        return None
+    return version_of("channel", channel_id, versions(Channel, channel_id).first())
+
+
+def project_version(project_id: int) -> Optional[tuple]:
+    """Validators of a project's event listing, like channel_version"""
+    if not conditional_get_enabled():
+        return None
+    return version_of("project", project_id, versions(Project, project_id).first())
+
+
+def user_version(user_id: int) -> Optional[tuple]:
+    """Validators of a user's project, channel and event listings, like channel_version"""
+    if not conditional_get_enabled():
+        return None
+    row = Project.objects.filter(user=user_id).aggregate(**USER_AGGREGATES)
+    return user_version_of(user_id, row)
+
+
+async def achannel_version(channel_id: int) -> Optional[tuple]:
+    """Async version of channel_version"""
+    if not conditional_get_enabled():
+        return None
+    return version_of("channel", channel_id, await versions(Channel, channel_id).afirst())
+
+
+async def aproject_version(project_id: int) -> Optional[tuple]:
+    """Async version of project_version"""
+    if not conditional_get_enabled():
+        return None
+    return version_of("project", project_id, await versions(Project, project_id).afirst())
+
+
+async def auser_version(user_id: int) -> Optional[tuple]:
+    """Async version of user_version"""
+    if not conditional_get_enabled():
+        return None
+    row = await Project.objects.filter(user=user_id).aaggregate(**USER_AGGREGATES)
+    return user_version_of(user_id, row)
+
+
+class ResponseCache:
+    """Rendered responses by (user, url, accept, etag), bounded in total bytes"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        """Get the (content, content type) cached for a key"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key: tuple, content: bytes, content_type: str) -> None:
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[0])
+            self._entries[key] = (content, content_type)
+            self.bytes += len(content)
+            while self.bytes > self.max_bytes:
+                self.bytes -= len(self._entries.popitem(last=False)[1][0])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+response_cache = ResponseCache(get_setting("RESPONSE_CACHE_MAX_BYTES"))
+
+
+def cache_key(request, etag: str) -> tuple:
+    return request.user.id, request.get_full_path(), request.META.get("HTTP_ACCEPT", ""), etag
+
+
+def with_validators(response, version: tuple):
+    etag, changed_at = version
+    response["ETag"] = etag
+    if changed_at is not None and int(changed_at.timestamp()) < int(timezone.now().timestamp()):
+        response["Last-Modified"] = http_date(changed_at.timestamp())
+    # browsers revalidate on every read instead of guessing a freshness lifetime
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ("Accept", "Authorization"))
+    return response
+
+
+def cached_response(request, version: Optional[tuple]) -> Optional[HttpResponse]:
+    """Answer a listing without running it, when the client or the cache has it
+
+    Args:
+        request: incoming GET request
+        version (Optional[tuple]): (etag, changed_at) of the listing
+
+    Returns:
+        Optional[HttpResponse]: 304 when the client's copy is current, the cached
+        200, or None when the listing has to run
+    """
+    if version is None:
+        return None
+    etag, changed_at = version
+    last_modified = int(changed_at.timestamp()) if changed_at is not None else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return with_validators(response, version)
+    if response_cache.max_bytes:
+        cached = response_cache.get(cache_key(request, etag))
+        if cached is not None:
+            return with_validators(HttpResponse(cached[0], content_type=cached[1]), version)
+    return None
+
+
+def finish_response(request, response, version: Optional[tuple]):
+    """Add validators to a listing response and cache it once rendered
+
+    The version was read before the listing, so a write in between can only
+    make the cached content newer than its tag, never older.
+
+    Args:
+        request: incoming GET request
+        response: 200 response of the listing, DRF or plain Django
+        version (Optional[tuple]): (etag, changed_at) read before the listing ran
+
+    Returns:
+        the response
+    """
+    if version is None or response.status_code != 200:
+        return response
+    with_validators(response, version)
+    if response_cache.max_bytes:
+        key = cache_key(request, version[0])
+        if isinstance(response, SimpleTemplateResponse) and not response.is_rendered:
+            response.add_post_render_callback(
+                lambda rendered: response_cache.set(key, rendered.content, rendered["Content-Type"])
+            )
+        else:
+            response_cache.set(key, response.content, response["Content-Type"])
+    return response
+
+
+# saves and deletes outside of ingest change the listings too
+@receiver(post_save, sender=Project)
+def bump_saved_project(sender, instance: Project, created=False, **kwargs) -> None:
+    if not created:
+        bump(Project, [instance.id])
+
+
+@receiver(post_save, sender=Channel)
+def bump_saved_channel(sender, instance: Channel, created=False, **kwargs) -> None:
+    if not created:
+        bump(Channel, [instance.id])
+    bump(Project, [instance.project_id_id])
+
+
+@receiver(post_delete, sender=Channel)
+def bump_deleted_channel(sender, instance: Channel, **kwargs) -> None:
+    bump(Project, [instance.project_id_id])
@@ -0,0 +1,364 @@
+"""
+Native async versions of the event views for the ASGI server.
+
+Authentication, name resolution and buffered ingest are answered inside the
+event loop when the token and name caches are warm. Reads use Django's async
+ORM iteration. Direct writes hop to a thread once per request, because
+Django cannot run transactions from async code.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.exceptions import APIException, NotAuthenticated, ParseError
+
+from ..archive import ArchiveReader
+from ..authentication import CachedTokenAuthentication, authenticate_async
+from ..buffer import BufferFull, buffering_enabled
+from ..cache import lookup_channel, lookup_project, name_cache
+from ..conf import get_setting
+from ..ingest import (
+    build_event,
+    enqueue,
+    ingest_batch,
+    ingest_event,
+    queue_batch,
+    queue_event,
+    validate_item,
+)
+from ..metrics import span
+from ..models import Event
+from ..pagination import KeysetPagination
+from ..ratelimit import (
+    RateLimited,
+    acheck_ingest,
+    project_counts,
+    rate_limiting_enabled,
+    retry_after,
+)
+from ..idempotency import duplicate, idempotency_key
+from ..rules import EventSkipped, apply_rules, channel_rules
+from ..renderers import FastJSONRenderer
+from ..serializers import EVENT_FIELDS, EventSerializer, event_row, serialize_rows
+from ..versions import (
+    achannel_version,
+    aproject_version,
+    auser_version,
+    cached_response,
+    finish_response,
+)
+from .event_view import MAX_BATCH_SIZE, filter_created_at
+
+
+def json_response(data, status_code: int = status.HTTP_200_OK, headers=None) -> HttpResponse:
+    """Render data the same way the DRF views do
+
+    Args:
+        data: json serializable response body
+        status_code (int): http status code
+        headers (dict, optional): extra response headers
+
+    Returns:
+        HttpResponse: json response
+    """
+    return HttpResponse(
+        FastJSONRenderer().render(data),
+        content_type="application/json",
+        status=status_code,
+        headers=headers,
+    )
+
+
+def forbidden(detail: str = NotAuthenticated.default_detail) -> HttpResponse:
+    # 403 like the DRF views, whose first authenticator sends no WWW-Authenticate
+    return json_response({"detail": str(detail)}, status.HTTP_403_FORBIDDEN)
+
+
+def rate_limited(exc: RateLimited) -> HttpResponse:
+    return json_response(
+        {"message": "Rate limit exceeded, retry later."},
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        {"Retry-After": retry_after(exc)},
+    )
+
+
+async def channel_not_found(user_id: int, project_name: str) -> HttpResponse:
+    if await sync_to_async(lookup_project)(user_id, project_name) is None:
+        message = "Project name for user could not be found."
+    else:
+        message = "Channel name for project could not be found."
+    return json_response({"message": message}, status.HTTP_400_BAD_REQUEST)
+
+
+async def alookup_project(user_id: int, project_name: str):
+    ids = name_cache.get((user_id, project_name, None))
+    if ids is not None:
+        return ids[0]
+    return await sync_to_async(lookup_project)(user_id, project_name)
+
+
+async def alookup_channel(user_id: int, project_name: str, channel_name: str):
+    ids = name_cache.get((user_id, project_name, channel_name))
+    if ids is not None:
+        return ids
+    return await sync_to_async(lookup_channel)(user_id, project_name, channel_name)
+
+
+async def paginated_response(
+    events, request: HttpRequest, archive=None, version=None
+) -> HttpResponse:
+    paginator = KeysetPagination()
+    try:
+        with span("query"):
+            rows = await paginator.apaginate_queryset(
+                events, request, fields=EVENT_FIELDS, archive=archive
+            )
+    except ParseError as exc:
+        return json_response(exc.detail, status.HTTP_400_BAD_REQUEST)
+    with span("serialize"):
+        results = serialize_rows(rows, event_row)
+    return finish_response(
+        request, json_response({"next": paginator.next_cursor, "results": results}), version
+    )
+
+
+class AsyncAPIView(View):
+    """Base for the async views, authenticating like the DRF views do"""
+
+    authentication_classes = [
+        SessionAuthentication,
+        BasicAuthentication,
+        CachedTokenAuthentication,
+    ]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # like DRF views, csrf is only enforced for session authentication
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        try:
+            with span("auth"):
+                request.user = await authenticate_async(request, self.authentication_classes)
+        except APIException as exc:
+            return forbidden(exc.detail)
+        if request.user is None:
+            return forbidden()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncEventAPIView(AsyncAPIView):
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Get all events for a user
+
+        Args:
+            request (HttpRequest): incoming http request
+
+        Returns:
+            HttpResponse: page of user events and the next cursor
+        """
+        with span("lookup"):
+            version = await auser_version(request.user.id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+        events = Event.objects.filter(user=request.user.id)
+        archive = ArchiveReader(user_id=request.user.id)
+        return await paginated_response(events, request, archive, version)
+
+    async def post(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Post a log, or a list of logs as a batch
+
+        Args:
+            request (HttpRequest): incoming http request with a json body
+
+        Returns:
+            HttpResponse: http status code
+        """
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return json_response(
+                {"message": "Request body is not valid json."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        if isinstance(data, list):
+            return await self.post_batch(request, data)
+
+        # if any of the required field are empty
+        with span("validate"):
+            error = validate_item(data)
+        if error == "Required fields are empty.":
+            return json_response({"message": error})
+        if error:
+            return json_response({"message": error}, status.HTTP_400_BAD_REQUEST)
+
+        user_id = request.user.id
+        if rate_limiting_enabled():
+            try:
+                await acheck_ingest(user_id, project_counts([data]))
+            except RateLimited as exc:
+                return rate_limited(exc)
+
+        if buffering_enabled():
+            try:
+                skipped = duplicate(user_id, idempotency_key(data))
+                if skipped is not None:
+                    raise skipped
+                # a cached channel is queued without leaving the event loop
+                ids = name_cache.get((user_id, str(data["project"]), str(data["channel"])))
+                if ids is not None and channel_rules.cached([ids[1]]):
+                    event = build_event(user_id, ids, data)
+                    skipped = apply_rules([event])[0]
+                    if skipped is not None:
+                        raise skipped
+                    enqueue([event])
+                    queued = True
+                else:
+                    queued = await sync_to_async(queue_event)(user_id, data)
+            except EventSkipped as exc:
+                return json_response(exc.body(), exc.status)
+            except BufferFull:
+                return json_response(
+                    {"message": "Ingest buffer is full, retry later."},
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    {"Retry-After": str(get_setting("INGEST_RETRY_AFTER"))},
+                )
+            if not queued:
+                return json_response(
+                    {"message": "Project does not exist for user."},
+                    status.HTTP_400_BAD_REQUEST,
+                )
+            return json_response({"message": "Event queued."}, status.HTTP_202_ACCEPTED)
+
+        try:
+            event = await sync_to_async(ingest_event)(user_id, data)
+        except EventSkipped as exc:
+            return json_response(exc.body(), exc.status)
+        if event is None:
+            return json_response(
+                {"message": "Project does not exist for user."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        with span("serialize"):
+            data = EventSerializer(event).data
+        return json_response(data, status.HTTP_201_CREATED)
+
+    async def post_batch(self, request: HttpRequest, items: list) -> HttpResponse:
+        if len(items) == 0:
+            return json_response({"message": "Batch is empty."}, status.HTTP_400_BAD_REQUEST)
+        if len(items) > MAX_BATCH_SIZE:
+            return json_response(
+                {"message": f"Batch is larger than {MAX_BATCH_SIZE} events."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        # a batch is limited as a whole, it is either accepted or turned away
+        if rate_limiting_enabled():
+            try:
+                await acheck_ingest(request.user.id, project_counts(items))
+            except RateLimited as exc:
+                return rate_limited(exc)
+
+        if buffering_enabled():
+            try:
+                results = await sync_to_async(queue_batch)(request.user.id, items)
+            except BufferFull:
+                return json_response(
+                    {"message": "Ingest buffer is full, retry later."},
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    {"Retry-After": str(get_setting("INGEST_RETRY_AFTER"))},
+                )
+            queued = sum(1 for result in results if result["status"] == 202)
+            return json_response(
+                {"queued": queued, "results": results},
+                status.HTTP_202_ACCEPTED
+                if queued == len(results)
+                else status.HTTP_207_MULTI_STATUS,
+            )
+
+        results = await sync_to_async(ingest_batch)(request.user.id, items)
+        created = sum(1 for result in results if result["status"] == 201)
+        return json_response(
+            {"created": created, "results": results},
+            status.HTTP_201_CREATED
+            if created == len(results)
+            else status.HTTP_207_MULTI_STATUS,
+        )
+
+
+class AsyncProjectEventsView(AsyncAPIView):
+    """Events for a specific project"""
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Get all events for a project
+
+        Args:
+            request (HttpRequest): incoming http request, with optional start and end
+
+        Returns:
+            HttpResponse: page of project events and the next cursor
+        """
+        with span("lookup"):
+            project_id = await alookup_project(request.user.id, self.kwargs.get("project"))
+        if project_id is None:
+            return json_response(
+                {"message": "Project name for user could not be found."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        with span("lookup"):
+            version = await aproject_version(project_id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+        start = request.GET.get("start")
+        end = request.GET.get("end")
+        try:
+            archive = ArchiveReader(start=start, end=end, project_id=project_id)
+        except ParseError as exc:
+            return json_response(exc.detail, status.HTTP_400_BAD_REQUEST)
+        events = Event.objects.filter(user=request.user.id, project_id=project_id)
+        events = filter_created_at(events, start, end)
+        return await paginated_response(events, request, archive, version)
+
+
+class AsyncProjectChannelEventsView(AsyncAPIView):
+    """Events for a project's channel"""
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Get all events for a project's channel
+
+        Args:
+            request (HttpRequest): Incoming HTTP Request
+
+        Returns:
+            HttpResponse: page of events in a given project channel and the next cursor
+        """
+        project_name = self.kwargs.get("project")
+        with span("lookup"):
+            ids = await alookup_channel(
+                request.user.id, project_name, self.kwargs.get("channel")
+            )
+        if ids is None:
+            return await channel_not_found(request.user.id, project_name)
+
+        with span("lookup"):
+            version = await achannel_version(ids[1])
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+
+        start = request.GET.get("start")
+        end = request.GET.get("end")
+        try:
+            archive = ArchiveReader(ids[1], start, end)
+        except ParseError as exc:
+            return json_response(exc.detail, status.HTTP_400_BAD_REQUEST)
+        events = Event.objects.filter(user=request.user.id, channel_id=ids[1])
+        events = filter_created_at(events, start, end)
+        return await paginated_response(events, request, archive, version)
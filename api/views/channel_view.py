@@ -1,15 +1,14 @@
+from django.db import IntegrityError, transaction
 from rest_framework.request import Request
 from rest_framework import permissions, status
-from rest_framework.authentication import (
-    BasicAuthentication,
-    SessionAuthentication,
-    TokenAuthentication,
-)
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from ..authentication import CachedTokenAuthentication
 from ..models import Channel
-from ..serializers import ChannelSerializer
+from ..serializers import CHANNEL_FIELDS, ChannelSerializer, channel_row, serialize_rows
+from ..versions import cached_response, finish_response, user_version
 
 
 class ChannelAPIView(APIView):
@@ -17,7 +16,7 @@ class ChannelAPIView(APIView):
     authentication_classes = [
         SessionAuthentication,
         BasicAuthentication,
-        TokenAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [permissions.IsAuthenticated]
 
@@ -30,9 +29,15 @@ class ChannelAPIView(APIView):
         Returns:
             Response: user channels serialized in json
         """
-        channels = Channel.objects.filter(user=request.user.id)
-        serializer = ChannelSerializer(channels, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # unchanged channels are answered with 304 or from the response cache
+        version = user_version(request.user.id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+
+        channels = Channel.objects.filter(user=request.user.id).values_list(*CHANNEL_FIELDS)
+        response = Response(serialize_rows(channels, channel_row), status=status.HTTP_200_OK)
+        return finish_response(request, response, version)
 
     def post(self, request: Request, *args, **kwargs) -> Response:
         """Post channel for user
@@ -43,27 +48,26 @@ class ChannelAPIView(APIView):
         Returns:
             Response: http status code
         """
-        # check if channel name already exists for user in project
-        channels = Channel.objects.filter(
-            user=request.user.id,
-            name=request.data.get("name"),
-            project_id=request.data.get("project_id"),
-        )
-        if len(channels) > 0:
-            return Response(
-                {"message": "Channel name already exists for project."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
         data = {
             "project_id": request.data.get("project_id"),
             "name": request.data.get("name"),
             "user": request.user.id,
+            "retention_days": request.data.get("retention_days"),
+            "sample_rate": request.data.get("sample_rate"),
+            "dedup_window": request.data.get("dedup_window"),
         }
         # serialize and validate data
         serializer = ChannelSerializer(data=data)
         if serializer.is_valid():
-            serializer.save()
+            # the unique constraint rejects a channel name that already exists in project
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError:
+                return Response(
+                    {"message": "Channel name already exists for project."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -1,17 +1,125 @@
-from datetime import datetime
+from typing import Optional
 
+from django.db.models import QuerySet
+from django.utils import timezone
 from rest_framework import permissions, status
-from rest_framework.authentication import (
-    BasicAuthentication,
-    SessionAuthentication,
-    TokenAuthentication,
-)
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from ..models import Channel, Event, Project
-from ..serializers import ChannelSerializer, EventSerializer
+from ..archive import ArchiveReader, parse_bound
+from ..authentication import CachedTokenAuthentication
+from ..buffer import BufferFull, buffering_enabled
+from ..cache import lookup_channel, lookup_project
+from ..conf import get_setting
+from ..ingest import (
+    ingest_batch,
+    ingest_event,
+    queue_batch,
+    queue_event,
+    validate_item,
+)
+from ..metrics import span
+from ..models import Event
+from ..pagination import KeysetPagination
+from ..ratelimit import (
+    RateLimited,
+    check_ingest,
+    project_counts,
+    rate_limiting_enabled,
+    retry_after,
+)
+from ..rules import EventSkipped
+from ..serializers import EVENT_FIELDS, EventSerializer, event_row, serialize_rows
+from ..versions import (
+    cached_response,
+    channel_version,
+    finish_response,
+    project_version,
+    user_version,
+)
+
+# largest number of events accepted in a single batch POST
+MAX_BATCH_SIZE = 10000
+
+
+def filter_created_at(events: QuerySet, start: Optional[str], end: Optional[str]) -> QuerySet:
+    """Filter events to a created_at timeframe
+
+    Args:
+        events (QuerySet): events to filter
+        start (Optional[str]): earliest created_at, if any
+        end (Optional[str]): latest created_at, if any
+
+    Raises:
+        ParseError: start or end is not a date or datetime, a 400 in the views
+
+    Returns:
+        QuerySet: filtered events
+    """
+    # parsed here, so a malformed date is a 400 rather than an error in the query
+    start = parse_bound(start)
+    end = parse_bound(end)
+    # start = get from start, up to now if there is no end
+    if start:
+        events = events.filter(created_at__gte=start)
+        if not end:
+            events = events.filter(created_at__lte=timezone.now())
+    # end = get everything up until end
+    if end:
+        events = events.filter(created_at__lte=end)
+    return events
+
+
+def channel_not_found(user_id: int, project_name: str) -> Response:
+    """Error response for a project/channel pair that could not be resolved
+
+    Args:
+        user_id (int): id of the requesting user
+        project_name (str): name of the requested project
+
+    Returns:
+        Response: 400 naming whichever of the project or channel is missing
+    """
+    if lookup_project(user_id, project_name) is None:
+        return Response(
+            {"message": "Project name for user could not be found."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return Response(
+        {"message": "Channel name for project could not be found."},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+def buffer_full() -> Response:
+    """Error response for a full ingest buffer
+
+    Returns:
+        Response: 503 asking the client to retry later
+    """
+    return Response(
+        {"message": "Ingest buffer is full, retry later."},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(get_setting("INGEST_RETRY_AFTER"))},
+    )
+
+
+def rate_limited(exc: RateLimited) -> Response:
+    """Error response for a user or project over its ingest rate
+
+    Args:
+        exc (RateLimited): the failed check
+
+    Returns:
+        Response: 429 asking the client to retry once the bucket refilled
+    """
+    return Response(
+        {"message": "Rate limit exceeded, retry later."},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={"Retry-After": retry_after(exc)},
+    )
 
 
 class EventAPIView(APIView):
@@ -19,10 +127,14 @@ class EventAPIView(APIView):
     authentication_classes = [
         SessionAuthentication,
         BasicAuthentication,
-        TokenAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_authentication(self, request: Request) -> None:
+        with span("auth"):
+            super().perform_authentication(request)
+
     def get(self, request: Request, *args, **kwargs) -> Response:
         """Get all events for a user
 
@@ -32,12 +144,26 @@ class EventAPIView(APIView):
         Returns:
             Response: user channels serialized in json
         """
+        with span("lookup"):
+            version = user_version(request.user.id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+
         events = Event.objects.filter(user=request.user.id)
-        serializer = EventSerializer(events, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # archived segments of all the user's channels are merged with the hot rows
+        archive = ArchiveReader(user_id=request.user.id)
+        paginator = KeysetPagination()
+        with span("query"):
+            rows = paginator.paginate_queryset(
+                events, request, fields=EVENT_FIELDS, archive=archive
+            )
+        with span("serialize"):
+            results = serialize_rows(rows, event_row)
+        return finish_response(request, paginator.get_paginated_response(results), version)
 
     def post(self, request: Request, *args, **kwargs) -> Response:
-        """Post a log
+        """Post a log, or a list of logs as a batch
 
         Args:
             request (Request): incoming http request
@@ -45,64 +171,101 @@ class EventAPIView(APIView):
         Returns:
             Response: http status code
         """
+        if isinstance(request.data, list):
+            return self.post_batch(request)
+
         # if any of the required field are empty
-        if (
-            request.data.get("project") is None
-            or request.data.get("channel") is None
-            or request.data.get("event") is None
-        ):
-            return Response({"message": "Required fields are empty."})
+        with span("validate"):
+            error = validate_item(request.data)
+        if error == "Required fields are empty.":
+            return Response({"message": error})
+        if error:
+            return Response({"message": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        if rate_limiting_enabled():
+            try:
+                check_ingest(request.user.id, project_counts([request.data]))
+            except RateLimited as exc:
+                return rate_limited(exc)
+
+        # buffered mode queues the event and answers before it is written
+        if buffering_enabled():
+            try:
+                queued = queue_event(request.user.id, request.data)
+            except BufferFull:
+                return buffer_full()
+            except EventSkipped as exc:
+                return Response(exc.body(), status=exc.status)
+            if not queued:
+                return Response(
+                    {"message": "Project does not exist for user."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            return Response({"message": "Event queued."}, status=status.HTTP_202_ACCEPTED)
+
+        # resolve project and channel, creating the channel if it does not exist
+        try:
+            event = ingest_event(request.user.id, request.data)
+        except EventSkipped as exc:
+            return Response(exc.body(), status=exc.status)
         # if the project does not exist for user, throw err
-        projects = Project.objects.filter(
-            user=request.user.id, name=request.data.get("project")
-        )
-        if len(projects) == 0:
+        if event is None:
             return Response(
                 {"message": "Project does not exist for user."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        # get project id from projects query
-        project_id = projects.values("id")[0]["id"]
 
-        # if the channel does not exist, create the channel
-        channels = Channel.objects.filter(
-            user=request.user.id, name=request.data.get("channel")
+        with span("serialize"):
+            data = EventSerializer(event).data
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def post_batch(self, request: Request) -> Response:
+        """Post a list of logs in one transaction
+
+        Args:
+            request (Request): incoming http request with a list body
+
+        Returns:
+            Response: per item results, 201 if every item was created and 207 otherwise
+        """
+        if len(request.data) == 0:
+            return Response(
+                {"message": "Batch is empty."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(request.data) > MAX_BATCH_SIZE:
+            return Response(
+                {"message": f"Batch is larger than {MAX_BATCH_SIZE} events."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # a batch is limited as a whole, it is either accepted or turned away
+        if rate_limiting_enabled():
+            try:
+                check_ingest(request.user.id, project_counts(request.data))
+            except RateLimited as exc:
+                return rate_limited(exc)
+
+        if buffering_enabled():
+            try:
+                results = queue_batch(request.user.id, request.data)
+            except BufferFull:
+                return buffer_full()
+            queued = sum(1 for result in results if result["status"] == 202)
+            return Response(
+                {"queued": queued, "results": results},
+                status=status.HTTP_202_ACCEPTED
+                if queued == len(results)
+                else status.HTTP_207_MULTI_STATUS,
+            )
+
+        results = ingest_batch(request.user.id, request.data)
+        created = sum(1 for result in results if result["status"] == 201)
+        return Response(
+            {"created": created, "results": results},
+            status=status.HTTP_201_CREATED
+            if created == len(results)
+            else status.HTTP_207_MULTI_STATUS,
         )
-        if len(channels) == 0:
-            channel_data = {
-                "project_id": project_id,
-                "name": request.data.get("channel"),
-                "user": request.user.id,
-            }
-            channel_serializer = ChannelSerializer(data=channel_data)
-            if not channel_serializer.is_valid():
-                return Response(
-                    {
-                        "message": "Server error when saving new channel.",
-                        "serializer_errors": channel_serializer.errors,
-                    },
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
-            channel_serializer.save()
-        channel_id = Channel.objects.filter(
-            user=request.user.id, name=request.data.get("channel")
-        ).values("id")[0]["id"]
-
-        # post log to db
-        data = {
-            "project_id": project_id,
-            "channel_id": channel_id,
-            "event_name": request.data.get("event"),
-            "description": request.data.get("description"),
-            "icon": request.data.get("icon"),
-            "user": request.user.id,
-        }
-        serializer = EventSerializer(data=data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 class ProjectEventsView(APIView):
@@ -112,15 +275,19 @@ class ProjectEventsView(APIView):
     authentication_classes = [
         SessionAuthentication,
         BasicAuthentication,
-        TokenAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_authentication(self, request: Request) -> None:
+        with span("auth"):
+            super().perform_authentication(request)
+
     def get(self, request, *args, **kwargs) -> Response:
         """Get all events for a project
 
         Args:
-            request (Request): incoming http request
+            request (Request): incoming http request, with optional start and end
 
         Returns:
             Response: user channels serialized in json
@@ -128,20 +295,37 @@ class ProjectEventsView(APIView):
         # using project name, query for project
         project_name = self.kwargs.get("project")
 
-        projects = Project.objects.filter(user=request.user.id, name=project_name)
-
-        if len(projects) == 0:
+        with span("lookup"):
+            project_id = lookup_project(request.user.id, project_name)
+        if project_id is None:
             return Response(
                 {"message": "Project name for user could not be found."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        # use project id to get events for that project
-        project_id = projects.values("id")[0]["id"]
 
+        # unchanged pages are answered with 304 or from the response cache
+        with span("lookup"):
+            version = project_version(project_id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+
+        # use project id to get events for that project, within the optional
+        # start and end like the channel listing
+        start = request.query_params.get("start")
+        end = request.query_params.get("end")
         events = Event.objects.filter(user=request.user.id, project_id=project_id)
-        serializer = EventSerializer(events, many=True)
+        archive = ArchiveReader(start=start, end=end, project_id=project_id)
+        events = filter_created_at(events, start, end)
+        paginator = KeysetPagination()
+        with span("query"):
+            rows = paginator.paginate_queryset(
+                events, request, fields=EVENT_FIELDS, archive=archive
+            )
+        with span("serialize"):
+            results = serialize_rows(rows, event_row)
 
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return finish_response(request, paginator.get_paginated_response(results), version)
 
 
 class ProjectChannelEventsView(APIView):
@@ -151,10 +335,14 @@ class ProjectChannelEventsView(APIView):
     authentication_classes = [
         SessionAuthentication,
         BasicAuthentication,
-        TokenAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [permissions.IsAuthenticated]
 
+    def perform_authentication(self, request: Request) -> None:
+        with span("auth"):
+            super().perform_authentication(request)
+
     def get(self, request: Request, *args, **kwargs) -> Response:
         """Get all events for a project's channel
 
@@ -162,66 +350,42 @@ class ProjectChannelEventsView(APIView):
             request (Request): Incoming HTTP Request
 
         Returns:
-            Response: List of all events in a given project channel
+            Response: page of events in a given project channel and the next cursor
         """
         # using project name, query for project
         project_name = self.kwargs.get("project")
+        channel_name = self.kwargs.get("channel")
 
-        projects = Project.objects.filter(user=request.user.id, name=project_name)
+        with span("lookup"):
+            ids = lookup_channel(request.user.id, project_name, channel_name)
+        if ids is None:
+            return channel_not_found(request.user.id, project_name)
+        channel_id = ids[1]
 
-        if len(projects) == 0:
-            return Response(
-                {"message": "Project name for user could not be found."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        # using the channel name, query for channel
-        channel_name = self.kwargs.get("channel")
+        # unchanged pages are answered with 304 or from the response cache
+        with span("lookup"):
+            version = channel_version(channel_id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
 
-        channels = Channel.objects.filter(user=request.user.id, name=channel_name)
-        if len(channels) == 0:
-            return Response(
-                {"message": "Channel name for project could not be found."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-        # use project id to get events for that project
-        project_id = projects.values("id")[0]["id"]
-        channel_id = channels.values("id")[0]["id"]
+        # the channel implies the project, so filter on the columns of the
+        # (user, channel, created_at) index and let the paginator walk it in order
+        events = Event.objects.filter(user=request.user.id, channel_id=channel_id)
 
         # get the start and end date if it exists
         start = request.query_params.get("start")
         end = request.query_params.get("end")
-
-        # start and end = get between timeframe
-        if start and end:
-            events = Event.objects.filter(
-                user=request.user.id,
-                project_id=project_id,
-                channel_id=channel_id,
-                created_at__gte=start,
-                created_at__lte=end,
-            )
-        # start and no end = get beginning to now
-        elif start and not end:
-            events = Event.objects.filter(
-                user=request.user.id,
-                project_id=project_id,
-                channel_id=channel_id,
-                created_at__gte=start,
-                created_at__lte=datetime.now().isoformat(),
-            )
-        # no start and end = get everything up until end
-        elif not start and end:
-            events = Event.objects.filter(
-                user=request.user.id,
-                project_id=project_id,
-                channel_id=channel_id,
-                created_at__lte=end,
-            )
-        # no start and no end = get all
-        else:
-            events = Event.objects.filter(
-                user=request.user.id, project_id=project_id, channel_id=channel_id
+        # archived segments in the range are merged with the hot rows. the
+        # reader also rejects malformed dates before they reach the filter
+        archive = ArchiveReader(channel_id, start, end)
+        events = filter_created_at(events, start, end)
+        paginator = KeysetPagination()
+        with span("query"):
+            rows = paginator.paginate_queryset(
+                events, request, fields=EVENT_FIELDS, archive=archive
             )
-        serializer = EventSerializer(events, many=True)
+        with span("serialize"):
+            results = serialize_rows(rows, event_row)
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return finish_response(request, paginator.get_paginated_response(results), version)
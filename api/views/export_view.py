@@ -0,0 +1,76 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import permissions
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.request import Request
+from rest_framework.views import APIView
+
+from ..archive import ArchiveReader
+from ..authentication import CachedTokenAuthentication
+from ..cache import lookup_channel
+from ..export import astream, csv_stream, gzip_stream, ndjson_stream
+from ..models import Event
+from ..renderers import CSVRenderer, NDJSONRenderer
+from .event_view import channel_not_found, filter_created_at
+
+
+class ProjectChannelExportView(APIView):
+    """Streaming export of a project's channel"""
+
+    # check if user is auth
+    authentication_classes = [
+        SessionAuthentication,
+        BasicAuthentication,
+        CachedTokenAuthentication,
+    ]
+    permission_classes = [permissions.IsAuthenticated]
+    # ?format=ndjson|csv picks the renderer, ndjson by default
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get(self, request: Request, *args, **kwargs) -> StreamingHttpResponse:
+        """Export all events for a project's channel
+
+        Args:
+            request (Request): Incoming HTTP Request, with optional start, end and gzip
+
+        Returns:
+            StreamingHttpResponse: hot and archived events as ndjson or csv,
+            optionally gzipped
+        """
+        project_name = self.kwargs.get("project")
+        channel_name = self.kwargs.get("channel")
+
+        # a malformed start or end is a 400 before the lookup runs
+        events = filter_created_at(
+            Event.objects.filter(user=request.user.id),
+            request.query_params.get("start"),
+            request.query_params.get("end"),
+        )
+        ids = lookup_channel(request.user.id, project_name, channel_name)
+        if ids is None:
+            return channel_not_found(request.user.id, project_name)
+
+        events = events.filter(channel_id=ids[1])
+        archive = ArchiveReader(
+            ids[1], request.query_params.get("start"), request.query_params.get("end")
+        )
+
+        renderer = request.accepted_renderer
+        if renderer.format == "csv":
+            stream = csv_stream(events, archive=archive)
+        else:
+            stream = ndjson_stream(events, archive=archive)
+        filename = f"{project_name}-{channel_name}.{renderer.format}"
+        content_type = f"{renderer.media_type}; charset={renderer.charset}"
+
+        if request.query_params.get("gzip") in ("1", "true"):
+            stream = gzip_stream(stream)
+            filename += ".gz"
+            content_type = "application/gzip"
+
+        # the ASGI handler would read a sync stream into memory before sending it
+        if isinstance(request._request, ASGIRequest):
+            stream = astream(stream)
+        response = StreamingHttpResponse(stream, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,11 @@
+from django.http import HttpRequest, HttpResponse
+from django.views import View
+
+from ..metrics import CONTENT_TYPE, render
+
+
+class MetricsView(View):
+    """Prometheus scrape target for the metrics of this process"""
+
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -1,15 +1,14 @@
+from django.db import IntegrityError, transaction
 from rest_framework.request import Request
 from rest_framework import permissions, status
-from rest_framework.authentication import (
-    BasicAuthentication,
-    SessionAuthentication,
-    TokenAuthentication,
-)
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from ..authentication import CachedTokenAuthentication
 from ..models import Project
-from ..serializers import ProjectSerializer
+from ..serializers import PROJECT_FIELDS, ProjectSerializer, project_row, serialize_rows
+from ..versions import cached_response, finish_response, user_version
 
 
 class ProjectAPIView(APIView):
@@ -17,7 +16,7 @@ class ProjectAPIView(APIView):
     authentication_classes = [
         SessionAuthentication,
         BasicAuthentication,
-        TokenAuthentication,
+        CachedTokenAuthentication,
     ]
     permission_classes = [permissions.IsAuthenticated]
 
@@ -30,9 +29,15 @@ class ProjectAPIView(APIView):
         Returns:
             Response: user projects serialized in json
         """
-        projects = Project.objects.filter(user=request.user.id)
-        serializer = ProjectSerializer(projects, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # unchanged projects are answered with 304 or from the response cache
+        version = user_version(request.user.id)
+        cached = cached_response(request, version)
+        if cached is not None:
+            return cached
+
+        projects = Project.objects.filter(user=request.user.id).values_list(*PROJECT_FIELDS)
+        response = Response(serialize_rows(projects, project_row), status=status.HTTP_200_OK)
+        return finish_response(request, response, version)
 
     def post(self, request: Request, *args, **kwargs) -> Response:
         """Post project for user
@@ -43,22 +48,24 @@ class ProjectAPIView(APIView):
         Returns:
             Response: http status code
         """
-        # check if project name already exists for user
-        projects = Project.objects.filter(user=request.user.id, name=request.data.get("name"))
-        if len(projects) > 0:
-            return Response(
-                {"message": "Project name already exists for user."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-
         data = {
             "name": request.data.get("name"),
             "user": request.user.id,
+            "retention_days": request.data.get("retention_days"),
+            "rate_limit": request.data.get("rate_limit"),
         }
         # serialize and validate data
         serializer = ProjectSerializer(data=data)
         if serializer.is_valid():
-            serializer.save()
+            # the unique constraint rejects a project name that already exists for user
+            try:
+                with transaction.atomic():
+                    serializer.save()
+            except IntegrityError:
+                return Response(
+                    {"message": "Project name already exists for user."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,116 @@
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.http import HttpRequest, HttpResponse
+from rest_framework import permissions, status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..authentication import CachedTokenAuthentication
+from ..cache import lookup_channel
+from ..conf import get_setting
+from ..metrics import span
+from ..recent import recent_events, render_recent
+from .async_event_view import AsyncAPIView, alookup_channel, json_response
+from .async_event_view import channel_not_found as achannel_not_found
+from .event_view import channel_not_found
+
+# events returned when n is not given
+DEFAULT_COUNT = 50
+
+
+def parse_count(value: Optional[str]) -> Optional[int]:
+    """Read the n query parameter, capped at the ring size
+
+    Returns:
+        Optional[int]: number of events, or None if n is not a positive integer
+    """
+    if value in (None, ""):
+        return min(DEFAULT_COUNT, get_setting("RECENT_EVENTS_SIZE"))
+    try:
+        count = int(value)
+    except ValueError:
+        return None
+    if count < 1:
+        return None
+    return min(count, get_setting("RECENT_EVENTS_SIZE"))
+
+
+def recent_response(events: list) -> HttpResponse:
+    return HttpResponse(render_recent(events), content_type="application/json")
+
+
+class RecentEventsView(APIView):
+    """Newest events of a project's channel, answered from memory, see api/recent.py"""
+
+    # check if user is auth
+    authentication_classes = [
+        SessionAuthentication,
+        BasicAuthentication,
+        CachedTokenAuthentication,
+    ]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_authentication(self, request: Request) -> None:
+        with span("auth"):
+            super().perform_authentication(request)
+
+    def get(self, request: Request, *args, **kwargs) -> HttpResponse:
+        """Get the newest events of a project's channel
+
+        Args:
+            request (Request): Incoming HTTP Request, with optional n
+
+        Returns:
+            HttpResponse: up to n events, oldest first
+        """
+        project_name = self.kwargs.get("project")
+        with span("lookup"):
+            ids = lookup_channel(request.user.id, project_name, self.kwargs.get("channel"))
+        if ids is None:
+            return channel_not_found(request.user.id, project_name)
+
+        count = parse_count(request.query_params.get("n"))
+        if count is None:
+            return Response(
+                {"message": "n must be a positive integer."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        with span("query"):
+            events = recent_events.read(request.user.id, ids[1], count)
+        return recent_response(events)
+
+
+class AsyncRecentEventsView(AsyncAPIView):
+    """Newest events of a project's channel, answered inside the event loop once cached"""
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Get the newest events of a project's channel
+
+        Args:
+            request (HttpRequest): Incoming HTTP Request, with optional n
+
+        Returns:
+            HttpResponse: up to n events, oldest first
+        """
+        project_name = self.kwargs.get("project")
+        with span("lookup"):
+            ids = await alookup_channel(
+                request.user.id, project_name, self.kwargs.get("channel")
+            )
+        if ids is None:
+            return await achannel_not_found(request.user.id, project_name)
+
+        count = parse_count(request.GET.get("n"))
+        if count is None:
+            return json_response(
+                {"message": "n must be a positive integer."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+        with span("query"):
+            events = recent_events.get(ids[1], count)
+            if events is None:
+                events = await sync_to_async(recent_events.read)(request.user.id, ids[1], count)
+        return recent_response(events)
@@ -0,0 +1,103 @@
+from rest_framework import permissions, status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..archive import ArchiveReader
+from ..authentication import CachedTokenAuthentication
+from ..cache import lookup_channel, lookup_project
+from ..conf import get_setting
+from ..models import Event
+from ..search import search_events, supported
+from ..serializers import EVENT_FIELDS, event_row, serialize_rows
+from .event_view import channel_not_found, filter_created_at
+
+
+class EventSearchView(APIView):
+    """Full text search over a user's events"""
+
+    # check if user is auth
+    authentication_classes = [
+        SessionAuthentication,
+        BasicAuthentication,
+        CachedTokenAuthentication,
+    ]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        """Search event names and descriptions
+
+        Args:
+            request (Request): Incoming HTTP Request, with q and optional project,
+                channel, start, end, limit and offset
+
+        Returns:
+            Response: matching events, best match first, the next offset and the
+            number of archived events in scope, which search does not cover
+        """
+        if not supported():
+            return Response(
+                {"message": "Search is not available on this database."},
+                status=status.HTTP_501_NOT_IMPLEMENTED,
+            )
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                {"message": "Search query is empty."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            limit = int(request.query_params.get("limit", get_setting("PAGE_SIZE")))
+            offset = int(request.query_params.get("offset", 0))
+        except ValueError:
+            return Response(
+                {"message": "Limit and offset must be integers."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if limit < 1 or offset < 0:
+            return Response(
+                {"message": "Limit must be positive and offset not negative."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = min(limit, get_setting("MAX_PAGE_SIZE"))
+
+        # a malformed start or end is a 400 before any lookup runs
+        start = request.query_params.get("start")
+        end = request.query_params.get("end")
+        events = filter_created_at(Event.objects.filter(user=request.user.id), start, end)
+        archive = ArchiveReader(start=start, end=end, user_id=request.user.id)
+        project_name = request.query_params.get("project")
+        channel_name = request.query_params.get("channel")
+        if project_name and channel_name:
+            ids = lookup_channel(request.user.id, project_name, channel_name)
+            if ids is None:
+                return channel_not_found(request.user.id, project_name)
+            events = events.filter(channel_id=ids[1])
+            archive = ArchiveReader(ids[1], start, end)
+        elif project_name:
+            project_id = lookup_project(request.user.id, project_name)
+            if project_id is None:
+                return Response(
+                    {"message": "Project name for user could not be found."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            events = events.filter(project_id=project_id)
+            archive = ArchiveReader(start=start, end=end, project_id=project_id)
+
+        # fetch one extra row to know whether there is a next page
+        rows = list(
+            search_events(events, query).values_list(*EVENT_FIELDS)[
+                offset : offset + limit + 1
+            ]
+        )
+        next_offset = offset + limit if len(rows) > limit else None
+        return Response(
+            {
+                "next": next_offset,
+                "results": serialize_rows(rows[:limit], event_row),
+                # the index only covers the hot table, archived events are not searched
+                "archived": archive.count(),
+            },
+            status=status.HTTP_200_OK,
+        )
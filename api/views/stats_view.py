@@ -0,0 +1,62 @@
+from rest_framework import permissions, status
+from rest_framework.authentication import BasicAuthentication, SessionAuthentication
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from ..archive import parse_bound
+from ..authentication import CachedTokenAuthentication
+from ..cache import lookup_channel
+from ..models import EventRollup
+from .event_view import channel_not_found
+
+
+class ChannelStatsView(APIView):
+    """Event counts of a project's channel per time bucket"""
+
+    # check if user is auth
+    authentication_classes = [
+        SessionAuthentication,
+        BasicAuthentication,
+        CachedTokenAuthentication,
+    ]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        """Get event counts for a project's channel
+
+        Args:
+            request (Request): Incoming HTTP Request, with optional bucket, start and end
+
+        Returns:
+            Response: event count per bucket start, oldest first
+        """
+        bucket = request.query_params.get("bucket", EventRollup.HOUR)
+        if bucket not in EventRollup.BUCKETS:
+            return Response(
+                {"message": "Bucket must be one of minute, hour or day."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # a malformed start or end raises ParseError, a 400
+        start = parse_bound(request.query_params.get("start"))
+        end = parse_bound(request.query_params.get("end"))
+
+        project_name = self.kwargs.get("project")
+        ids = lookup_channel(request.user.id, project_name, self.kwargs.get("channel"))
+        if ids is None:
+            return channel_not_found(request.user.id, project_name)
+
+        rollups = EventRollup.objects.filter(channel_id=ids[1], bucket=bucket)
+        if start:
+            rollups = rollups.filter(bucket_start__gte=start)
+        if end:
+            rollups = rollups.filter(bucket_start__lte=end)
+
+        counts = [
+            {"bucket_start": bucket_start, "count": count}
+            for bucket_start, count in rollups.order_by("bucket_start").values_list(
+                "bucket_start", "count"
+            )
+        ]
+        return Response({"bucket": bucket, "results": counts}, status=status.HTTP_200_OK)
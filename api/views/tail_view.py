@@ -0,0 +1,143 @@
+import time
+from typing import Optional
+
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from rest_framework import status
+
+from ..conf import get_setting
+from ..models import Event
+from ..notifier import notifier
+from ..renderers import FastJSONRenderer
+from ..serializers import EVENT_FIELDS, event_row, serialize_rows
+from .async_event_view import (
+    AsyncAPIView,
+    alookup_channel,
+    channel_not_found,
+    json_response,
+)
+
+# seconds between database re-checks, and between keepalives on an sse stream
+HEARTBEAT = 15
+MAX_POLL_TIMEOUT = 60
+# seconds an sse stream stays open, the client then reconnects with Last-Event-ID
+MAX_STREAM_SECONDS = 600
+
+
+class ProjectChannelTailView(AsyncAPIView):
+    """Live tail of a project's channel, as a long-poll or server-sent events
+
+    Waiting requests sleep on the in process notifier, so hundreds of open
+    tails cost a database query per wake up or heartbeat rather than a
+    polling loop each.
+    """
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        """Get events newer than since_id for a project's channel
+
+        Args:
+            request (HttpRequest): Incoming HTTP Request, with optional since_id,
+                mode (poll or sse), timeout and limit
+
+        Returns:
+            HttpResponse: new events once there are any, or an empty list on timeout
+        """
+        user = request.user
+        project_name = self.kwargs.get("project")
+        ids = await alookup_channel(user.id, project_name, self.kwargs.get("channel"))
+        if ids is None:
+            return await channel_not_found(user.id, project_name)
+
+        try:
+            since_id = self.get_int(
+                request.GET.get("since_id") or request.headers.get("Last-Event-ID")
+            )
+            timeout = self.get_int(request.GET.get("timeout"))
+            timeout = 25 if timeout is None else min(timeout, MAX_POLL_TIMEOUT)
+            limit = self.get_int(request.GET.get("limit"))
+            limit = get_setting("PAGE_SIZE") if limit is None else limit
+            limit = min(limit, get_setting("MAX_PAGE_SIZE"))
+            if limit < 1 or timeout < 0:
+                raise ValueError()
+        except ValueError:
+            return json_response(
+                {"message": "since_id, timeout and limit must be integers."},
+                status.HTTP_400_BAD_REQUEST,
+            )
+
+        events = Event.objects.filter(user=user.id, channel_id=ids[1])
+        # without since_id the tail starts at the newest event
+        if since_id is None:
+            latest = await events.aaggregate(latest=Max("id"))
+            since_id = latest["latest"] or 0
+
+        if request.GET.get("mode") == "sse":
+            if not isinstance(request, ASGIRequest):
+                return json_response(
+                    {"message": "Server-sent events need the ASGI server."},
+                    status.HTTP_400_BAD_REQUEST,
+                )
+            response = StreamingHttpResponse(
+                self.stream(events, ids[1], since_id, limit),
+                content_type="text/event-stream",
+            )
+            response["Cache-Control"] = "no-cache"
+            response["X-Accel-Buffering"] = "no"
+            return response
+
+        announced = notifier.latest(ids[1])
+        rows = await self.fetch(events, since_id, limit)
+        waited = 0
+        while not rows and waited < timeout:
+            wait = min(HEARTBEAT, timeout - waited)
+            # everything announced before the fetch was already committed, so
+            # only a newer announcement can bring new rows
+            await notifier.wait(ids[1], max(since_id, announced), wait)
+            waited += wait
+            announced = notifier.latest(ids[1])
+            rows = await self.fetch(events, since_id, limit)
+
+        results = serialize_rows(rows, event_row)
+        last_id = results[-1]["id"] if results else since_id
+        return json_response({"last_id": last_id, "results": results})
+
+    async def stream(self, events, channel_id: int, since_id: int, limit: int):
+        """Yield server-sent events for every new event on the channel
+
+        The stream ends after MAX_STREAM_SECONDS, and the client picks up
+        where it left off by reconnecting with the last id it received.
+
+        Args:
+            events (QuerySet): events of the channel
+            channel_id (int): channel to wait on
+            since_id (int): id of the newest event the client has seen
+            limit (int): events fetched per query
+        """
+        renderer = FastJSONRenderer()
+        yield b"retry: 1000\n\n"
+        deadline = time.monotonic() + MAX_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            announced = notifier.latest(channel_id)
+            rows = await self.fetch(events, since_id, limit)
+            if rows:
+                for event in serialize_rows(rows, event_row):
+                    since_id = event["id"]
+                    yield b"id: %d\nevent: log\ndata: %s\n\n" % (
+                        since_id,
+                        renderer.render(event),
+                    )
+                continue
+            wait = min(HEARTBEAT, remaining)
+            if not await notifier.wait(channel_id, max(since_id, announced), wait):
+                yield b": keepalive\n\n"
+
+    async def fetch(self, events, since_id: int, limit: int) -> list:
+        rows = events.filter(id__gt=since_id).order_by("id").values_list(*EVENT_FIELDS)
+        return [row async for row in rows[:limit]]
+
+    def get_int(self, value: Optional[str]) -> Optional[int]:
+        return None if value in (None, "") else int(value)
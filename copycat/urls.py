@@ -17,9 +17,12 @@ from django.contrib import admin
 from django.urls import include, path
 from rest_framework.authtoken.views import obtain_auth_token
 
+from api.views.metrics_view import MetricsView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
     path("auth/", include("rest_framework.urls")),
     path("token/", obtain_auth_token),
+    path("metrics", MetricsView.as_view()),
 ]